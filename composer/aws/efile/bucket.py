@@ -1,5 +1,33 @@
-from composer.aws.handshake import Handshake
-from composer.aws.s3 import Bucket
+from typing import Optional, TYPE_CHECKING
+
+from composer.aws.s3 import Bucket, LocalBucket
+
+if TYPE_CHECKING:
+    from composer.aws.handshake import Handshake
+
+# Local mirror of the IRS bucket that this process reads in its place, if one was chosen with use_local_source
+_local_source: Optional[LocalBucket] = None
+
+# Resolved credentials for the IRS bucket, if it is not to be read with the default ones; see use_credentials
+_credentials: Optional["Handshake"] = None
+
+def use_local_source(source: Optional[LocalBucket]) -> None:
+    """Reads e-file indices and filings from a local mirror of the IRS bucket, rather than from S3, in this process.
+    Pool workers must be told separately; see init_efile_worker."""
+    global _local_source
+    _local_source = source
+
+def use_credentials(handshake: Optional["Handshake"]) -> Optional["Handshake"]:
+    """Reads the IRS bucket with the S3 credentials of the given handshake in this process, and returns a clone of it
+    with the credentials already resolved. The clone can be handed to pool workers (see init_efile_worker), so that
+    the secrets are fetched from SSM once per run rather than once per process."""
+    global _credentials
+    _credentials = None if handshake is None else handshake.clone()
+    return _credentials
 
 def efile_bucket() -> Bucket:
+    if _local_source is not None:
+        return _local_source
+    if _credentials is not None:
+        return Bucket.build_authenticated(_credentials, "irs-form-990")
     return Bucket.build("irs-form-990")
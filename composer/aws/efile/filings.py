@@ -4,36 +4,88 @@ import os
 import random
 import shutil
 import string
-from typing import Iterator, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional, Set
 
-from botocore.exceptions import ClientError
-
-from composer.aws.efile.bucket import efile_bucket
-from composer.aws.s3 import Tuple, Dict, Iterable, Bucket
+from composer.aws.efile.bucket import efile_bucket, use_credentials, use_local_source
+from composer.aws.inventory import BucketInventory
+from composer.aws.s3 import Tuple, Dict, Iterable, Bucket, LocalBucket
+from composer.efile.conversions import ConversionCache
+from composer.efile.structures.ledger import RunLedger, DOWNLOADED, CONVERTED
 from composer.efile.structures.metadata import FilingMetadata
-from functools import lru_cache
+from composer.efile.structures.plan import ChangePlan, read_plan, temporary_plan
+from composer.efile.structures.quarantine import ItemFailure, exclude_failed, flatten_failures
+from composer.fileio.atomic import AtomicBatchWriter
+from composer.fileio.layout import EINLayout, DEFAULT_LAYOUT
+from composer.fileio.paths import EINPathManager
+from composer.futures import ItemTimeout, pool_workers_count, run_on_process_pool, run_on_thread_pool, time_limit
+from composer import tracing
+from composer.metrics import Histogram, MetricsRegistry, registry
+
+if TYPE_CHECKING:
+    from composer.aws.handshake import Handshake
+    from composer.efile.xmlio import JsonTranslator
+
+# Time allowed to convert a single filing before it is moved to the slow lane
+CONVERT_TIMEOUT: float = 120.0
+
+# The slow lane converts overrunning filings one at a time on a few workers, with a much longer limit. Filings that
+# overrun even that are quarantined.
+SLOW_LANE_TIMEOUT: float = 1800.0
+SLOW_LANE_WORKERS: int = 2
+
+# Filings with more XML than this are converted in the memory-budgeted lane
+HUGE_XML_BYTES: int = 16 * 1024 * 1024
+
+# Peak memory used to convert a filing, per byte of its XML: the cleaned copies of the text, the lxml tree and the
+# resulting dictionaries. Measured at 11-13 on filings of 1.5-6 MB.
+MEMORY_PER_XML_BYTE: int = 12
+
+# Memory that the huge-filing lane may use at once
+CONVERT_MEMORY_BUDGET: int = 4 * 1024 * 1024 * 1024
+
+# Filings prefetched during the index pass are downloaded in waves of this many, each on one thread
+PREFETCH_WAVE: int = 64
+
+# With a staging budget, downloads proceed in waves of this many EINs, checking the budget before each wave
+DOWNLOAD_WAVE_EINS: int = 256
+
+XML_TEMPLATE: str = "%s_public.xml"
+JSON_TEMPLATE: str = "%s.json"
 
-from composer.efile.xmlio import JsonTranslator
-from composer.futures import run_on_process_pool, run_on_thread_pool
 
+@dataclass
+class FetchOutcome:
+    """Result of fetching a batch of changes. Deferred changes were not downloaded because the staging area reached
+    its budget; they should be fetched again once the rest of the batch has been composed and discarded."""
+    failures: List[ItemFailure] = field(default_factory=list)
+    deferred: List[Tuple[str, Dict[str, FilingMetadata]]] = field(default_factory=list)
 
-@lru_cache(maxsize=4194304)
-def _ein_path(basepath: str, ein: str) -> str:
-    first, second = ein[0:3], ein[3:6]
-    ein_path: str = os.path.join(basepath, first, second)
-    os.makedirs(ein_path, exist_ok=True)
-    return ein_path
 
-def _get_download_targets(changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]], target_path: str) \
-        -> Iterator[Tuple[str, str]]:
+def _get_download_targets(changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]], xml_paths: EINPathManager) \
+        -> Iterator[Tuple[str, str, str]]:
     for ein, updates in changes:
-        ein_path = _ein_path(target_path, ein)
+        ein_path = xml_paths.ensure_directory_for(ein)
         for filing_md in updates.values():
             irs_efile_id: str = filing_md.irs_efile_id
-            yield ein_path, irs_efile_id
+            yield ein, ein_path, irs_efile_id
 
 
-# TODO Add lots of timing to this once it's working
+def json_path_for(json_paths: EINPathManager, ein: str, irs_efile_id: str) -> str:
+    return os.path.join(json_paths.directory_for(ein), JSON_TEMPLATE % irs_efile_id)
+
+
+def _directory_bytes(path: str) -> int:
+    total: int = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except FileNotFoundError:
+                pass
+    return total
+
 
 def _tmpdir(tmp_base) -> str:
     while True:
@@ -45,81 +97,545 @@ def _tmpdir(tmp_base) -> str:
 
 class RetrieveEfiles:
     """Download any new e-files as XML from S3 and store them in a temporary directory. Convert them to JSON files, also
-    stored in a temporary directory. Yield a map of EIN -> (map of period -> JSON file path)."""
+    stored in a temporary directory. Yield a map of EIN -> (map of period -> JSON file path).
+
+    Persistent staging directories survive an interrupted run so that it can be resumed, and are only removed by an
+    explicit call to cleanup().
+
+    With use_plan, each stage writes its changes to a memory-mapped ChangePlan in the XML staging directory and hands
+    pool workers ranges of plan positions instead of pickled change lists.
+
+    Each filing's conversion is limited to convert_timeout seconds, so one pathological filing cannot hold up its
+    chunk; filings that overrun are converted afterward in a slow lane. Huge filings are converted in their own lane,
+    within convert_memory_budget.
+
+    Staged files are removed as soon as they are no longer needed: XML once converted, and JSON once the caller
+    discards its batch. With a staging_budget (in bytes), downloads stop when the staging area holds that much, and
+    the rest of the batch is deferred until space has been freed.
+
+    With an inventory of the bucket, filings that are not in it fail without a request, and the rest are downloaded
+    largest first, in chunks balanced by size.
+
+    With a conversion_cache, filings whose XML was already converted by the current converter are copied from the
+    cache rather than converted again, and every new conversion is added to it."""
 
-    def __init__(self, tmp_base: str = "/tmp", no_cleanup: bool = False):
+    def __init__(self, tmp_base: str = "/tmp", no_cleanup: bool = False, layout: EINLayout = DEFAULT_LAYOUT,
+                 persistent: bool = False, use_plan: bool = False, convert_timeout: Optional[float] = CONVERT_TIMEOUT,
+                 convert_memory_budget: int = CONVERT_MEMORY_BUDGET, staging_budget: Optional[int] = None,
+                 inventory: Optional[BucketInventory] = None, conversion_cache: Optional[ConversionCache] = None):
         self.xml_cache_dir: str = _tmpdir(tmp_base)  # Official temp directory package makes things too hard
         self.json_cache_dir: str = _tmpdir(tmp_base)
+        self.layout: EINLayout = layout
+        self.xml_paths: EINPathManager = EINPathManager(self.xml_cache_dir, layout)
+        self.json_paths: EINPathManager = EINPathManager(self.json_cache_dir, layout)
         self.no_cleanup: bool = no_cleanup
+        self.persistent: bool = persistent
+        self.use_plan: bool = use_plan
+        self.convert_timeout: Optional[float] = convert_timeout
+        self.convert_memory_budget: int = convert_memory_budget
+        self.staging_budget: Optional[int] = staging_budget
+        self.staged_bytes: int = 0
+        self.inventory: Optional[BucketInventory] = inventory
+        self.conversion_cache: Optional[ConversionCache] = conversion_cache
 
-    def _get_json_tuples(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]) \
+    def resume_from(self, xml_cache_dir: str, json_cache_dir: str):
+        """Adopts the staging directories of an interrupted run in place of the fresh ones."""
+        self.cleanup()
+        self.xml_cache_dir = xml_cache_dir
+        self.json_cache_dir = json_cache_dir
+        self.xml_paths = EINPathManager(xml_cache_dir, self.layout)
+        self.json_paths = EINPathManager(json_cache_dir, self.layout)
+        if self.staging_budget is not None:
+            self.staged_bytes = _directory_bytes(xml_cache_dir) + _directory_bytes(json_cache_dir)
+
+    def json_tuples(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]) \
             -> Iterator[Tuple[str, Dict[str, str]]]:
         for ein, updates in changes:
-            ein_path = _ein_path(self.json_cache_dir, ein)
+            self.json_paths.ensure_directory_for(ein)
             json_paths: Dict[str, str] = {}
             for period, filing_md in updates.items():
-                irs_efile_id: str = filing_md.irs_efile_id
-                json_paths[period] = os.path.join(ein_path, "%s.json" % irs_efile_id)
+                json_paths[period] = json_path_for(self.json_paths, ein, filing_md.irs_efile_id)
             yield ein, json_paths
 
-    def _convert_all(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]):
-        """Convert all XML files into JSON files. CPU-bound, so process pool."""
+    @staticmethod
+    def _staged_bytes_of(paths: EINPathManager, template: str, ein: str, irs_efile_ids: Iterable[str]) -> int:
+        ein_path: str = paths.directory_for(ein)
+        total: int = 0
+        for irs_efile_id in irs_efile_ids:
+            try:
+                total += os.path.getsize(os.path.join(ein_path, template % irs_efile_id))
+            except FileNotFoundError:
+                pass
+        return total
+
+    def _xml_bytes_of(self, ein: str, irs_efile_ids: Iterable[str]) -> int:
+        return self._staged_bytes_of(self.xml_paths, XML_TEMPLATE, ein, irs_efile_ids)
+
+    def _remove_staged(self, paths: EINPathManager, template: str,
+                       changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]) -> None:
+        """Removes the staged file of each filing, keeping the staging usage up to date. Directories are left in place
+        so that path managers' record of existing directories stays valid."""
+        if self.no_cleanup:
+            return
+        for ein, updates in changes:
+            ein_path: str = paths.directory_for(ein)
+            for filing_md in updates.values():
+                path: str = os.path.join(ein_path, template % filing_md.irs_efile_id)
+                try:
+                    if self.staging_budget is not None:
+                        self.staged_bytes -= os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def discard(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]) -> None:
+        """Removes the staged files of a batch that has been composed."""
+        change_list: List[Tuple[str, Dict[str, FilingMetadata]]] = list(changes)
+        self._remove_staged(self.xml_paths, XML_TEMPLATE, change_list)
+        self._remove_staged(self.json_paths, JSON_TEMPLATE, change_list)
+
+    @property
+    def over_budget(self) -> bool:
+        return self.staging_budget is not None and self.staged_bytes >= self.staging_budget
+
+    def _download_within_budget(self, changes: List[Tuple[str, Dict[str, FilingMetadata]]]) -> FetchOutcome:
+        """Downloads changes in waves until the staging area reaches its budget, deferring the rest. At least one wave
+        is always downloaded, so every batch makes progress."""
+        if self.staging_budget is None:
+            return FetchOutcome(self._download_all(changes))
+        outcome: FetchOutcome = FetchOutcome()
+        for start in range(0, len(changes), DOWNLOAD_WAVE_EINS):
+            if start > 0 and self.over_budget:
+                outcome.deferred = changes[start:]
+                logging.info("Staging area holds {:,} bytes against a budget of {:,}; deferring {:,} EINs."
+                             .format(self.staged_bytes, self.staging_budget, len(outcome.deferred)))
+                break
+            wave: List[Tuple[str, Dict[str, FilingMetadata]]] = changes[start:start + DOWNLOAD_WAVE_EINS]
+            outcome.failures += self._download_all(wave)
+            self.staged_bytes += sum(self._xml_bytes(change) for change in wave)
+        return outcome
+
+    def _xml_bytes(self, change: Tuple[str, Dict[str, FilingMetadata]]) -> int:
+        """Estimates the cost of converting an EIN's new filings as the total size of their XML."""
+        ein, updates = change
+        return self._xml_bytes_of(ein, (filing_md.irs_efile_id for filing_md in updates.values()))
+
+    def _planned_xml_bytes(self, plan: ChangePlan, index: int) -> int:
+        ein, updates = next(plan.changes([index]))
+        return self._xml_bytes_of(ein, updates.values())
+
+    def _split_by_size(self, changes: List[Tuple[str, Dict[str, FilingMetadata]]]) \
+            -> Tuple[List[Tuple[str, Dict[str, FilingMetadata]]], List[Tuple[str, Dict[str, FilingMetadata]]], int]:
+        """Separates filings whose XML exceeds HUGE_XML_BYTES from the rest. Returns the small changes, the huge
+        changes, and the size of the largest huge filing."""
+        small: List[Tuple[str, Dict[str, FilingMetadata]]] = []
+        huge: List[Tuple[str, Dict[str, FilingMetadata]]] = []
+        largest: int = 0
+        for ein, updates in changes:
+            small_updates: Dict[str, FilingMetadata] = {}
+            huge_updates: Dict[str, FilingMetadata] = {}
+            for period, filing_md in updates.items():
+                size: int = self._xml_bytes_of(ein, [filing_md.irs_efile_id])
+                if size > HUGE_XML_BYTES:
+                    huge_updates[period] = filing_md
+                    largest = max(largest, size)
+                else:
+                    small_updates[period] = filing_md
+            if len(small_updates) > 0:
+                small.append((ein, small_updates))
+            if len(huge_updates) > 0:
+                huge.append((ein, huge_updates))
+        return small, huge, largest
+
+    def _budgeted_workers(self, largest: int) -> int:
+        """Number of filings no larger than the given size that can be converted at once within the memory budget."""
+        return max(1, self.convert_memory_budget // max(largest * MEMORY_PER_XML_BYTE, 1))
+
+    def _convert_all(self, changes: List[Tuple[str, Dict[str, FilingMetadata]]]) -> List[ItemFailure]:
+        """Convert all XML files into JSON files. CPU-bound, so process pool.
+
+        Filings with more than HUGE_XML_BYTES of XML are converted in a separate lane, concurrently with the rest, on
+        only as many workers as convert_memory_budget allows; the remaining workers keep converting small filings.
+        Peak memory for the stage is therefore bounded by the budget plus HUGE_XML_BYTES * MEMORY_PER_XML_BYTE per
+        small-filing worker. Filings that overrun the time limit in either lane are retried in the slow lane."""
         logging.info("Converting XML to JSON.")
-        run_on_process_pool(_xml_to_json, list(changes), self.xml_cache_dir, self.json_cache_dir)
+        small, huge, largest = self._split_by_size(changes)
+        if len(huge) == 0:
+            failures: List[ItemFailure] = self._convert_small(small, None)
+            return self._convert_slow_lane(changes, failures)
+
+        n_huge: int = sum(len(updates) for _, updates in huge)
+        total_workers: int = pool_workers_count()
+        huge_workers: int = min(self._budgeted_workers(largest), n_huge, max(total_workers - 1, 1))
+        if largest * MEMORY_PER_XML_BYTE > self.convert_memory_budget:
+            logging.warning("The largest filing ({:,} bytes of XML) may alone exceed the conversion memory budget."
+                            .format(largest))
+        logging.info("Converting {:,} filings over {:,} bytes on {} worker(s).".format(n_huge, HUGE_XML_BYTES,
+                                                                                     huge_workers))
+        with ThreadPoolExecutor(max_workers=1) as lane:
+            huge_future: Future = lane.submit(run_on_process_pool, _xml_to_json, huge, self.xml_paths,
+                                              self.json_paths, self.convert_timeout, self.conversion_cache,
+                                              chunk_size=1, workers_count=huge_workers, max_in_flight=huge_workers,
+                                              cost=self._xml_bytes, largest_first=True, label="convert (huge)")
+            failures = self._convert_small(small, max(total_workers - huge_workers, 1))
+            failures += flatten_failures(huge_future.result())
+        return self._convert_slow_lane(changes, failures)
+
+    def _convert_small(self, changes: List[Tuple[str, Dict[str, FilingMetadata]]], workers: Optional[int]) \
+            -> List[ItemFailure]:
+        """Converts filings on the given number of workers, or on the whole pool if None. Chunks are balanced by XML
+        size, and the largest filings are dispatched first so they do not end up at the tail of the stage. Conversion
+        is idempotent, so straggling chunks are re-dispatched speculatively."""
+        if self.use_plan:
+            with temporary_plan(self.xml_cache_dir, changes) as plan:
+                return flatten_failures(run_on_process_pool(
+                    _xml_to_json_planned, range(len(plan)), plan.path, self.xml_paths, self.json_paths,
+                    self.convert_timeout, self.conversion_cache,
+                    cost=lambda index: self._planned_xml_bytes(plan, index), largest_first=True, workers_count=workers, max_in_flight=workers, speculate=True, label="convert"))
+        return flatten_failures(run_on_process_pool(
+            _xml_to_json, changes, self.xml_paths, self.json_paths, self.convert_timeout, self.conversion_cache,
+            cost=self._xml_bytes, largest_first=True, workers_count=workers, max_in_flight=workers, speculate=True,
+            label="convert"))
 
-    def _download_all(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]):
+    def _convert_slow_lane(self, changes: List[Tuple[str, Dict[str, FilingMetadata]]],
+                           failures: List[ItemFailure]) -> List[ItemFailure]:
+        """Converts the filings that overran the time limit, one per chunk and with limited concurrency, and returns
+        the stage's remaining failures."""
+        overran: Set[str] = {failure.irs_efile_id for failure in failures if failure.timed_out}
+        if len(overran) == 0:
+            return failures
+        logging.info("{:,} filings overran the conversion time limit; converting them in the slow lane."
+                     .format(len(overran)))
+        slow: List[Tuple[str, Dict[str, FilingMetadata]]] = []
+        largest: int = 0
+        for ein, updates in changes:
+            selected: Dict[str, FilingMetadata] = {period: filing_md for period, filing_md in updates.items()
+                                                   if filing_md.irs_efile_id in overran}
+            if len(selected) > 0:
+                slow.append((ein, selected))
+                largest = max(largest, self._xml_bytes_of(ein, [f.irs_efile_id for f in selected.values()]))
+        slow_workers: int = min(SLOW_LANE_WORKERS, self._budgeted_workers(largest))
+        slow_failures: List[ItemFailure] = flatten_failures(run_on_process_pool(
+            _xml_to_json, slow, self.xml_paths, self.json_paths, SLOW_LANE_TIMEOUT, self.conversion_cache,
+            chunk_size=1, workers_count=slow_workers, max_in_flight=slow_workers, label="convert (slow lane)"))
+        return [failure for failure in failures if not failure.timed_out] + slow_failures
+
+    def _missing_from_inventory(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]) -> List[ItemFailure]:
+        """Fails each filing whose XML is not in the inventory, so that it is never requested."""
+        if self.inventory is None:
+            return []
+        failures: List[ItemFailure] = []
+        for ein, updates in changes:
+            for filing_md in updates.values():
+                s3_key: str = XML_TEMPLATE % filing_md.irs_efile_id
+                if s3_key not in self.inventory:
+                    failures.append(ItemFailure(DOWNLOADED, ein, filing_md.irs_efile_id,
+                                                "%s is not in the bucket inventory" % s3_key, ""))
+        if len(failures) > 0:
+            logging.warning("{:,} filings are not in the bucket inventory; skipping them.".format(len(failures)))
+            registry().counter("download_missing_total", "Filings absent from the bucket inventory").inc(len(failures))
+        return failures
+
+    def _inventory_size(self, irs_efile_id: str) -> int:
+        return self.inventory.size(XML_TEMPLATE % irs_efile_id) or 0
+
+    def _download_all(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]) -> List[ItemFailure]:
         """Download all XML files to local storage. I/O-bound, so thread pool."""
         logging.info("Downloading new XML files.")
-        targets: List[Tuple[str, str]] = list(_get_download_targets(changes, self.xml_cache_dir))
-        run_on_process_pool(_download_xml_on_process, targets)
+        change_list: List[Tuple[str, Dict[str, FilingMetadata]]] = list(changes)
+        missing: List[ItemFailure] = self._missing_from_inventory(change_list)
+        change_list = exclude_failed(change_list, missing)
+        if self.use_plan:
+            with temporary_plan(self.xml_cache_dir, change_list) as plan:
+                plan_cost: Optional[Callable[[int], int]] = None
+                if self.inventory is not None:
+                    ein_sizes: List[int] = [sum(self._inventory_size(irs_efile_id) for _, _, irs_efile_id
+                                                in plan.filings([index])) for index in range(len(plan))]
+                    plan_cost = ein_sizes.__getitem__
+                return missing + flatten_failures(run_on_process_pool(
+                    _download_planned_on_process, range(len(plan)), plan.path, self.xml_paths, cost=plan_cost,
+                    largest_first=plan_cost is not None, label="download"))
+        targets: List[Tuple[str, str, str]] = list(_get_download_targets(change_list, self.xml_paths))
+        cost: Optional[Callable[[Tuple[str, str, str]], int]] = None
+        if self.inventory is not None:
+            sizes: Dict[str, int] = {irs_efile_id: self._inventory_size(irs_efile_id) for _, _, irs_efile_id in targets}
+            cost = lambda target: sizes[target[2]]
+        return missing + flatten_failures(run_on_process_pool(_download_xml_on_process, targets, cost=cost,
+                                                              largest_first=cost is not None, label="download"))
         # run_on_thread_pool(_download_xml_on_thread, targets, self.bucket, workers_count=os.cpu_count()*10)
 
-    def __call__(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]) \
+    def fetch(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]], ledger: Optional[RunLedger] = None) \
+            -> FetchOutcome:
+        """Downloads and converts the new filings, returning the failure of each filing that could not be processed and
+        any EINs deferred by the staging budget. A filing that fails a stage is left out of the later stages, and its
+        XML is removed once converted.
+
+        If a run ledger is supplied, filings that already completed a stage in an earlier attempt skip that stage, and
+        each stage is recorded in the ledger as it completes."""
+        change_list: List[Tuple[str, Dict[str, FilingMetadata]]] = list(changes)
+
+        to_download: List = change_list if ledger is None else ledger.pending(change_list, DOWNLOADED)
+        outcome: FetchOutcome = self._download_within_budget(to_download)
+        if len(outcome.deferred) > 0:
+            deferred_eins: Set[str] = {ein for ein, _ in outcome.deferred}
+            outcome.deferred = [change for change in change_list if change[0] in deferred_eins]
+            change_list = [change for change in change_list if change[0] not in deferred_eins]
+            to_download = [change for change in to_download if change[0] not in deferred_eins]
+        if ledger is not None:
+            ledger.mark_changes(exclude_failed(to_download, outcome.failures), DOWNLOADED)
+
+        change_list = exclude_failed(change_list, outcome.failures)
+        to_convert: List = change_list if ledger is None else ledger.pending(change_list, CONVERTED)
+        convert_failures: List[ItemFailure] = self._convert_all(to_convert)
+        converted: List[Tuple[str, Dict[str, FilingMetadata]]] = exclude_failed(to_convert, convert_failures)
+        if ledger is not None:
+            ledger.mark_changes(converted, CONVERTED)
+        if self.staging_budget is not None:
+            self.staged_bytes += sum(self._staged_bytes_of(self.json_paths, JSON_TEMPLATE, ein,
+                                                           (f.irs_efile_id for f in updates.values()))
+                                     for ein, updates in converted)
+        self._remove_staged(self.xml_paths, XML_TEMPLATE, converted)
+        outcome.failures += convert_failures
+        return outcome
+
+    def __call__(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]], ledger: Optional[RunLedger] = None) \
             -> Iterator[Tuple[str, Dict[str, str]]]:
-        self._download_all(changes)
-        self._convert_all(changes)
-        yield from self._get_json_tuples(changes)
+        """Yields JSON paths for the filings that were fetched successfully. Changes deferred by the staging budget are
+        fetched in turn, but as nothing is discarded here, the budget cannot be enforced."""
+        change_list: List[Tuple[str, Dict[str, FilingMetadata]]] = list(changes)
+        while len(change_list) > 0:
+            outcome: FetchOutcome = self.fetch(change_list, ledger)
+            deferred_eins: Set[str] = {ein for ein, _ in outcome.deferred}
+            fetched: List = [change for change in change_list if change[0] not in deferred_eins]
+            yield from self.json_tuples(exclude_failed(fetched, outcome.failures))
+            change_list = outcome.deferred
 
-    def __del__(self):
+    def cleanup(self):
         if not self.no_cleanup:
             shutil.rmtree(self.xml_cache_dir, ignore_errors=True)
             shutil.rmtree(self.json_cache_dir, ignore_errors=True)
 
+    def __del__(self):
+        if not self.persistent:
+            self.cleanup()
+
     @staticmethod
     def get_bucket() -> Bucket:
         return efile_bucket()
 
-def _download_xml_on_process(targets: List[Tuple[str, str]]):
-    bucket = RetrieveEfiles.get_bucket()
-    run_on_thread_pool(_download_xml_on_thread, targets, bucket, workers_count=os.cpu_count()*10)
+class Prefetcher:
+    """Downloads filings into a retriever's XML staging directory in the background, so that downloads can start while
+    the e-file indices are still being read. Filings are submitted as they are first staged as changes, and the partial
+    wave is flushed at the end of each year's index, so a year's downloads are under way while the next year is being
+    fetched and parsed. Once the index pass is over, finish() keeps the prefetched filings that are still changes and removes the XML of any that were
+    superseded in the meantime.
+
+    Prefetching is best-effort: a filing that fails to download is simply downloaded again by the retrieval stage. If
+    the retriever has a staging budget, prefetching stops once it is reached."""
+
+    def __init__(self, retrieve: RetrieveEfiles, wave_size: int = PREFETCH_WAVE,
+                 workers_count: Optional[int] = None):
+        self.retrieve: RetrieveEfiles = retrieve
+        self.wave_size: int = wave_size
+        self.bucket: Bucket = retrieve.get_bucket()
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers_count or os.cpu_count() * 10)
+        self.submitted: Dict[str, FilingMetadata] = {}
+        self.wave: List[FilingMetadata] = []
+        self.in_flight: List[Tuple[Future, List[FilingMetadata]]] = []
+        self.failed: Dict[str, ItemFailure] = {}
+
+    def submit(self, filing: FilingMetadata) -> None:
+        if filing.irs_efile_id in self.submitted or self.retrieve.over_budget:
+            return
+        # Left for the retrieval stage to fail without a request
+        inventory: Optional[BucketInventory] = self.retrieve.inventory
+        if inventory is not None and XML_TEMPLATE % filing.irs_efile_id not in inventory:
+            return
+        self.submitted[filing.irs_efile_id] = filing
+        self.wave.append(filing)
+        if len(self.wave) >= self.wave_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Starts downloading the filings submitted since the last wave, even if they fall short of a full wave."""
+        self._reap(wait=False)
+        if len(self.wave) == 0:
+            return
+        targets: List[Tuple[str, str, str]] = [(f.ein, self.retrieve.xml_paths.ensure_directory_for(f.ein),
+                                                f.irs_efile_id) for f in self.wave]
+        self.in_flight.append((self.executor.submit(_download_xml_on_thread, targets, self.bucket), self.wave))
+        self.wave = []
+
+    def _reap(self, wait: bool) -> None:
+        """Collects the failures of completed waves and counts their downloads toward the staging budget."""
+        remaining: List[Tuple[Future, List[FilingMetadata]]] = []
+        for future, wave in self.in_flight:
+            if not wait and not future.done():
+                remaining.append((future, wave))
+                continue
+            for failure in future.result():
+                self.failed[failure.irs_efile_id] = failure
+            if self.retrieve.staging_budget is not None:
+                self.retrieve.staged_bytes += sum(self.retrieve._xml_bytes_of(f.ein, [f.irs_efile_id]) for f in wave
+                                                  if f.irs_efile_id not in self.failed)
+        self.in_flight = remaining
+
+    def _remove(self, filing: FilingMetadata) -> None:
+        path: str = os.path.join(self.retrieve.xml_paths.directory_for(filing.ein), XML_TEMPLATE % filing.irs_efile_id)
+        try:
+            if self.retrieve.staging_budget is not None:
+                self.retrieve.staged_bytes -= os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def finish(self, keep: Callable[[FilingMetadata], bool]) -> List[FilingMetadata]:
+        """Waits for outstanding downloads and returns the prefetched filings for which keep() is true. The XML of the
+        rest is removed."""
+        self.flush()
+        self._reap(wait=True)
+        self.executor.shutdown()
+        kept: List[FilingMetadata] = []
+        n_superseded: int = 0
+        for irs_efile_id, filing in self.submitted.items():
+            if irs_efile_id in self.failed:
+                continue
+            if keep(filing):
+                kept.append(filing)
+            else:
+                self._remove(filing)
+                n_superseded += 1
+        logging.info("Prefetched {:,} filings during the index pass; discarded {:,} that were superseded and {:,} that "
+                     "failed.".format(len(kept), n_superseded, len(self.failed)))
+        return kept
+
+# Per-process state for pool workers. Built by init_efile_worker when a worker starts, or lazily on first use.
+_worker_bucket: Optional[Bucket] = None
+_worker_translator: Optional["JsonTranslator"] = None
+
+def _get_worker_bucket() -> Bucket:
+    global _worker_bucket
+    if _worker_bucket is None:
+        _worker_bucket = RetrieveEfiles.get_bucket()
+    return _worker_bucket
+
+def _get_worker_translator() -> "JsonTranslator":
+    # lxml and xmljson are imported only by processes that convert filings
+    from composer.efile.xmlio import JsonTranslator
+    global _worker_translator
+    if _worker_translator is None:
+        _worker_translator = JsonTranslator()
+    return _worker_translator
+
+def init_efile_worker(source: Optional[LocalBucket] = None, credentials: Optional["Handshake"] = None):
+    """Pool initializer that builds the S3 client and XML translator once per worker process. With a source, workers
+    read filings from that local mirror of the IRS bucket instead. With credentials, resolved in the parent by
+    use_credentials, workers read the bucket with them, and never call SSM themselves."""
+    if source is not None:
+        use_local_source(source)
+    if credentials is not None:
+        use_credentials(credentials)
+    _get_worker_bucket()
+    _get_worker_translator()
 
+# Modules worth importing once in a forkserver, before any worker is forked
+EFILE_WORKER_PRELOAD: List[str] = ["composer.aws.efile.filings", "composer.efile.compose", "boto3", "lxml.etree",
+                                   "xmljson"]
 
-def _download_xml_on_thread(targets: List[Tuple[str, str]], bucket: Optional[Bucket]):
+def _download_xml_on_process(targets: List[Tuple[str, str, str]]) -> List[ItemFailure]:
+    bucket = _get_worker_bucket()
+    return flatten_failures(run_on_thread_pool(_download_xml_on_thread, targets, bucket,
+                                               workers_count=os.cpu_count()*10))
+
+
+def _download_planned_on_process(indices: Iterable[int], plan_path: str, xml_paths: EINPathManager) \
+        -> List[ItemFailure]:
+    plan: ChangePlan = read_plan(plan_path)
+    targets: List[Tuple[str, str, str]] = [(ein, xml_paths.ensure_directory_for(ein), irs_efile_id)
+                                           for ein, _, irs_efile_id in plan.filings(indices)]
+    return _download_xml_on_process(targets)
+
+
+def _download_xml_on_thread(targets: List[Tuple[str, str, str]], bucket: Optional[Bucket]) -> List[ItemFailure]:
+    metrics: MetricsRegistry = registry()
+    n_bytes: int = 0
+    failures: List[ItemFailure] = []
     for target in targets:
-        ein_path, irs_efile_id = target  # types: str, str
+        ein, ein_path, irs_efile_id = target  # types: str, str, str
         s3_key: str = "%s_public.xml" % irs_efile_id
         try:
-            raw_xml: str = bucket.get_obj_body(s3_key)
-        except ClientError as e:
-            logging.warning("can't get object by key '%s': %s", s3_key, e)
-            continue
-        destination: str = os.path.join(ein_path, s3_key)
-        with open(destination, "w") as fh:
-            fh.write(raw_xml)
-
-
-def _xml_to_json(changes: List[Tuple[str, Dict[str, FilingMetadata]]], xml_cache_dir: str, json_cache_dir: str) -> None:
-    translate = JsonTranslator()
-    for change in changes:
-        (ein, updates) = change
-        for filing_md in updates.values():
-            irs_efile_id: str = filing_md.irs_efile_id
-            xml_path: str = os.path.join(_ein_path(xml_cache_dir, ein), "%s_public.xml" % irs_efile_id)
-            json_path: str = os.path.join(_ein_path(json_cache_dir, ein), "%s.json" % irs_efile_id)
+            with tracing.span("download", "filing", ein=ein, irs_efile_id=irs_efile_id):
+                raw_xml: str = bucket.get_obj_body(s3_key)
+                destination: str = os.path.join(ein_path, s3_key)
+                with open(destination, "w") as fh:
+                    fh.write(raw_xml)
+                n_bytes += os.path.getsize(destination)
+        except Exception as e:
+            failures.append(ItemFailure.capture(DOWNLOADED, ein, irs_efile_id, e))
+    metrics.counter("download_filings_total", "Filings downloaded").inc(len(targets) - len(failures))
+    metrics.counter("download_bytes_total", "Bytes of XML downloaded").inc(n_bytes)
+    return failures
+
+
+def _xml_to_json(changes: List[Tuple[str, Dict[str, FilingMetadata]]], xml_paths: EINPathManager,
+                 json_paths: EINPathManager, timeout: Optional[float] = None,
+                 cache: Optional[ConversionCache] = None) -> List[ItemFailure]:
+    filings: Iterator[Tuple[str, str]] = ((ein, filing_md.irs_efile_id) for ein, updates in changes
+                                          for filing_md in updates.values())
+    return _convert_filings(filings, xml_paths, json_paths, timeout, cache)
+
+
+def _xml_to_json_planned(indices: Iterable[int], plan_path: str, xml_paths: EINPathManager,
+                         json_paths: EINPathManager, timeout: Optional[float] = None,
+                         cache: Optional[ConversionCache] = None) -> List[ItemFailure]:
+    plan: ChangePlan = read_plan(plan_path)
+    return _convert_filings(((ein, irs_efile_id) for ein, _, irs_efile_id in plan.filings(indices)), xml_paths,
+                            json_paths, timeout, cache)
+
+
+def _convert_cached(raw_xml: str, translate: "JsonTranslator", cache: ConversionCache, json_fh) -> bool:
+    """Writes the filing's JSON from the cache if it holds it, or else converts the filing and adds it to the cache.
+    Returns whether the cache held it."""
+    key: str = cache.key(raw_xml)
+    as_text: Optional[str] = cache.get(key)
+    hit: bool = as_text is not None
+    if not hit:
+        as_text = json.dumps(translate(raw_xml))
+        cache.put(key, as_text)
+    json_fh.write(as_text)
+    return hit
+
+
+def _convert_filings(filings: Iterable[Tuple[str, str]], xml_paths: EINPathManager, json_paths: EINPathManager,
+                     timeout: Optional[float], cache: Optional[ConversionCache] = None) -> List[ItemFailure]:
+    """Converts each (EIN, IRS e-file ID) filing, capturing any error so that one bad filing does not fail the rest.
+    JSON files are renamed into place, so a chunk may safely be converted twice at once."""
+    translate: "JsonTranslator" = _get_worker_translator()
+    metrics: MetricsRegistry = registry()
+    latency: Histogram = metrics.histogram("convert_filing_seconds", "Time taken to convert one filing")
+    n_converted: int = 0
+    n_cached: int = 0
+    failures: List[ItemFailure] = []
+    with AtomicBatchWriter(fsync=False) as writer:
+        for ein, irs_efile_id in filings:
+            xml_path: str = os.path.join(xml_paths.ensure_directory_for(ein), "%s_public.xml" % irs_efile_id)
+            json_paths.ensure_directory_for(ein)
+            json_path: str = json_path_for(json_paths, ein, irs_efile_id)
             try:
-                with open(xml_path) as xml_fh, open(json_path, "w") as json_fh:
-                    raw_xml: str = xml_fh.read()
-                    as_json: Dict = translate(raw_xml)
-                    json.dump(as_json, json_fh)
-            except FileNotFoundError as e:
-                logging.warning(e)
+                with time_limit(timeout), latency.time(), \
+                        tracing.span("convert", "filing", ein=ein, irs_efile_id=irs_efile_id):
+                    with open(xml_path) as xml_fh:
+                        raw_xml: str = xml_fh.read()
+                    with writer.open(json_path) as json_fh:
+                        if cache is None:
+                            json.dump(translate(raw_xml), json_fh)
+                        elif _convert_cached(raw_xml, translate, cache, json_fh):
+                            n_cached += 1
+                n_converted += 1
+            except ItemTimeout as e:
+                failures.append(ItemFailure.capture(CONVERTED, ein, irs_efile_id, e, timed_out=True))
+            except Exception as e:
+                failures.append(ItemFailure.capture(CONVERTED, ein, irs_efile_id, e))
+    metrics.counter("convert_filings_total", "Filings converted to JSON").inc(n_converted)
+    metrics.counter("convert_cache_hits_total", "Filings whose JSON was copied from the conversion cache").inc(n_cached)
+    return failures
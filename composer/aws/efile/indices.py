@@ -1,62 +1,120 @@
 import json
 import logging
-from collections import deque
 from collections.abc import Iterable
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Iterator, Dict, List, Deque
-from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from typing import Callable, Iterator, Dict, List, Optional
 
 from composer.aws.efile.bucket import efile_bucket
+from composer.aws.inventory import BucketInventory
 from composer.aws.s3 import Bucket
-from composer.efile.structures.metadata import FilingMetadata
+from composer.efile.structures.metadata import FIELD_EQUIVALENTS, FilingMetadata, download_time
+from composer.futures import imap_on_process_pool
+from composer.metrics import MetricsRegistry, registry
 
 EARLIEST_YEAR = 2011
 
+# Separates the values of one field in an IndexColumns batch. It never appears in the IRS indices.
+_SEPARATOR: str = "\x1f"
+
 def _json_index_key(year: int) -> str:
     return "index_%i.json" % year
 
 @dataclass
-class EfileIndices(Iterable):
-    bucket: Bucket
+class IndexColumns:
+    """The filings of one year's index in columnar form: for each metadata field, the values of every filing joined
+    into a single string. A parsed year pickles as a handful of strings rather than a list of dicts, so it is cheap to
+    return from a pool worker."""
 
-    @classmethod
-    def build(cls) -> "EfileIndices":
-        bucket: Bucket = efile_bucket()
-        return cls(bucket)
+    year: int
+    n_filings: int
+    columns: Dict[str, str]
 
-    def _get_for_year(self, year: int) -> List[Dict]:
-        object_key: str = _json_index_key(year)
-        try:
-            raw: str = self.bucket.get_obj_body(object_key)
-        except FileNotFoundError:
-            return []
+    @classmethod
+    def parse(cls, year: int, raw: str) -> "IndexColumns":
         as_json: Dict = json.loads(raw)
 
         # The IRS currently includes a single key in its indices. Blow up if that changes.
         assert len(as_json) == 1
         filing_list_key: str = "Filings%i" % year
-        filing_list: List = as_json[filing_list_key]
-        return filing_list
+        filing_list: List[Dict] = as_json[filing_list_key]
+        columns: Dict[str, str] = {}
+        for irs_key in FIELD_EQUIVALENTS:
+            column: str = _SEPARATOR.join(spec[irs_key] for spec in filing_list)
+            if column.count(_SEPARATOR) != max(len(filing_list) - 1, 0):
+                raise ValueError("Field %s of the %i index contains a reserved character" % (irs_key, year))
+            columns[irs_key] = column
+        return cls(year, len(filing_list), columns)
 
     def __iter__(self) -> Iterator[FilingMetadata]:
+        if self.n_filings == 0:
+            return
+        date_downloaded: str = download_time()
+        fields: List[str] = list(FIELD_EQUIVALENTS.values())
+        values: List[List[str]] = [self.columns[irs_key].split(_SEPARATOR) for irs_key in FIELD_EQUIVALENTS]
+        for row in zip(*values):
+            yield FilingMetadata.from_fields(dict(zip(fields, row)), date_downloaded)
+
+def _get_raw_for_year(bucket: Bucket, year: int) -> Optional[str]:
+    object_key: str = _json_index_key(year)
+    metrics: MetricsRegistry = registry()
+    try:
+        with metrics.histogram("index_fetch_seconds", "Time taken to download one year's index").time():
+            raw: str = bucket.get_obj_body(object_key)
+    except FileNotFoundError:
+        return None
+    metrics.counter("index_bytes_total", "Characters of index JSON downloaded").inc(len(raw))
+    return raw
+
+def _fetch_indices(years: List[int], bucket: Bucket) -> List[IndexColumns]:
+    """Downloads and parses each year's index, skipping years that have none."""
+    parsed: List[IndexColumns] = []
+    for year in years:
+        raw: Optional[str] = _get_raw_for_year(bucket, year)
+        if raw is not None:
+            parsed.append(IndexColumns.parse(year, raw))
+    registry().counter("index_filings_total", "Filings read from the e-file indices").inc(sum(c.n_filings
+                                                                                              for c in parsed))
+    return parsed
+
+@dataclass
+class EfileIndices(Iterable):
+    """Reads the IRS e-file indices. Each year's index is downloaded and parsed by a pool worker, one year per task, so
+    that JSON parsing is spread across cores rather than serialized by the GIL, and the parent never holds the raw
+    JSON. Filings are yielded year by year, in order of year.
+
+    With an inventory of the bucket, the indices that exist are looked up in it rather than probed with requests, and
+    years without an index are not requested at all."""
+
+    bucket: Bucket
+    inventory: Optional[BucketInventory] = None
+
+    @classmethod
+    def build(cls) -> "EfileIndices":
+        bucket: Bucket = efile_bucket()
+        return cls(bucket)
+
+    def by_year(self) -> Iterator[IndexColumns]:
+        """Yields each year's filings in turn, in order of year, as soon as that year has been parsed."""
         years: Iterator = range(EARLIEST_YEAR, datetime.now().year + 1)
         #years: Iterator = range(EARLIEST_YEAR, EARLIEST_YEAR + 1)
 
+        exists: Callable[[str], bool] = self.bucket.exists if self.inventory is None else self.inventory.__contains__
+
         # The IRS currently provides e-files starting with those filed in 2011. Blow up if that changes.
-        assert not self.bucket.exists(_json_index_key(EARLIEST_YEAR - 1))
-        assert self.bucket.exists(_json_index_key(EARLIEST_YEAR))
-
-        with ThreadPoolExecutor() as executor:
-            future_to_year: Dict[Future, int] = {}
-            results: Deque[List[Dict]] = deque()
-            for year in years:
-                future: Future = executor.submit(self._get_for_year, year)
-                future_to_year[future] = year
-            for completed_future in as_completed(future_to_year):  # type: Future
-                logging.info("Finished downloading index for %i" % future_to_year[completed_future])
-                results.append(completed_future.result())
-
-            for result in results:
-                for filing_spec in result:
-                    yield FilingMetadata.from_json(filing_spec)
+        assert not exists(_json_index_key(EARLIEST_YEAR - 1))
+        assert exists(_json_index_key(EARLIEST_YEAR))
+        if self.inventory is not None:
+            years = [year for year in years if _json_index_key(year) in self.inventory]
+
+        # Years are yielded in order as soon as each is parsed, so the caller works through the earlier years while
+        # the workers are still fetching the later ones
+        for result in imap_on_process_pool(_fetch_indices, list(years), self.bucket, chunk_size=1, ordered=True,
+                                           label="index"):
+            for columns in result:
+                logging.info("Read {:,} filings from the index for {}".format(columns.n_filings, columns.year))
+                yield columns
+
+    def __iter__(self) -> Iterator[FilingMetadata]:
+        for columns in self.by_year():
+            yield from columns
@@ -0,0 +1,102 @@
+import csv
+import gzip
+import io
+import json
+import logging
+from dataclasses import dataclass
+from sqlite3 import Connection, Cursor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import unquote
+
+from composer.aws.s3 import Bucket, ObjectInfo
+
+# Produces a bucket's objects, such as Bucket.list_objects or read_manifest bound to its arguments
+ObjectListing = Callable[[], Iterable[ObjectInfo]]
+
+# Objects inserted into the inventory per executemany
+_INSERT_BATCH: int = 10000
+
+def _init_inventory_table(conn: Connection) -> None:
+    cursor: Cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bucket_inventory (
+            key text PRIMARY KEY,
+            size integer NOT NULL,
+            etag text NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.commit()
+
+def read_manifest(bucket: Bucket, manifest_key: str) -> Iterator[ObjectInfo]:
+    """Yields the objects listed by an S3 Inventory report, given the key of its manifest.json in the bucket that
+    receives the reports. Only CSV reports that include the Size and ETag fields can be read."""
+    manifest: Dict = json.loads(bucket.get_obj_body(manifest_key))
+    if manifest.get("fileFormat") != "CSV":
+        raise ValueError("Cannot read an inventory report in %s format" % manifest.get("fileFormat"))
+    schema: List[str] = [field.strip() for field in manifest["fileSchema"].split(",")]
+    missing: List[str] = [field for field in ["Key", "Size", "ETag"] if field not in schema]
+    if len(missing) > 0:
+        raise ValueError("Inventory report lacks the field(s) %s" % ", ".join(missing))
+    key_at, size_at, etag_at = schema.index("Key"), schema.index("Size"), schema.index("ETag")
+    for data_file in manifest["files"]:
+        with bucket.open_obj(data_file["key"]) as raw, gzip.open(raw) as decompressed:
+            for row in csv.reader(io.TextIOWrapper(decompressed, encoding="utf-8")):
+                # Keys are URL-encoded in CSV reports
+                yield unquote(row[key_at]), int(row[size_at]), row[etag_at].strip('"')
+
+@dataclass
+class BucketInventory:
+    """Local copy of a bucket's listing: the size and ETag of every object, by key. Kept in SQLite, sorted by key, so
+    that the existence and size of any object can be looked up without a request to the bucket.
+
+    The inventory is only as fresh as its last refresh: an object added since then is taken to be missing."""
+
+    conn: Connection
+
+    @classmethod
+    def build(cls, conn: Connection) -> "BucketInventory":
+        _init_inventory_table(conn)
+        return cls(conn)
+
+    def refresh(self, objects: Iterable[ObjectInfo]) -> List[str]:
+        """Replaces the inventory with the given listing, such as that of Bucket.list_objects or read_manifest, and
+        returns the keys of objects whose ETag differs from that of the previous listing."""
+        cursor: Cursor = self.conn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS temp.listing")
+        cursor.execute("CREATE TEMP TABLE listing (key text PRIMARY KEY, size integer NOT NULL, etag text NOT NULL)")
+        batch: List[ObjectInfo] = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= _INSERT_BATCH:
+                cursor.executemany("INSERT OR REPLACE INTO temp.listing VALUES (?, ?, ?)", batch)
+                batch = []
+        cursor.executemany("INSERT OR REPLACE INTO temp.listing VALUES (?, ?, ?)", batch)
+        changed: List[str] = [row[0] for row in cursor.execute("""
+            SELECT l.key FROM temp.listing l JOIN bucket_inventory i ON l.key = i.key WHERE l.etag != i.etag
+            ORDER BY l.key
+        """)]
+        cursor.execute("DELETE FROM bucket_inventory")
+        cursor.execute("INSERT INTO bucket_inventory SELECT key, size, etag FROM temp.listing ORDER BY key")
+        cursor.execute("DROP TABLE temp.listing")
+        self.conn.commit()
+        logging.info("Bucket inventory holds {:,} objects; {:,} changed since the last listing."
+                     .format(len(self), len(changed)))
+        return changed
+
+    def size(self, key: str) -> Optional[int]:
+        """Size of the object in bytes, or None if the bucket has no such object."""
+        cursor: Cursor = self.conn.cursor()
+        row: Optional[tuple] = cursor.execute("SELECT size FROM bucket_inventory WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def etag(self, key: str) -> Optional[str]:
+        cursor: Cursor = self.conn.cursor()
+        row: Optional[tuple] = cursor.execute("SELECT etag FROM bucket_inventory WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def __contains__(self, key: str) -> bool:
+        return self.size(key) is not None
+
+    def __len__(self) -> int:
+        cursor: Cursor = self.conn.cursor()
+        return cursor.execute("SELECT COUNT(*) FROM bucket_inventory").fetchone()[0]
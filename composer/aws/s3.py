@@ -1,35 +1,69 @@
+import io
 import logging
 import os
+import threading
+import time
 
-import boto3
 from typing import *
+from typing import TYPE_CHECKING
 from multiprocessing import cpu_count
-from mock import MagicMock
 
-from composer.aws.handshake import Handshake
-from botocore.errorfactory import ClientError
-from botocore.client import Config
+# boto3 and botocore take a noticeable fraction of a second to import, so they are imported only once a client is needed
+if TYPE_CHECKING:
+    import boto3
+    from composer.aws.handshake import Handshake
 
 logging.getLogger("botocore.vendored.requests.packages.urllib3").setLevel(logging.WARNING)
 
+# (key, size in bytes, ETag) of an object in a bucket
+ObjectInfo = Tuple[str, int, str]
+
+# S3 clients built by this process, by credentials. A client is costly to build but safe to share between threads; it
+# cannot be shared with another process, so a forked process starts with none.
+_clients: Dict[Tuple[Optional[str], Optional[str]], Any] = {}
+_clients_pid: int = os.getpid()
+_clients_lock: threading.Lock = threading.Lock()
+
+def s3_client(aws_id: Optional[str] = None, aws_secret: Optional[str] = None) -> "boto3.client":
+    """Returns this process's S3 client for the given credentials, or for the default credentials if none are given,
+    building it on first use."""
+    global _clients, _clients_pid, _clients_lock
+    if _clients_pid != os.getpid():
+        _clients, _clients_pid, _clients_lock = {}, os.getpid(), threading.Lock()
+    with _clients_lock:
+        if (aws_id, aws_secret) not in _clients:
+            import boto3
+            from botocore.client import Config
+            config: Config = Config(max_pool_connections=cpu_count() * 10)
+            _clients[(aws_id, aws_secret)] = boto3.client('s3', aws_access_key_id=aws_id,
+                                                          aws_secret_access_key=aws_secret, config=config)
+        return _clients[(aws_id, aws_secret)]
+
 class Bucket:
-    def __init__(self, s3: boto3.client, name: str):
+    def __init__(self, s3: "boto3.client", name: str, credentials: Tuple[Optional[str], Optional[str]] = (None, None)):
         self.s3: boto3.client = s3
         self.name: str = name
+        self.credentials: Tuple[Optional[str], Optional[str]] = credentials
 
     @classmethod
     def build(cls, name: str) -> "Bucket":
-        config: Config = Config(max_pool_connections=cpu_count() * 10)
-        client: boto3.client = boto3.client('s3', config=config)
-        return cls(client, name)
+        return cls(s3_client(), name)
 
     @classmethod
-    def build_authenticated(cls, handshake: Handshake, name: str) -> "Bucket":
-        aws_id = handshake.get_aws_key()
-        aws_secret = handshake.get_aws_secret()
-        config: Config = Config(max_pool_connections=cpu_count() * 10)
-        client = boto3.client('s3', aws_access_key_id=aws_id, aws_secret_access_key=aws_secret, config=config)
-        return cls(client, name)
+    def build_authenticated(cls, handshake: "Handshake", name: str) -> "Bucket":
+        credentials: Tuple[str, str] = (handshake.get_aws_key(), handshake.get_aws_secret())
+        return cls(s3_client(*credentials), name, credentials)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """A client cannot be pickled, so a bucket is pickled without one. Once unpickled, as by a pool worker, it uses
+        that process's client for the same credentials."""
+        state: Dict[str, Any] = dict(self.__dict__)
+        del state["s3"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.s3 = s3_client(*self.credentials)
 
     def get_obj_body(self, key: str, encoding: Optional[str]= "utf-8"):
         obj = self.s3.get_object(Bucket=self.name, Key=key)
@@ -39,28 +73,103 @@ class Bucket:
             return decoded
         return encoded
 
+    def open_obj(self, key: str) -> BinaryIO:
+        """Returns a stream of the object's bytes, so that a large object need not be held in memory at once."""
+        return self.s3.get_object(Bucket=self.name, Key=key)['Body']
+
     # SO 33842944
     def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
         try:
             self.s3.head_object(Bucket=self.name, Key=key)
             return True
         except ClientError:
             return False
 
-def file_backed_bucket(root_dir: str) -> Bucket:
-    """Mock bucket used in tests and fixture creation"""
-    bucket: Bucket = MagicMock(spec=Bucket)
+    def list_objects(self, prefix: str = "") -> Iterator[ObjectInfo]:
+        """Yields the key, size and ETag of each object whose key starts with the prefix, in order of key. ETags are
+        given without the quotes that S3 puts around them."""
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'], obj['Size'], obj['ETag'].strip('"')
+
+    def list_keys(self, prefix: str = "") -> Iterator[str]:
+        for key, _, _ in self.list_objects(prefix):
+            yield key
+
+class _ThrottledStream(io.RawIOBase):
+    """Read-only stream that delays each read as if its bytes had arrived at the given bandwidth."""
+
+    def __init__(self, fh: BinaryIO, bandwidth: float):
+        self.fh: BinaryIO = fh
+        self.bandwidth: float = bandwidth
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n_bytes: int = self.fh.readinto(buffer)
+        time.sleep(n_bytes / self.bandwidth)
+        return n_bytes
 
-    def get_file_content(filename: str, encoding: Optional[str] = "utf-8") -> str:
-        filepath: str = os.path.join(root_dir, filename)
-        with open(filepath) as fh:
-            return fh.read()
+    def close(self) -> None:
+        self.fh.close()
+        super().close()
 
-    bucket.get_obj_body.side_effect = get_file_content
+class LocalBucket(Bucket):
+    """A directory that stands in for a bucket, such as a local mirror of irs-form-990. Each key is a path relative to
+    the root directory. A missing object raises FileNotFoundError.
 
-    def file_exists(filename: str) -> bool:
-        filepath: str = os.path.join(root_dir, filename)
-        return os.path.exists(filepath)
+    Requests can be slowed to resemble a remote bucket: each one waits for the given latency, in seconds, and object
+    bodies arrive at the given bandwidth, in bytes per second. Holds no client, so it can be handed to pool workers."""
+
+    def __init__(self, root_dir: str, latency: float = 0.0, bandwidth: Optional[float] = None):
+        self.root_dir: str = root_dir
+        self.name: str = root_dir
+        self.latency: float = latency
+        self.bandwidth: Optional[float] = bandwidth
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+
+    def _request(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root_dir, key)
+
+    def open_obj(self, key: str) -> BinaryIO:
+        self._request()
+        fh: BinaryIO = open(self._path(key), "rb")
+        if self.bandwidth is None:
+            return fh
+        return io.BufferedReader(_ThrottledStream(fh, self.bandwidth))
+
+    def get_obj_body(self, key: str, encoding: Optional[str] = "utf-8"):
+        with self.open_obj(key) as fh:
+            encoded: bytes = fh.read()
+        if encoding:
+            return encoded.decode(encoding)
+        return encoded
+
+    def exists(self, key: str) -> bool:
+        self._request()
+        return os.path.isfile(self._path(key))
 
-    bucket.exists.side_effect = file_exists
-    return bucket
+    def list_objects(self, prefix: str = "") -> Iterator[ObjectInfo]:
+        """Yields the objects whose keys start with the prefix, in no particular order. A file has no ETag, so each
+        object's stands in with one made from its size and modification time, which changes whenever the file is
+        rewritten."""
+        self._request()
+        for dirpath, _, filenames in os.walk(self.root_dir):
+            relative: str = os.path.relpath(dirpath, self.root_dir)
+            for filename in filenames:
+                key: str = filename if relative == "." else os.path.join(relative, filename).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    stat: os.stat_result = os.stat(os.path.join(dirpath, filename))
+                    yield key, stat.st_size, "%x-%x" % (stat.st_size, stat.st_mtime_ns)
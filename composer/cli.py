@@ -1,9 +1,23 @@
 import click
-from composer.efile.update import UpdateEfileState
 import logging
+from typing import Optional, TYPE_CHECKING
+
+# Each command imports what it needs when it runs, so that `composer --help` need not import boto3, lxml and the rest
+if TYPE_CHECKING:
+    from composer.aws.handshake import Handshake
+    from composer.aws.s3 import LocalBucket
+    from composer.efile.update import UpdateEfileState
+    from composer.fileio.layout import EINLayout
+    from composer.fileio.migrate import MigrateLayout
 
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
+def _handshake(authenticated: bool) -> Optional["Handshake"]:
+    if not authenticated:
+        return None
+    from composer.aws.handshake import Handshake
+    return Handshake.build()
+
 @click.group()
 def cli():
     """Polytropos ETL5 Composer. Copyright (c) 2019 Applied Nonprofit Research. All rights reserved."""
@@ -13,8 +27,110 @@ def cli():
 @click.argument('data_path', type=click.Path(exists=True))
 @click.option('--temp_path', type=click.Path(exists=True), default="/tmp")
 @click.option('--no_cleanup', is_flag=True)
-def efile(data_path: str, temp_path: str, no_cleanup: bool):
+@click.option('--resume', is_flag=True, help="Continue an interrupted update from its last checkpoint.")
+@click.option('--mmap_plan', is_flag=True, help="Hand work to pool workers as ranges of a memory-mapped change plan "
+                                                "rather than as pickled change lists.")
+@click.option('--staging_budget', type=int, default=None, help="Disk space, in MB, that staged XML and JSON may use "
+                                                               "in temp_path. Downloads pause when it is reached.")
+@click.option('--prefetch', is_flag=True, help="Start downloading new e-files while the indices are still being read.")
+@click.option('--metrics_path', type=click.Path(exists=True), default=None,
+              help="Directory for the run's metrics report and Prometheus textfile. Defaults to DATA_PATH.")
+@click.option('--trace', type=click.Path(), default=None,
+              help="Record a timeline of every stage, batch and filing, and write it here as a Chrome trace.")
+@click.option('--profile', is_flag=True, help="Profile CPU time and memory of each stage, in every process, and write "
+                                              "the results to DATA_PATH/profile.")
+@click.option('--source_dir', type=click.Path(exists=True, file_okay=False), default=None,
+              help="Read the e-file indices and filings from this local mirror of the irs-form-990 bucket instead of "
+                   "from S3.")
+@click.option('--source_latency', type=float, default=0.0,
+              help="With --source_dir, delay each request to the mirror by this many milliseconds.")
+@click.option('--source_bandwidth', type=float, default=None,
+              help="With --source_dir, read from the mirror at no more than this many MB per second.")
+@click.option('--authenticated', is_flag=True, help="Read the irs-form-990 bucket with the S3 credentials kept in SSM "
+                                                    "rather than with the default ones.")
+@click.option('--inventory', is_flag=True, help="List the bucket once at the start of the run, and look up objects in "
+                                                "the listing rather than requesting them.")
+@click.option('--inventory_manifest', default=None, metavar="BUCKET/KEY",
+              help="Like --inventory, but read the listing from the manifest.json of an S3 Inventory report.")
+@click.option('--conversion_cache', type=click.Path(file_okay=False), default=None,
+              help="Keep the JSON of every converted filing here, and reuse it rather than converting the same XML "
+                   "again.")
+def efile(data_path: str, temp_path: str, no_cleanup: bool, resume: bool, mmap_plan: bool,
+          staging_budget: Optional[int], prefetch: bool, metrics_path: Optional[str], trace: Optional[str],
+          profile: bool, source_dir: Optional[str], source_latency: float, source_bandwidth: Optional[float],
+          authenticated: bool, inventory: bool, inventory_manifest: Optional[str], conversion_cache: Optional[str]):
     """Update local efile composites, or create them if they do not exist. Results in a set of e-file composites for all
     organizations that have e-filed, along with a SQLite database of latest and duplicate filings."""
-    update: UpdateEfileState = UpdateEfileState.build(data_path, temp_path, no_cleanup)
+    from composer.aws.s3 import LocalBucket
+    from composer.efile.update import UpdateEfileState
+    budget_bytes: Optional[int] = None if staging_budget is None else staging_budget * 1024 * 1024
+    source: Optional[LocalBucket] = None
+    if source_dir is not None:
+        bandwidth: Optional[float] = None if source_bandwidth is None else source_bandwidth * 1024 * 1024
+        source = LocalBucket(source_dir, source_latency / 1000, bandwidth)
+    update: UpdateEfileState = UpdateEfileState.build(data_path, temp_path, no_cleanup, resume, mmap_plan,
+                                                      staging_budget=budget_bytes, prefetch=prefetch,
+                                                      metrics_path=metrics_path, trace_path=trace, profile=profile,
+                                                      source=source, handshake=_handshake(authenticated),
+                                                      inventory=inventory, inventory_manifest=inventory_manifest,
+                                                      conversion_cache=conversion_cache)
     update()
+
+@cli.command()
+@click.argument('data_path', type=click.Path(exists=True))
+@click.option('--temp_path', type=click.Path(exists=True), default="/tmp")
+@click.option('--no_cleanup', is_flag=True)
+@click.option('--source_dir', type=click.Path(exists=True, file_okay=False), default=None,
+              help="Read the filings from this local mirror of the irs-form-990 bucket instead of from S3.")
+@click.option('--authenticated', is_flag=True, help="Read the irs-form-990 bucket with the S3 credentials kept in SSM "
+                                                    "rather than with the default ones.")
+def retry_quarantined(data_path: str, temp_path: str, no_cleanup: bool, source_dir: Optional[str],
+                      authenticated: bool):
+    """Retry only the e-files that were quarantined after failing in an earlier update. Filings that succeed are
+    released from quarantine; those that fail again stay there with their latest error."""
+    from composer.aws.s3 import LocalBucket
+    from composer.efile.update import UpdateEfileState
+    source: Optional[LocalBucket] = None if source_dir is None else LocalBucket(source_dir)
+    update: UpdateEfileState = UpdateEfileState.build(data_path, temp_path, no_cleanup, retry_quarantined=True,
+                                                      source=source, handshake=_handshake(authenticated))
+    update()
+
+@cli.command()
+@click.argument('data_path', type=click.Path(exists=True))
+@click.option('--temp_path', type=click.Path(exists=True), default="/tmp")
+@click.option('--no_cleanup', is_flag=True)
+@click.option('--resume', is_flag=True, help="Continue an interrupted reconversion from its last checkpoint.")
+@click.option('--source_dir', type=click.Path(exists=True, file_okay=False), default=None,
+              help="Read the filings from this local mirror of the irs-form-990 bucket instead of from S3.")
+@click.option('--authenticated', is_flag=True, help="Read the irs-form-990 bucket with the S3 credentials kept in SSM "
+                                                    "rather than with the default ones.")
+@click.option('--conversion_cache', type=click.Path(file_okay=False), default=None,
+              help="Keep the JSON of every converted filing here, and reuse it rather than converting the same XML "
+                   "again.")
+def reconvert(data_path: str, temp_path: str, no_cleanup: bool, resume: bool, source_dir: Optional[str],
+              authenticated: bool, conversion_cache: Optional[str]):
+    """Convert again only the e-files whose JSON was produced by an earlier version of the XML converter, and update
+    their composites. Composites whose filings convert exactly as before are left untouched."""
+    from composer.aws.s3 import LocalBucket
+    from composer.efile.update import UpdateEfileState
+    source: Optional[LocalBucket] = None if source_dir is None else LocalBucket(source_dir)
+    update: UpdateEfileState = UpdateEfileState.build(data_path, temp_path, no_cleanup, resume, reconvert=True,
+                                                      source=source, handshake=_handshake(authenticated),
+                                                      conversion_cache=conversion_cache)
+    update()
+
+@cli.command()
+@click.argument('data_path', type=click.Path(exists=True))
+@click.option('--depth', type=int, default=2)
+@click.option('--width', type=int, default=3)
+@click.option('--hashed', is_flag=True)
+@click.option('--workers', type=int, default=None)
+def migrate_layout(data_path: str, depth: int, width: int, hashed: bool, workers: int):
+    """Re-lay out the e-file composites in a data path into a new directory fan-out. Composites remain readable
+    throughout; an interrupted migration resumes when re-run with the same options."""
+    from composer.efile.compose import TEMPLATE
+    from composer.fileio.layout import EINLayout
+    from composer.fileio.migrate import MigrateLayout
+    target: EINLayout = EINLayout(depth, width, hashed)
+    migrate: MigrateLayout = MigrateLayout.build(data_path, target, TEMPLATE)
+    migrate(workers_count=workers)
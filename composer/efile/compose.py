@@ -1,14 +1,24 @@
 import logging
+import os
 from collections.abc import Callable
 from dataclasses import dataclass
-from typing import Iterator, Tuple, Dict, List
+from typing import Iterable, Iterator, Tuple, Dict, List, Optional, Set
 import json
 
-from composer.aws.efile.filings import RetrieveEfiles
+from composer.aws.efile.filings import FetchOutcome, RetrieveEfiles, json_path_for
 from composer.aws.s3 import Bucket
+from composer.efile.conversions import ConversionCache
+from composer.efile.structures.ledger import RunLedger, COMPOSED
 from composer.efile.structures.metadata import FilingMetadata
+from composer.efile.structures.plan import ChangePlan, read_plan, temporary_plan
+from composer.efile.structures.quarantine import ItemFailure, exclude_failed, flatten_failures
+from composer.fileio.atomic import AtomicBatchWriter
+from composer.fileio.layout import EINLayout, load_layout, save_layout
+from composer.fileio.migrate import MIGRATION_FILENAME, migration_in_progress
 from composer.fileio.paths import EINPathManager
 from composer.futures import run_on_process_pool
+from composer import tracing
+from composer.metrics import Histogram, MetricsRegistry, registry
 
 TEMPLATE = "%s.json"
 
@@ -17,33 +27,100 @@ TEMPLATE = "%s.json"
 class ComposeEfiles(Callable):
     retrieve: RetrieveEfiles
     path_mgr: EINPathManager
+    fsync: bool = True
+    use_plan: bool = False
 
     @classmethod
-    def build(cls, basepath: str, temp_path: str, no_cleanup: bool) -> "ComposeEfiles":
-        retrieve: RetrieveEfiles = RetrieveEfiles(temp_path, no_cleanup)
-        path_mgr: EINPathManager = EINPathManager(basepath)
-        return cls(retrieve, path_mgr)
+    def build(cls, basepath: str, temp_path: str, no_cleanup: bool, use_plan: bool = False,
+              staging_budget: Optional[int] = None, conversion_cache: Optional[ConversionCache] = None) \
+            -> "ComposeEfiles":
+        if migration_in_progress(basepath):
+            raise ValueError("A layout migration of %s is in progress; finish it with migrate-layout before updating "
+                             "(see %s)" % (basepath, MIGRATION_FILENAME))
+        layout: EINLayout = load_layout(basepath)
+        save_layout(basepath, layout)  # Records the default layout the first time a data path is populated
+        retrieve: RetrieveEfiles = RetrieveEfiles(temp_path, no_cleanup, layout, persistent=True, use_plan=use_plan,
+                                                  staging_budget=staging_budget, conversion_cache=conversion_cache)
+        path_mgr: EINPathManager = EINPathManager(basepath, layout)
+        return cls(retrieve, path_mgr, use_plan=use_plan)
 
-    def process_all(self, json_changes: List[Tuple[str, Dict[str, str]]]):
-        updater = ComposeEfilesUpdater(self.path_mgr)
-        run_on_process_pool(updater.create_or_update, json_changes)
+    def _estimate_bytes(self, change: Tuple[str, Dict[str, str]]) -> int:
+        """Estimates the I/O cost of composing an EIN as the size of its existing composite plus the new filings."""
+        ein, updates = change
+        paths: List[str] = [self.path_mgr.path_for(ein, TEMPLATE)] + list(updates.values())
+        total: int = 0
+        for path in paths:
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return total
 
-    def __call__(self, changes: Iterator[Tuple[str, Dict[str, FilingMetadata]]]):
+    def process_all(self, json_changes: List[Tuple[str, Dict[str, str]]]) -> List[ItemFailure]:
+        """Updates composites on a process pool, returning a failure for each EIN whose composite could not be
+        updated. EINs are ordered by composite directory so that each chunk covers a contiguous run of directories, and
+        chunks are sized by estimated bytes rather than by EIN count."""
+        updater = ComposeEfilesUpdater(self.path_mgr, self.fsync)
+        ordered: List[Tuple[str, Dict[str, str]]] = sorted(json_changes, key=self._sort_key)
+        return flatten_failures(run_on_process_pool(updater.create_or_update, ordered, cost=self._estimate_bytes,
+                                                    label="compose"))
+
+    def _sort_key(self, change: Tuple[str, Dict]) -> Tuple[str, str]:
+        return self.path_mgr.directory_for(change[0]), change[0]
+
+    def _planned_bytes(self, plan: ChangePlan, index: int) -> int:
+        ein, updates = next(plan.changes([index]))
+        json_paths: EINPathManager = self.retrieve.json_paths
+        return self._estimate_bytes((ein, {period: json_path_for(json_paths, ein, irs_efile_id)
+                                           for period, irs_efile_id in updates.items()}))
+
+    def process_all_planned(self, changes: List[Tuple[str, Dict[str, FilingMetadata]]]) -> List[ItemFailure]:
+        """As process_all, but writes the changes to a memory-mapped plan and hands workers ranges of plan positions.
+        Workers find each new filing's JSON in the retriever's staging directory."""
+        updater = ComposeEfilesUpdater(self.path_mgr, self.fsync)
+        ordered: List[Tuple[str, Dict[str, FilingMetadata]]] = sorted(changes, key=self._sort_key)
+        with temporary_plan(self.retrieve.xml_cache_dir, ordered) as plan:
+            return flatten_failures(run_on_process_pool(updater.create_or_update_planned, range(len(plan)), plan.path,
+                                                        self.retrieve.json_paths,
+                                                        cost=lambda index: self._planned_bytes(plan, index),
+                                                        label="compose"))
+
+    def __call__(self, changes: Iterator[Tuple[str, Dict[str, FilingMetadata]]],
+                 ledger: Optional[RunLedger] = None) -> FetchOutcome:
         """Iterate over EINs flagged as having one or more new e-files since the last update. For each one, create or
         update its composite with the new data.
 
         :param changes: Iterator of (EIN, dictionary of (filing period -> Filing)).
+        :param ledger: If supplied, filings already composed in an earlier attempt are skipped, and progress through
+        each stage is recorded.
+        :return: The failure of every filing or EIN that could not be processed, and the changes deferred because the
+        staging area is over budget. The rest are unaffected.
         """
         change_list: List = list(changes)
-        json_changes: List[Tuple[str, Dict[str, str]]] = list(self.retrieve(change_list))
+        if ledger is not None:
+            change_list = ledger.pending(change_list, COMPOSED)
+        outcome: FetchOutcome = self.retrieve.fetch(change_list, ledger)
+        deferred_eins: Set[str] = {ein for ein, _ in outcome.deferred}
+        change_list = exclude_failed([change for change in change_list if change[0] not in deferred_eins],
+                                     outcome.failures)
         logging.info("Updating e-file composites.")
-
-        self.process_all(json_changes)
+        if self.use_plan:
+            compose_failures: List[ItemFailure] = self.process_all_planned(change_list)
+        else:
+            compose_failures = self.process_all(list(self.retrieve.json_tuples(change_list)))
+        if ledger is not None:
+            ledger.mark_changes(exclude_failed(change_list, compose_failures), COMPOSED)
+        outcome.failures += compose_failures
+        return outcome
 
 
 @dataclass
 class ComposeEfilesUpdater:
+    """Merges new filings into composites. Composites are replaced atomically, one batch of fsyncs per chunk, so an
+    interrupted run never leaves a truncated composite behind. A composite that already holds exactly the new filings,
+    as after reconverting them with an unchanged result, is left untouched."""
     path_mgr: EINPathManager
+    fsync: bool = True
 
     def _get_existing(self, ein: str) -> Dict:
         try:
@@ -52,16 +129,46 @@ class ComposeEfilesUpdater:
         except FileNotFoundError:
             return {}
 
-    def create_or_update(self, changes: List[Tuple[str, Dict[str, str]]]):
-        for change in changes:
-            ein, updates = change
-            composite: Dict = self._get_existing(ein)
-            for period, json_path in updates.items():
+    def _merge(self, ein: str, updates: Dict[str, str], writer: AtomicBatchWriter) -> bool:
+        """Returns whether the composite was written."""
+        composite: Dict = self._get_existing(ein)
+        changed: bool = False
+        for period, json_path in updates.items():
+            with open(json_path) as fh:
+                content: Dict = json.load(fh)
+            if period not in composite or composite[period] != content:
+                composite[period] = content
+                changed = True
+        if not changed:
+            return False
+        with self.path_mgr.open_for_writing(ein, TEMPLATE, writer) as fh:
+            json.dump(composite, fh, indent=2)
+        return True
+
+    def create_or_update(self, changes: List[Tuple[str, Dict[str, str]]]) -> List[ItemFailure]:
+        """Merges each EIN's new filings into its composite. An EIN whose composite cannot be updated is left as it was
+        and reported as a failure; the rest of the chunk carries on."""
+        metrics: MetricsRegistry = registry()
+        latency: Histogram = metrics.histogram("compose_merge_seconds", "Time taken to merge one EIN's new filings")
+        failures: List[ItemFailure] = []
+        n_written: int = 0
+        with AtomicBatchWriter(self.fsync) as writer:
+            for change in changes:
+                ein, updates = change
                 try:
-                    with open(json_path) as fh:
-                        content: Dict = json.load(fh)
-                    composite[period] = content
-                except FileNotFoundError as e:
-                    logging.warning(e)
-            with self.path_mgr.open_for_writing(ein, TEMPLATE) as fh:
-                json.dump(composite, fh, indent=2)
+                    with latency.time(), tracing.span("compose", "ein", ein=ein, filings=len(updates)):
+                        if self._merge(ein, updates, writer):
+                            n_written += 1
+                except Exception as e:
+                    failures.append(ItemFailure.capture(COMPOSED, ein, None, e))
+        metrics.counter("compose_writes_total", "Composites written").inc(n_written)
+        metrics.counter("compose_unchanged_total", "Composites that already held their new filings")\
+            .inc(len(changes) - len(failures) - n_written)
+        return failures
+
+    def create_or_update_planned(self, indices: Iterable[int], plan_path: str, json_paths: EINPathManager) \
+            -> List[ItemFailure]:
+        plan: ChangePlan = read_plan(plan_path)
+        return self.create_or_update([(ein, {period: json_path_for(json_paths, ein, irs_efile_id)
+                                      for period, irs_efile_id in updates.items()})
+                               for ein, updates in plan.changes(indices)])
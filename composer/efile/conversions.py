@@ -0,0 +1,40 @@
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+# Version of the XML to JSON conversion done by composer.efile.xmlio. Bump it whenever a change there alters the JSON
+# of any filing: filings converted by another version are then reconverted by the reconvert command, and are no longer
+# served from the conversion cache.
+CONVERTER_VERSION: str = "1"
+
+@dataclass
+class ConversionCache:
+    """JSON of converted filings, kept on disk by the SHA-256 of each filing's XML and the version of the converter that
+    produced it, so that a filing is never converted twice by the same converter. Entries are written atomically, so
+    the cache can be shared by every pool worker, and by any number of data paths."""
+
+    root: str
+    version: str = CONVERTER_VERSION
+
+    @staticmethod
+    def key(raw_xml: str) -> str:
+        return hashlib.sha256(raw_xml.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, self.version, key[:2], "%s.json" % key)
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key)) as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, as_text: str) -> None:
+        path: str = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path: str = "%s.%i.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as fh:
+            fh.write(as_text)
+        os.replace(tmp_path, path)
@@ -0,0 +1,147 @@
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from composer.efile.compose import TEMPLATE
+from composer.fileio.layout import LAYOUT_FILENAME
+from composer.fileio.paths import EINPathManager
+from composer.futures import run_on_thread_pool
+
+DEFAULT_CACHE_BYTES: int = 256 * 1024 * 1024
+
+def _layout_mtime_ns(basepath: str) -> Optional[int]:
+    try:
+        return os.stat(os.path.join(basepath, LAYOUT_FILENAME)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+@dataclass
+class _CacheEntry:
+    mtime_ns: int
+    size: int
+    composite: Dict
+
+@dataclass
+class CompositeReader:
+    """Random-access reader for e-file composites. Decoded composites are kept in a least-recently-used cache whose
+    capacity is expressed in bytes of composite JSON on disk. Cached composites are shared between callers and should be
+    treated as read-only.
+
+    A reader built for a data path follows a layout migration: when a composite is missing, it checks whether the
+    recorded layout has changed and, if so, looks again under the new layout."""
+
+    path_mgr: EINPathManager
+    max_cache_bytes: int = DEFAULT_CACHE_BYTES
+    cache_bytes: int = field(default=0, init=False)
+    _cache: "OrderedDict[str, _CacheEntry]" = field(default_factory=OrderedDict, init=False, repr=False)
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False)
+    _follows_layout: bool = field(default=False, init=False, repr=False)
+    _layout_mtime_ns: Optional[int] = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def build(cls, basepath: str, max_cache_bytes: int = DEFAULT_CACHE_BYTES) -> "CompositeReader":
+        layout_mtime_ns: Optional[int] = _layout_mtime_ns(basepath)
+        reader: CompositeReader = cls(EINPathManager.build(basepath), max_cache_bytes)
+        reader._follows_layout = True
+        reader._layout_mtime_ns = layout_mtime_ns
+        return reader
+
+    def _refresh_layout(self) -> bool:
+        """Switches to the data path's recorded layout if it has changed since it was last read. Returns whether it
+        had."""
+        layout_mtime_ns: Optional[int] = _layout_mtime_ns(self.path_mgr.basepath)
+        with self._lock:
+            if layout_mtime_ns == self._layout_mtime_ns:
+                return False
+            self.path_mgr = EINPathManager.build(self.path_mgr.basepath)
+            self._layout_mtime_ns = layout_mtime_ns
+            return True
+
+    def _evict(self, ein: str) -> None:
+        entry: Optional[_CacheEntry] = self._cache.pop(ein, None)
+        if entry is not None:
+            self.cache_bytes -= entry.size
+
+    def _store(self, ein: str, entry: _CacheEntry) -> None:
+        if entry.size > self.max_cache_bytes:
+            return
+        self._evict(ein)
+        self._cache[ein] = entry
+        self.cache_bytes += entry.size
+        while self.cache_bytes > self.max_cache_bytes:
+            _, evicted = self._cache.popitem(last=False)  # type: str, _CacheEntry
+            self.cache_bytes -= evicted.size
+
+    def _load(self, ein: str, refresh: bool = True) -> Optional[Dict]:
+        """Returns the composite for an EIN, decoding it from disk only if the cached copy is missing or stale."""
+        filepath: str = self.path_mgr.path_for(ein, TEMPLATE)
+        try:
+            stat: os.stat_result = os.stat(filepath)
+        except FileNotFoundError:
+            if refresh and self._follows_layout and self._refresh_layout():
+                return self._load(ein, refresh=False)
+            with self._lock:
+                self._evict(ein)
+            return None
+
+        with self._lock:
+            entry: Optional[_CacheEntry] = self._cache.get(ein)
+            if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                self._cache.move_to_end(ein)
+                return entry.composite
+
+        try:
+            with open(filepath) as fh:
+                composite: Dict = json.load(fh)
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            self._store(ein, _CacheEntry(stat.st_mtime_ns, stat.st_size, composite))
+        return composite
+
+    def _load_chunk(self, eins: List[str]) -> None:
+        for ein in eins:
+            self._load(ein)
+
+    def get(self, ein: str, periods: Optional[Iterable[str]] = None) -> Optional[Dict]:
+        """Returns the composite for an EIN, or None if no composite exists.
+
+        :param ein: The EIN whose composite should be returned
+        :param periods: If supplied, only these filing periods are included in the result
+        :return: A dictionary of filing period -> filing content.
+        """
+        composite: Optional[Dict] = self._load(ein)
+        if composite is None or periods is None:
+            return composite
+        return {period: composite[period] for period in periods if period in composite}
+
+    def prefetch(self, eins: Iterable[str], workers_count: Optional[int] = None) -> None:
+        """Loads composites for the supplied EINs into the cache on a thread pool. Reading is dominated by file I/O for
+        cold composites, so threads overlap well."""
+        run_on_thread_pool(self._load_chunk, list(eins), chunk_size=16, workers_count=workers_count)
+
+    def get_many(self, eins: Iterable[str], periods: Optional[Iterable[str]] = None,
+                 workers_count: Optional[int] = None, window: int = 256) -> Iterator[Tuple[str, Optional[Dict]]]:
+        """Yields (EIN, composite) for each of the supplied EINs, in order. Composites are prefetched in parallel one
+        window at a time, so the cache only needs to hold a window's worth of composites to avoid repeated reads."""
+        if periods is not None:
+            periods = list(periods)
+        ein_list: List[str] = list(eins)
+        for start in range(0, len(ein_list), window):
+            batch: List[str] = ein_list[start:start + window]
+            self.prefetch(batch, workers_count=workers_count)
+            for ein in batch:
+                yield ein, self.get(ein, periods)
+
+    def invalidate(self, ein: Optional[str] = None) -> None:
+        """Drops a single EIN, or the entire cache if no EIN is given."""
+        with self._lock:
+            if ein is None:
+                self._cache.clear()
+                self.cache_bytes = 0
+            else:
+                self._evict(ein)
@@ -0,0 +1,50 @@
+from dataclasses import dataclass
+from sqlite3 import Connection, Cursor
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from composer.efile.structures.metadata import FilingMetadata
+
+def _init_conversions_table(conn: Connection) -> None:
+    cursor: Cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversions (
+            irs_efile_id text PRIMARY KEY,
+            converter_version text NOT NULL
+        );
+    """)
+    conn.commit()
+
+@dataclass
+class ConversionLog:
+    """Version of the converter that produced the JSON of each filing in the composites, kept in the e-file state
+    database. Filings composed before versions were recorded have no entry."""
+
+    conn: Connection
+
+    @classmethod
+    def build(cls, conn: Connection) -> "ConversionLog":
+        _init_conversions_table(conn)
+        return cls(conn)
+
+    def record(self, irs_efile_ids: Iterable[str], version: str) -> None:
+        rows: List[Tuple[str, str]] = [(irs_efile_id, version) for irs_efile_id in irs_efile_ids]
+        cursor: Cursor = self.conn.cursor()
+        cursor.executemany("INSERT OR REPLACE INTO conversions VALUES (?, ?)", rows)
+        self.conn.commit()
+
+    def version_of(self, irs_efile_id: str) -> Optional[str]:
+        cursor: Cursor = self.conn.cursor()
+        row: Optional[tuple] = cursor.execute("SELECT converter_version FROM conversions WHERE irs_efile_id = ?",
+                                              (irs_efile_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def stale(self, version: str) -> Iterator[FilingMetadata]:
+        """Yields the latest filings whose JSON was produced by any other version of the converter, or by an unknown
+        one."""
+        cursor: Cursor = self.conn.cursor()
+        for row in cursor.execute("""
+            SELECT latest_filings.* FROM latest_filings
+            LEFT JOIN conversions ON latest_filings.irs_efile_id = conversions.irs_efile_id
+            WHERE conversions.converter_version IS NULL OR conversions.converter_version != ?
+        """, (version,)):
+            yield FilingMetadata(*row)
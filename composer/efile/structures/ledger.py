@@ -0,0 +1,147 @@
+import dataclasses
+import logging
+from sqlite3 import Connection, Cursor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from composer.efile.structures.mdindex import EfileMetadataIndex
+from composer.efile.structures.metadata import FilingMetadata
+
+STAGED = "staged"
+DOWNLOADED = "downloaded"
+CONVERTED = "converted"
+COMPOSED = "composed"
+
+STAGES: List[str] = [STAGED, DOWNLOADED, CONVERTED, COMPOSED]
+
+_FILING_COLUMNS: List[str] = [f.name for f in dataclasses.fields(FilingMetadata)]
+
+def _init_ledger_tables(conn: Connection) -> None:
+    cursor: Cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS run_filings (
+            record_id text NOT NULL,
+            irs_efile_id text PRIMARY KEY,
+            irs_dln text NOT NULL,
+            ein text NOT NULL,
+            period text NOT NULL,
+            name_org text NOT NULL,
+            form_type text NOT NULL,
+            date_submitted text NOT NULL,
+            date_uploaded text NOT NULL,
+            date_downloaded text NOT NULL,
+            url text NOT NULL,
+            is_duplicate integer NOT NULL,
+            stage text NOT NULL
+        );
+    """)
+    cursor.execute("CREATE TABLE IF NOT EXISTS run_eins (ein text PRIMARY KEY, committed integer NOT NULL);")
+    cursor.execute("CREATE TABLE IF NOT EXISTS run_state (key text PRIMARY KEY, value text NOT NULL);")
+    conn.commit()
+
+@dataclasses.dataclass
+class RunLedger:
+    """Persistent record of an update run, kept in the e-file state database. Tracks the furthest stage that each
+    staged filing has completed and whether each changed EIN has been committed to the metadata index, so that an
+    interrupted run can continue from where it stopped."""
+
+    conn: Connection
+    stages: Dict[str, str] = dataclasses.field(default_factory=dict, init=False)
+
+    @classmethod
+    def build(cls, conn: Connection) -> "RunLedger":
+        _init_ledger_tables(conn)
+        ledger: RunLedger = cls(conn)
+        ledger._load_stages()
+        return ledger
+
+    def _load_stages(self) -> None:
+        cursor: Cursor = self.conn.cursor()
+        for irs_efile_id, stage in cursor.execute("SELECT irs_efile_id, stage FROM run_filings WHERE is_duplicate = 0"):
+            self.stages[irs_efile_id] = stage
+
+    @property
+    def in_progress(self) -> bool:
+        cursor: Cursor = self.conn.cursor()
+        row: Tuple = cursor.execute("SELECT COUNT(*) FROM run_state").fetchone()
+        return row[0] > 0
+
+    def get_state(self, key: str) -> Optional[str]:
+        cursor: Cursor = self.conn.cursor()
+        row: Optional[Tuple] = cursor.execute("SELECT value FROM run_state WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def begin(self, md_index: EfileMetadataIndex, state: Dict[str, str]) -> None:
+        """Records every change and duplicate staged in the metadata index, along with any values (such as staging
+        directories) needed to resume the run."""
+        self.clear()
+        placeholders: str = ", ".join(["?"] * (len(_FILING_COLUMNS) + 2))
+        query: str = "INSERT INTO run_filings VALUES (%s)" % placeholders
+        cursor: Cursor = self.conn.cursor()
+        cursor.executemany(query, (dataclasses.astuple(filing) + (0, STAGED)
+                                   for _, updates in md_index.changes for filing in updates.values()))
+        cursor.executemany(query, (dataclasses.astuple(filing) + (1, STAGED)
+                                   for filing in md_index.staged_dupes.values()))
+        cursor.executemany("INSERT INTO run_eins VALUES (?, 0)", ((ein,) for ein, _ in md_index.changes))
+        cursor.executemany("INSERT INTO run_state VALUES (?, ?)", state.items())
+        self.conn.commit()
+        self._load_stages()
+
+    def restore(self, md_index: EfileMetadataIndex) -> None:
+        """Re-stages, in the metadata index, every recorded change and duplicate whose EIN has not been committed."""
+        placeholders: str = ", ".join("f.%s" % column for column in _FILING_COLUMNS)
+        query: str = """
+            SELECT %s, f.is_duplicate FROM run_filings f LEFT JOIN run_eins e ON f.ein = e.ein
+            WHERE e.committed IS NULL OR e.committed = 0
+        """ % placeholders
+        cursor: Cursor = self.conn.cursor()
+        n_restored: int = 0
+        for row in cursor.execute(query):
+            filing: FilingMetadata = FilingMetadata(*row[:-1])
+            if row[-1]:
+                md_index.staged_dupes[filing.irs_efile_id] = filing
+            else:
+                md_index.staged_changes[filing.ein][filing.period] = filing
+            n_restored += 1
+        logging.info("Restored {:,} staged filings from the run ledger.".format(n_restored))
+
+    def reached(self, irs_efile_id: str, stage: str) -> bool:
+        """True if the filing has completed the given stage (or a later one) in this run."""
+        current: str = self.stages.get(irs_efile_id, STAGED)
+        return STAGES.index(current) >= STAGES.index(stage)
+
+    def mark(self, irs_efile_ids: Iterable[str], stage: str) -> None:
+        """Records that the given filings have completed a stage, in a single transaction."""
+        ids: List[str] = list(irs_efile_ids)
+        cursor: Cursor = self.conn.cursor()
+        cursor.executemany("UPDATE run_filings SET stage = ? WHERE irs_efile_id = ?", ((stage, i) for i in ids))
+        self.conn.commit()
+        for irs_efile_id in ids:
+            self.stages[irs_efile_id] = stage
+
+    def pending(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]], stage: str) \
+            -> List[Tuple[str, Dict[str, FilingMetadata]]]:
+        """Filters (EIN, period -> filing) changes down to the filings that have not yet completed the given stage,
+        omitting EINs with nothing left to do."""
+        ret: List[Tuple[str, Dict[str, FilingMetadata]]] = []
+        for ein, updates in changes:
+            remaining: Dict[str, FilingMetadata] = {period: filing for period, filing in updates.items()
+                                                    if not self.reached(filing.irs_efile_id, stage)}
+            if len(remaining) > 0:
+                ret.append((ein, remaining))
+        return ret
+
+    def mark_changes(self, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]], stage: str) -> None:
+        self.mark((filing.irs_efile_id for _, updates in changes for filing in updates.values()), stage)
+
+    def mark_committed(self, eins: Iterable[str]) -> None:
+        cursor: Cursor = self.conn.cursor()
+        cursor.executemany("UPDATE run_eins SET committed = 1 WHERE ein = ?", ((ein,) for ein in eins))
+        self.conn.commit()
+
+    def clear(self) -> None:
+        """Forgets the current run."""
+        cursor: Cursor = self.conn.cursor()
+        for table in ["run_filings", "run_eins", "run_state"]:
+            cursor.execute("DELETE FROM %s" % table)
+        self.conn.commit()
+        self.stages.clear()
@@ -2,7 +2,7 @@ import logging
 import sqlite3
 from collections import defaultdict, deque
 from dataclasses import field, dataclass
-from typing import Iterator, Dict, Tuple, List, Deque
+from typing import Iterator, Dict, Tuple, List, Deque, Iterable, Optional, Set
 
 from composer.efile.structures.metadata import FilingMetadata
 from composer.efile.structures.sqlite import EfileIndexTable
@@ -92,15 +92,46 @@ class EfileMetadataIndex:
         else:
             self._choose_between_new_and_existing(filing)
 
-    def commit(self):
-        """Commits all changes that were staged."""
-        logging.info("Committing observed changes to persistent e-file metadata index.")
-        for filing in self.staged_dupes.values():
+    def restage(self, filing: FilingMetadata) -> None:
+        """Stages a filing that is already recorded as the latest for its EIN/period, so that it is processed again.
+        Committing it leaves the index as it was."""
+        self.staged_changes[filing.ein][filing.period] = filing
+
+    def is_staged_change(self, filing: FilingMetadata) -> bool:
+        staged: Optional[FilingMetadata] = self.staged_changes.get(filing.ein, {}).get(filing.period)
+        return staged is not None and staged.irs_efile_id == filing.irs_efile_id
+
+    def discard(self, filings: Iterable[FilingMetadata]) -> None:
+        """Unstages the given changes, along with any duplicates staged for the same EIN/period, so that the index is
+        left as it was for those periods when the changes are committed."""
+        record_ids: Set[str] = set()
+        for filing in filings:
+            staged: Dict[str, FilingMetadata] = self.staged_changes.get(filing.ein, {})
+            if filing.period in staged and staged[filing.period].irs_efile_id == filing.irs_efile_id:
+                del staged[filing.period]
+                if len(staged) == 0:
+                    del self.staged_changes[filing.ein]
+            record_ids.add(filing.record_id)
+        for irs_efile_id in [i for i, dupe in self.staged_dupes.items() if dupe.record_id in record_ids]:
+            del self.staged_dupes[irs_efile_id]
+
+    def commit(self, eins: Optional[Iterable[str]] = None):
+        """Commits all changes that were staged. If EINs are supplied, commits only the changes and duplicates staged
+        for those EINs, leaving the rest staged."""
+        if eins is None:
+            logging.info("Committing observed changes to persistent e-file metadata index.")
+            dupes: List[FilingMetadata] = list(self.staged_dupes.values())
+            ein_set: Set[str] = set(self.staged_changes.keys())
+        else:
+            ein_set = set(eins)
+            dupes = [filing for filing in self.staged_dupes.values() if filing.ein in ein_set]
+
+        for filing in dupes:
             self.latest_filings.delete_if_exists(filing.irs_efile_id)
             self.duplicates.upsert(filing)
-        self.staged_dupes.clear()
+            del self.staged_dupes[filing.irs_efile_id]
 
-        for change_list in self.staged_changes.values():
+        for ein in ein_set:
+            change_list: Dict[str, FilingMetadata] = self.staged_changes.pop(ein, {})
             for filing in change_list.values():
                 self.latest_filings.upsert(filing)
-        self.staged_changes.clear()
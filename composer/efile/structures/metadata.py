@@ -1,10 +1,7 @@
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict
-from datetime import datetime
-
-from pytz import timezone
-
-tz = timezone('America/New_York')
+from datetime import datetime, tzinfo
 
 FIELD_EQUIVALENTS = {
     "EIN": "ein",
@@ -18,6 +15,17 @@ FIELD_EQUIVALENTS = {
     "LastUpdated": "date_uploaded"
 }
 
+@lru_cache(maxsize=None)
+def eastern() -> tzinfo:
+    """The IRS's time zone, in which download and quarantine times are recorded. pytz is imported on first use, as it
+    is slow to import."""
+    from pytz import timezone
+    return timezone('America/New_York')
+
+def download_time() -> str:
+    """The current time in the IRS's time zone, as recorded in date_downloaded."""
+    return datetime.now(eastern()).strftime("%Y-%m-%d %H:%M:%S")
+
 @dataclass
 class FilingMetadata:
     record_id: str
@@ -33,12 +41,12 @@ class FilingMetadata:
     url: str
 
     @classmethod
-    def from_json(cls, content: Dict) -> "FilingMetadata":
-        params: Dict = {}
-        for irs_key, anr_key in FIELD_EQUIVALENTS.items():
-            params[anr_key] = content[irs_key]
+    def from_fields(cls, params: Dict[str, str], date_downloaded: str) -> "FilingMetadata":
+        """Builds a filing's metadata from its index fields, keyed by their names here (the values of
+        FIELD_EQUIVALENTS)."""
+        return cls(record_id="%s_%s" % (params["ein"], params["period"]), date_downloaded=date_downloaded, **params)
 
-        date_downloaded: datetime = datetime.now(tz)
-        params["date_downloaded"] = date_downloaded.strftime("%Y-%m-%d %H:%M:%S")
-        params["record_id"] = "%s_%s" % (params["ein"], params["period"])
-        return cls(**params)
+    @classmethod
+    def from_json(cls, content: Dict) -> "FilingMetadata":
+        params: Dict[str, str] = {anr_key: content[irs_key] for irs_key, anr_key in FIELD_EQUIVALENTS.items()}
+        return cls.from_fields(params, download_time())
@@ -0,0 +1,130 @@
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from composer.efile.structures.metadata import FilingMetadata
+
+_MAGIC: bytes = b"CPLAN001"
+_HEADER: struct.Struct = struct.Struct("=8sQQ")  # magic, number of filings, number of EINs
+_RECORD: struct.Struct = struct.Struct("=9s6s24s")  # EIN, period, IRS e-file ID; NUL-padded ASCII
+
+class ChangePlan:
+    """Compact, read-only table of the filings to process in one stage, stored in a memory-mapped file. Each record
+    holds an EIN, a period and an IRS e-file ID; records for an EIN are contiguous, and an offsets table at the end of
+    the file maps each EIN's position in the plan to its first record.
+
+    The plan is written once by the parent. Pool workers are then handed only EIN positions (typically as range
+    objects) along with the plan's path, and read their share of the work straight out of the page cache, with no
+    per-filing pickling. The file uses native byte order, as it never outlives the machine that wrote it."""
+
+    def __init__(self, path: str, mm: mmap.mmap, n_filings: int, n_eins: int):
+        self.path: str = path
+        self.n_filings: int = n_filings
+        self._mm: mmap.mmap = mm
+        offsets_start: int = _HEADER.size + n_filings * _RECORD.size
+        self._offsets: memoryview = memoryview(mm)[offsets_start:offsets_start + (n_eins + 1) * 8].cast("Q")
+        self._identity: Tuple[int, int] = _identity(path)
+
+    @classmethod
+    def write(cls, path: str, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]) -> "ChangePlan":
+        """Streams (EIN, period -> filing) changes into a plan file at the given path and opens it."""
+        offsets: array = array("Q", [0])
+        n_filings: int = 0
+        with open(path, "wb") as fh:
+            fh.write(_HEADER.pack(_MAGIC, 0, 0))
+            for ein, updates in changes:
+                for period, filing in updates.items():
+                    fh.write(_RECORD.pack(_encode(ein, 9), _encode(period, 6), _encode(filing.irs_efile_id, 24)))
+                    n_filings += 1
+                offsets.append(n_filings)
+            offsets.tofile(fh)
+            fh.seek(0)
+            fh.write(_HEADER.pack(_MAGIC, n_filings, len(offsets) - 1))
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path: str) -> "ChangePlan":
+        with open(path, "rb") as fh:
+            mm: mmap.mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_filings, n_eins = _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC:
+            mm.close()
+            raise ValueError("%s is not a change plan" % path)
+        return cls(path, mm, n_filings, n_eins)
+
+    def __len__(self) -> int:
+        """Number of EINs in the plan."""
+        return len(self._offsets) - 1
+
+    def _record(self, position: int) -> Tuple[str, str, str]:
+        ein, period, irs_efile_id = _RECORD.unpack_from(self._mm, _HEADER.size + position * _RECORD.size)
+        return _decode(ein), _decode(period), _decode(irs_efile_id)
+
+    def filings(self, indices: Iterable[int]) -> Iterator[Tuple[str, str, str]]:
+        """Yields (EIN, period, IRS e-file ID) for every filing of the EINs at the given positions."""
+        for index in indices:
+            for position in range(self._offsets[index], self._offsets[index + 1]):
+                yield self._record(position)
+
+    def changes(self, indices: Iterable[int]) -> Iterator[Tuple[str, Dict[str, str]]]:
+        """Yields (EIN, period -> IRS e-file ID) for the EINs at the given positions."""
+        for index in indices:
+            updates: Dict[str, str] = {}
+            ein: Optional[str] = None
+            for position in range(self._offsets[index], self._offsets[index + 1]):
+                ein, period, irs_efile_id = self._record(position)
+                updates[period] = irs_efile_id
+            if ein is not None:
+                yield ein, updates
+
+    def close(self) -> None:
+        self._offsets.release()
+        self._mm.close()
+
+    def __enter__(self) -> "ChangePlan":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+def _encode(value: str, width: int) -> bytes:
+    encoded: bytes = value.encode("ascii")
+    if len(encoded) > width:
+        raise ValueError("'%s' does not fit in a %i-byte change plan field" % (value, width))
+    return encoded
+
+def _decode(value: bytes) -> str:
+    return value.rstrip(b"\0").decode("ascii")
+
+def _identity(path: str) -> Tuple[int, int]:
+    stat: os.stat_result = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
+
+@contextmanager
+def temporary_plan(directory: str, changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]]) -> Iterator[ChangePlan]:
+    """Writes changes to a uniquely named plan file in the given directory, which is removed on exit."""
+    fd, path = tempfile.mkstemp(prefix=".plan-", suffix=".bin", dir=directory)
+    os.close(fd)
+    try:
+        with ChangePlan.write(path, changes) as plan:
+            yield plan
+    finally:
+        os.remove(path)
+
+# Per-process handle on the plan most recently read by a pool worker
+_worker_plan: Optional[ChangePlan] = None
+
+def read_plan(path: str) -> ChangePlan:
+    """Returns an open handle on the plan at the given path, reusing this process's handle from an earlier chunk if it
+    still refers to the same file."""
+    global _worker_plan
+    if _worker_plan is not None and _worker_plan.path == path and _worker_plan._identity == _identity(path):
+        return _worker_plan
+    if _worker_plan is not None:
+        _worker_plan.close()
+    _worker_plan = ChangePlan.open(path)
+    return _worker_plan
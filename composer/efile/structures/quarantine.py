@@ -0,0 +1,143 @@
+import dataclasses
+import logging
+import traceback
+from datetime import datetime
+from sqlite3 import Connection, Cursor
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from composer.efile.structures.metadata import FilingMetadata, eastern
+
+_FILING_COLUMNS: List[str] = [f.name for f in dataclasses.fields(FilingMetadata)]
+
+@dataclasses.dataclass
+class ItemFailure:
+    """An error raised while processing a single item in a pool worker. Failures are returned to the parent rather than
+    raised, so that the rest of the chunk carries on. If irs_efile_id is None, the failure applies to every filing of
+    the EIN. A failure that timed_out may succeed if retried with a longer time limit."""
+
+    stage: str
+    ein: str
+    irs_efile_id: Optional[str]
+    error: str
+    traceback: str
+    timed_out: bool = False
+
+    @classmethod
+    def capture(cls, stage: str, ein: str, irs_efile_id: Optional[str], e: BaseException,
+                timed_out: bool = False) -> "ItemFailure":
+        """Builds a failure from the exception currently being handled."""
+        subject: str = ein if irs_efile_id is None else "%s (EIN %s)" % (irs_efile_id, ein)
+        logging.warning("Failed to process %s at stage '%s': %r" % (subject, stage, e))
+        return cls(stage, ein, irs_efile_id, repr(e), traceback.format_exc(), timed_out)
+
+def flatten_failures(chunk_results: Iterable[Optional[List[ItemFailure]]]) -> List[ItemFailure]:
+    return [failure for result in chunk_results if result is not None for failure in result]
+
+def expand_failures(changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]], failures: Iterable[ItemFailure]) \
+        -> List[Tuple[FilingMetadata, ItemFailure]]:
+    """Pairs each failure with the filing it applies to. EIN-wide failures are paired with every filing of the EIN."""
+    by_ein: Dict[str, List[ItemFailure]] = {}
+    for failure in failures:
+        by_ein.setdefault(failure.ein, []).append(failure)
+    ret: List[Tuple[FilingMetadata, ItemFailure]] = []
+    for ein, updates in changes:
+        for failure in by_ein.get(ein, []):
+            for filing in updates.values():
+                if failure.irs_efile_id is None or failure.irs_efile_id == filing.irs_efile_id:
+                    ret.append((filing, failure))
+    return ret
+
+def exclude_failed(changes: Iterable[Tuple[str, Dict[str, FilingMetadata]]], failures: Iterable[ItemFailure]) \
+        -> List[Tuple[str, Dict[str, FilingMetadata]]]:
+    """Removes failed filings from (EIN, period -> filing) changes, omitting EINs with nothing left."""
+    failed_eins: Set[str] = set()
+    failed_ids: Set[str] = set()
+    for failure in failures:
+        if failure.irs_efile_id is None:
+            failed_eins.add(failure.ein)
+        else:
+            failed_ids.add(failure.irs_efile_id)
+    ret: List[Tuple[str, Dict[str, FilingMetadata]]] = []
+    for ein, updates in changes:
+        if ein in failed_eins:
+            continue
+        remaining: Dict[str, FilingMetadata] = {period: filing for period, filing in updates.items()
+                                                if filing.irs_efile_id not in failed_ids}
+        if len(remaining) > 0:
+            ret.append((ein, remaining))
+    return ret
+
+def _init_quarantine_table(conn: Connection) -> None:
+    cursor: Cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quarantine (
+            record_id text NOT NULL,
+            irs_efile_id text PRIMARY KEY,
+            irs_dln text NOT NULL,
+            ein text NOT NULL,
+            period text NOT NULL,
+            name_org text NOT NULL,
+            form_type text NOT NULL,
+            date_submitted text NOT NULL,
+            date_uploaded text NOT NULL,
+            date_downloaded text NOT NULL,
+            url text NOT NULL,
+            stage text NOT NULL,
+            error text NOT NULL,
+            traceback text NOT NULL,
+            attempts integer NOT NULL,
+            date_quarantined text NOT NULL
+        );
+    """)
+    conn.commit()
+
+@dataclasses.dataclass
+class Quarantine:
+    """Filings that could not be processed, kept in the e-file state database along with the stage that failed and the
+    error raised. Quarantined filings are left out of the metadata index, so their composites and the index stay in
+    agreement, and can be retried on their own."""
+
+    conn: Connection
+
+    @classmethod
+    def build(cls, conn: Connection) -> "Quarantine":
+        _init_quarantine_table(conn)
+        return cls(conn)
+
+    def add(self, failed: Iterable[Tuple[FilingMetadata, ItemFailure]]) -> None:
+        """Records failed filings. A filing that is already quarantined has its error replaced and its attempt count
+        incremented."""
+        now: str = datetime.now(eastern()).strftime("%Y-%m-%d %H:%M:%S")
+        placeholders: str = ", ".join(["?"] * (len(_FILING_COLUMNS) + 3))
+        query: str = """
+            INSERT OR REPLACE INTO quarantine
+            VALUES (%s, COALESCE((SELECT attempts FROM quarantine WHERE irs_efile_id = ?), 0) + 1, ?)
+        """ % placeholders
+        cursor: Cursor = self.conn.cursor()
+        cursor.executemany(query, (dataclasses.astuple(filing) + (failure.stage, failure.error, failure.traceback,
+                                                                  filing.irs_efile_id, now)
+                                   for filing, failure in failed))
+        self.conn.commit()
+
+    def release(self, irs_efile_ids: Iterable[str]) -> None:
+        """Removes filings from quarantine, typically because they have now been processed successfully."""
+        cursor: Cursor = self.conn.cursor()
+        cursor.executemany("DELETE FROM quarantine WHERE irs_efile_id = ?", ((i,) for i in irs_efile_ids))
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        cursor: Cursor = self.conn.cursor()
+        return cursor.execute("SELECT COUNT(*) FROM quarantine").fetchone()[0]
+
+    def __iter__(self) -> Iterator[FilingMetadata]:
+        """Yields the metadata of every quarantined filing."""
+        query: str = "SELECT %s FROM quarantine" % ", ".join(_FILING_COLUMNS)
+        cursor: Cursor = self.conn.cursor()
+        for row in cursor.execute(query):
+            yield FilingMetadata(*row)
+
+    def failures(self) -> Iterator[ItemFailure]:
+        """Yields the most recent failure of every quarantined filing."""
+        cursor: Cursor = self.conn.cursor()
+        for row in cursor.execute("SELECT stage, ein, irs_efile_id, error, traceback FROM quarantine"):
+            yield ItemFailure(*row)
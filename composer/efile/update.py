@@ -1,29 +1,134 @@
+import functools
 import logging
 import os
+import time
+import shutil
 from collections.abc import Callable
 from dataclasses import dataclass
 from sqlite3 import Connection, connect
+from typing import Any, Dict, Iterable, List, Set, Tuple, Optional, TYPE_CHECKING
 
-from composer.aws.efile.bucket import efile_bucket
+from composer.aws.efile.bucket import efile_bucket, use_credentials, use_local_source
+from composer.aws.efile.filings import FetchOutcome, Prefetcher, init_efile_worker, EFILE_WORKER_PRELOAD
 from composer.aws.efile.indices import EfileIndices
-from composer.aws.s3 import Bucket
+from composer.aws.inventory import BucketInventory, ObjectListing, read_manifest
+from composer.aws.s3 import Bucket, LocalBucket
+from composer.efile.conversions import CONVERTER_VERSION, ConversionCache
+from composer.efile.structures.conversions import ConversionLog
+from composer.efile.structures.ledger import RunLedger, DOWNLOADED
 from composer.efile.structures.mdindex import EfileMetadataIndex
+from composer.efile.structures.quarantine import ItemFailure, Quarantine, exclude_failed, expand_failures
 from composer.efile.compose import ComposeEfiles
+from composer.efile.structures.metadata import FilingMetadata
 from composer.efile.structures.sqlite import init_sqlite_db
-from composer.timer import TimeLogger
+from composer.futures import SharedPool
+from composer import profiling, tracing
+from composer.metrics import Histogram, MetricsRegistry, registry, reset
+
+if TYPE_CHECKING:
+    from composer.aws.handshake import Handshake
+
+# Index entries between progress messages in the index pass
+INDEX_LOG_EVERY: int = 100000
+
+# Name of the JSON report and Prometheus textfile written at the end of each run
+METRICS_NAME: str = "efile_metrics"
+
+# Directory of the data path that receives profiles
+PROFILE_DIRECTORY: str = "profile"
+
+def _write_report(kind: str, write: Callable, *args: Any) -> None:
+    """Writes one of a run's reports. A report that cannot be written is logged rather than raised, so that it neither
+    stops the other reports from being written nor masks the exception that ended the run."""
+    try:
+        write(*args)
+    except Exception:
+        logging.exception("Could not write the run's %s." % kind)
 
 @dataclass
 class UpdateEfileState(Callable):
+    """Brings a data path up to date with the IRS e-file indices. Changed EINs are processed in batches; after each
+    batch is composed, the metadata for its EINs is committed and recorded in the run ledger. An interrupted run can
+    therefore be resumed without repeating the index pass or any completed work.
+
+    A shared pool is started once and used to parse the indices and by the download, conversion and compose stages of
+    every batch. Unless one is supplied, a pool of the default size is started before any of the run's threads, so its
+    workers are never forked from a multi-threaded process.
+
+    A filing that fails in any stage is quarantined rather than failing the run: it is recorded in the quarantine table
+    and left out of the metadata index, so it is picked up again by the next update. With retry_quarantined, the
+    quarantined filings are processed on their own in place of the e-file indices.
+
+    The version of the converter that produced each composed filing's JSON is recorded in the state database. With
+    reconvert, the filings recorded with any other version, or with none, are downloaded and converted again on their
+    own, in place of the e-file indices; composites whose filings convert exactly as before are not rewritten.
+
+    The staged files of each batch are discarded once it is committed. If the retrieval stage defers part of a batch
+    because its staging area is over budget, the deferred EINs are carried over to the start of the next batch.
+
+    With prefetch, new filings are downloaded in the background as soon as the index pass stages them, so that the
+    network is not idle while the indices are read: the indices stream in year by year, and each year's new filings
+    start downloading while later years are still being fetched and parsed. Prefetched filings that are still changes once the pass is over
+    are recorded in the run ledger as downloaded; the rest are discarded.
+
+    Every run, even a failed one, ends by writing its metrics (see composer.metrics) to efile_metrics.json and
+    efile_metrics.prom in metrics_path, which defaults to the data path. With a trace_path, spans for every stage,
+    batch and filing, in every process, are written there as a Chrome trace (see composer.tracing). With profile, CPU
+    and memory profiles of each stage, merged across processes, are written to the profile directory of the data path
+    (see composer.profiling).
+
+    With an inventory_source, each run starts by listing the bucket into an inventory kept in the state database (see
+    composer.aws.inventory). The index pass and the download stage then look objects up in it instead of requesting
+    them, and objects whose ETag changed since the previous run are reported."""
+
     basepath: str
     indices: EfileIndices
     compose: ComposeEfiles
+    resume: bool = False
+    batch_size: int = 10000
+    pool: Optional[SharedPool] = None
+    retry_quarantined: bool = False
+    reconvert: bool = False
+    prefetch: bool = False
+    metrics_path: Optional[str] = None
+    trace_path: Optional[str] = None
+    profile: bool = False
+    inventory_source: Optional[ObjectListing] = None
 
     @classmethod
-    def build(cls, basepath: str, temp_path: str, no_cleanup: bool) -> "UpdateEfileState":
+    def build(cls, basepath: str, temp_path: str, no_cleanup: bool, resume: bool = False,
+              use_plan: bool = False, retry_quarantined: bool = False,
+              staging_budget: Optional[int] = None, prefetch: bool = False,
+              metrics_path: Optional[str] = None, trace_path: Optional[str] = None,
+              profile: bool = False, source: Optional[LocalBucket] = None,
+              handshake: Optional["Handshake"] = None, inventory: bool = False,
+              inventory_manifest: Optional[str] = None, reconvert: bool = False,
+              conversion_cache: Optional[str] = None) -> "UpdateEfileState":
+        """With a source, e-file indices and filings are read from that local mirror of the IRS bucket rather than
+        from S3. With a handshake, the bucket is read with its S3 credentials, which are resolved once here and handed
+        to the pool workers.
+
+        With inventory, the bucket is listed at the start of each run. An inventory_manifest, given as BUCKET/KEY of
+        the manifest.json of an S3 Inventory report on the IRS bucket, is read in place of the listing.
+
+        With a conversion_cache directory, converted filings are kept there and reused (see ConversionCache)."""
+        use_local_source(source)
+        credentials: Optional["Handshake"] = use_credentials(handshake)
         bucket: Bucket = efile_bucket()
         indices: EfileIndices = EfileIndices(bucket)
-        compose: ComposeEfiles = ComposeEfiles.build(basepath, temp_path, no_cleanup)
-        return cls(basepath, indices, compose)
+        cache: Optional[ConversionCache] = None if conversion_cache is None else ConversionCache(conversion_cache)
+        compose: ComposeEfiles = ComposeEfiles.build(basepath, temp_path, no_cleanup, use_plan, staging_budget, cache)
+        pool: SharedPool = SharedPool(start_method="forkserver", preload=EFILE_WORKER_PRELOAD,
+                                      initializer=init_efile_worker, initargs=(source, credentials))
+        inventory_source: Optional[ObjectListing] = bucket.list_objects if inventory else None
+        if inventory_manifest is not None:
+            manifest_bucket, manifest_key = inventory_manifest.split("/", 1)
+            reports: Bucket = Bucket.build(manifest_bucket) if credentials is None \
+                else Bucket.build_authenticated(credentials, manifest_bucket)
+            inventory_source = functools.partial(read_manifest, reports, manifest_key)
+        return cls(basepath, indices, compose, resume, pool=pool, retry_quarantined=retry_quarantined,
+                   reconvert=reconvert, prefetch=prefetch, metrics_path=metrics_path, trace_path=trace_path,
+                   profile=profile, inventory_source=inventory_source)
 
     def _connect(self) -> Connection:
         sqlite_path: str = os.path.join(self.basepath, "state.sqlite")
@@ -34,20 +139,157 @@ class UpdateEfileState(Callable):
             logging.info("e-File state database does not exist; initializing.")
             return init_sqlite_db(sqlite_path)
 
-    def _index_changes(self) -> EfileMetadataIndex:
-        conn: Connection = self._connect()
+    def _refresh_inventory(self, conn: Connection) -> None:
+        """Lists the bucket into the inventory and hands the inventory to the index pass and the retrieval stage."""
+        with tracing.span("inventory", "stage"):
+            inventory: BucketInventory = BucketInventory.build(conn)
+            changed: List[str] = inventory.refresh(self.inventory_source())
+        registry().counter("inventory_changed_total", "Objects whose ETag changed since the last inventory")\
+            .inc(len(changed))
+        if len(changed) > 0:
+            logging.warning("{:,} objects were replaced in the bucket since the last inventory, including {}."
+                            .format(len(changed), ", ".join(changed[:10])))
+        if isinstance(self.indices, EfileIndices):
+            self.indices.inventory = inventory
+        self.compose.retrieve.inventory = inventory
+
+    def _stage_stale(self, conn: Connection) -> EfileMetadataIndex:
+        """Stages the filings whose JSON was produced by another version of the converter, to be converted again."""
         md_index: EfileMetadataIndex = EfileMetadataIndex.build(conn)
-        t_log: TimeLogger = TimeLogger("Considered {:,} e-File index entries")
-        for filing_md in self.indices:
-            fn: Callable = lambda: md_index.add(filing_md)
-            t_log.measure(fn)
-        t_log.finish()
+        n_stale: int = 0
+        for filing_md in ConversionLog.build(conn).stale(CONVERTER_VERSION):
+            md_index.restage(filing_md)
+            n_stale += 1
+        logging.info("Reconverting {:,} filings not converted by version {} of the converter."
+                     .format(n_stale, CONVERTER_VERSION))
+        return md_index
+
+    def _index_changes(self, conn: Connection, prefetcher: Optional[Prefetcher] = None) -> EfileMetadataIndex:
+        if self.reconvert:
+            return self._stage_stale(conn)
+        md_index: EfileMetadataIndex = EfileMetadataIndex.build(conn)
+        metrics: MetricsRegistry = registry()
+        latency: Histogram = metrics.histogram("index_add_seconds", "Time taken to stage one index entry")
+        # One iterable of filings per year, so the prefetcher can be flushed as each year is staged
+        source: Iterable[Iterable[FilingMetadata]] = self.indices.by_year()
+        quarantined: List[FilingMetadata] = []
+        if self.retry_quarantined:
+            quarantined = list(Quarantine.build(conn))
+            logging.info("Retrying {:,} quarantined filings.".format(len(quarantined)))
+            source = [quarantined]
+        start: float = time.monotonic()
+        for filings in source:
+            for filing_md in filings:
+                with latency.time():
+                    md_index.add(filing_md)
+                if latency.count % INDEX_LOG_EVERY == 0:
+                    logging.info("Considered {:,} e-File index entries (p50 {:.1f}µs, p99 {:.1f}µs per entry)."
+                                 .format(latency.count, latency.quantile(0.5) * 1e6, latency.quantile(0.99) * 1e6))
+                if prefetcher is not None and md_index.is_staged_change(filing_md):
+                    prefetcher.submit(filing_md)
+            if prefetcher is not None:
+                prefetcher.flush()
+        logging.info("Considered {:,} e-File index entries.".format(latency.count))
+        metrics.counter("index_add_entries_total", "Index entries staged").inc(latency.count)
+        metrics.counter("index_add_seconds_total", "Wall time spent staging index entries").inc(time.monotonic() - start)
+        if len(quarantined) > 0:
+            # Filings superseded since they were quarantined only need recording as duplicates
+            Quarantine.build(conn).release(filing.irs_efile_id for filing in quarantined
+                                           if not md_index.is_staged_change(filing))
         n_eins_changed: int = len(md_index.staged_changes.keys())
         n_amended: int = len(md_index.staged_dupes.keys())
         logging.info("{:,} EINs have new e-Files; {:,} filings were amended.".format(n_eins_changed, n_amended))
         return md_index
 
+    def _begin(self, conn: Connection, ledger: RunLedger) -> EfileMetadataIndex:
+        """Returns a metadata index staged with the changes to process, either restored from an interrupted run or
+        from a fresh pass over the e-file indices."""
+        retrieve = self.compose.retrieve
+        if self.resume and ledger.in_progress and not self.retry_quarantined:
+            logging.info("Resuming interrupted e-file update.")
+            retrieve.resume_from(ledger.get_state("xml_cache_dir"), ledger.get_state("json_cache_dir"))
+            md_index: EfileMetadataIndex = EfileMetadataIndex.build(conn)
+            ledger.restore(md_index)
+            return md_index
+
+        if ledger.in_progress and not retrieve.no_cleanup:
+            logging.info("Discarding staging directories of an interrupted e-file update.")
+            shutil.rmtree(ledger.get_state("xml_cache_dir"), ignore_errors=True)
+            shutil.rmtree(ledger.get_state("json_cache_dir"), ignore_errors=True)
+        prefetcher: Optional[Prefetcher] = Prefetcher(retrieve) if self.prefetch else None
+        md_index = self._index_changes(conn, prefetcher)
+        ledger.begin(md_index, {"xml_cache_dir": retrieve.xml_cache_dir, "json_cache_dir": retrieve.json_cache_dir})
+        if prefetcher is not None:
+            prefetched: List[FilingMetadata] = prefetcher.finish(md_index.is_staged_change)
+            ledger.mark((filing.irs_efile_id for filing in prefetched), DOWNLOADED)
+        return md_index
+
+    def _settle(self, batch: List[Tuple[str, Dict[str, FilingMetadata]]], failures: List[ItemFailure],
+                md_index: EfileMetadataIndex, quarantine: Quarantine) -> None:
+        """Quarantines the batch's failed filings and unstages them from the metadata index, and releases any of its
+        filings that were quarantined by an earlier run but have now succeeded."""
+        failed: List[Tuple[FilingMetadata, ItemFailure]] = expand_failures(batch, failures)
+        failed_ids: Set[str] = {filing.irs_efile_id for filing, _ in failed}
+        quarantine.release(filing.irs_efile_id for _, updates in batch for filing in updates.values()
+                           if filing.irs_efile_id not in failed_ids)
+        if len(failed) == 0:
+            return
+        logging.warning("Quarantined {:,} filings that could not be processed.".format(len(failed)))
+        quarantine.add(failed)
+        md_index.discard(filing for filing, _ in failed)
+
     def __call__(self):
-        md_index: EfileMetadataIndex = self._index_changes()
-        self.compose(md_index.changes)
+        reset()
+        if self.trace_path is not None:
+            tracing.enable()
+        if self.profile:
+            profiling.enable()
+        try:
+            self._update()
+        finally:
+            _write_report("metrics", registry().write, self.metrics_path or self.basepath, METRICS_NAME)
+            if self.trace_path is not None:
+                _write_report("trace", tracing.write, self.trace_path)
+            if self.profile:
+                _write_report("profiles", profiling.write, os.path.join(self.basepath, PROFILE_DIRECTORY))
+                profiling.disable()
+
+    def _update(self) -> None:
+        conn: Connection = self._connect()
+        ledger: RunLedger = RunLedger.build(conn)
+        quarantine: Quarantine = Quarantine.build(conn)
+        conversions: ConversionLog = ConversionLog.build(conn)
+        if self.inventory_source is not None:
+            self._refresh_inventory(conn)
+
+        with self.pool if self.pool is not None else SharedPool():
+            with tracing.span("index pass", "stage"), profiling.profile("index pass"):
+                md_index: EfileMetadataIndex = self._begin(conn, ledger)
+            changes: List[Tuple[str, Dict[str, FilingMetadata]]] = list(md_index.changes)
+            deferred: List[Tuple[str, Dict[str, FilingMetadata]]] = []
+            start: int = 0
+            while start < len(changes) or len(deferred) > 0:
+                n_new: int = max(self.batch_size - len(deferred), 0)
+                batch: List[Tuple[str, Dict[str, FilingMetadata]]] = deferred + changes[start:start + n_new]
+                start += n_new
+                logging.info("Processing {:,} EINs; {:,} of {:,} started.".format(len(batch), min(start, len(changes)),
+                                                                                  len(changes)))
+                with tracing.span("batch", "batch", eins=len(batch)), profiling.profile("batch"):
+                    outcome: FetchOutcome = self.compose(batch, ledger)
+                deferred_eins: Set[str] = {ein for ein, _ in outcome.deferred}
+                deferred = outcome.deferred
+                processed: List[Tuple[str, Dict[str, FilingMetadata]]] = [change for change in batch
+                                                                          if change[0] not in deferred_eins]
+                self._settle(processed, outcome.failures, md_index, quarantine)
+                composed: List[Tuple[str, Dict[str, FilingMetadata]]] = exclude_failed(processed, outcome.failures)
+                eins: List[str] = [ein for ein, _ in processed]
+                with registry().histogram("commit_seconds", "Time taken to commit one batch").time():
+                    md_index.commit(eins)
+                    conversions.record((filing.irs_efile_id for _, updates in composed for filing in updates.values()),
+                                       CONVERTER_VERSION)
+                    ledger.mark_committed(eins)
+                self.compose.retrieve.discard(processed)
+
         md_index.commit()
+        ledger.clear()
+        self.compose.retrieve.cleanup()
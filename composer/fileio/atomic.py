@@ -0,0 +1,93 @@
+import logging
+import os
+from typing import IO, List, Set, Tuple
+
+class _PendingFile:
+    """File handle wrapper that writes to a temporary sibling and registers it with its batch when closed."""
+
+    def __init__(self, batch: "AtomicBatchWriter", tmp_path: str, final_path: str):
+        self._batch: "AtomicBatchWriter" = batch
+        self._fh: IO = open(tmp_path, "w")
+        self.write = self._fh.write  # Bound directly; json.dump calls write once per token
+        self.tmp_path: str = tmp_path
+        self.final_path: str = final_path
+
+    def close(self) -> None:
+        if self._fh.closed:
+            return
+        self._fh.close()
+        self._batch._register(self.tmp_path, self.final_path)
+
+    def __enter__(self) -> "_PendingFile":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._fh.close()
+            os.remove(self.tmp_path)
+
+class AtomicBatchWriter:
+    """Writes files crash-safely. Each file is written to a hidden temporary sibling and renamed over its final path
+    only when the batch commits, so a final path always holds either its previous content or its complete new content.
+
+    With fsync enabled, durability is paid for once per batch: all temporary files are fsynced, renamed, and then each
+    affected directory is fsynced once, rather than syncing every file as it is written."""
+
+    def __init__(self, fsync: bool = True, batch_size: int = 256):
+        self.fsync: bool = fsync
+        self.batch_size: int = batch_size
+        self._pending: List[Tuple[str, str]] = []
+
+    def open(self, path: str) -> _PendingFile:
+        directory, filename = os.path.split(path)
+        tmp_path: str = os.path.join(directory, ".%s.%i.tmp" % (filename, os.getpid()))
+        return _PendingFile(self, tmp_path, path)
+
+    def _register(self, tmp_path: str, final_path: str) -> None:
+        self._pending.append((tmp_path, final_path))
+        if len(self._pending) >= self.batch_size:
+            self.commit()
+
+    def commit(self) -> None:
+        """Moves every completed file in the batch into place."""
+        if self.fsync:
+            for tmp_path, _ in self._pending:
+                _fsync_path(tmp_path, os.O_RDONLY)
+
+        directories: Set[str] = set()
+        for tmp_path, final_path in self._pending:
+            os.replace(tmp_path, final_path)
+            directories.add(os.path.dirname(final_path))
+        self._pending.clear()
+
+        if self.fsync:
+            for directory in directories:
+                _fsync_path(directory, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+
+    def abort(self) -> None:
+        """Discards every completed file in the batch, leaving the final paths untouched."""
+        for tmp_path, _ in self._pending:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+        self._pending.clear()
+
+    def __enter__(self) -> "AtomicBatchWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            logging.warning("Discarding %i uncommitted file(s) after an error." % len(self._pending))
+            self.abort()
+
+def _fsync_path(path: str, flags: int) -> None:
+    fd: int = os.open(path, flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
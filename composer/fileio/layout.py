@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass, asdict
+from typing import Dict, List
+
+LAYOUT_FILENAME = "layout.json"
+
+@dataclass(frozen=True)
+class EINLayout:
+    """Describes how files keyed by EIN are fanned out into nested directories. The EIN (or, if hashed, the hex MD5
+    digest of the EIN) is cut into `depth` directory names of `width` characters each. The historical layout is two
+    levels of three digits, e.g. 123/456/123456789.json."""
+
+    depth: int = 2
+    width: int = 3
+    hashed: bool = False
+
+    def __post_init__(self):
+        if self.depth < 0 or self.width < 1:
+            raise ValueError("Layout depth must be non-negative and width must be positive")
+        key_length: int = 32 if self.hashed else 9
+        if self.depth * self.width > key_length:
+            raise ValueError("Layout %s needs more than %i characters of key" % (self.name, key_length))
+
+    @property
+    def name(self) -> str:
+        return "%s-%ix%i" % ("hashed" if self.hashed else "split", self.depth, self.width)
+
+    def parts_for(self, ein: str) -> List[str]:
+        """Returns the directory names, outermost first, under which files for an EIN are stored."""
+        key: str = hashlib.md5(ein.encode("utf-8")).hexdigest() if self.hashed else ein
+        return [key[i * self.width:(i + 1) * self.width] for i in range(self.depth)]
+
+    def to_json(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_json(cls, content: Dict) -> "EINLayout":
+        return cls(**content)
+
+DEFAULT_LAYOUT: EINLayout = EINLayout()
+
+def load_layout(basepath: str) -> EINLayout:
+    """Returns the layout recorded for a data path, or the default layout if none has been recorded."""
+    layout_path: str = os.path.join(basepath, LAYOUT_FILENAME)
+    if not os.path.exists(layout_path):
+        return DEFAULT_LAYOUT
+    with open(layout_path) as fh:
+        return EINLayout.from_json(json.load(fh))
+
+def save_layout(basepath: str, layout: EINLayout) -> None:
+    """Records the layout for a data path. The file is replaced atomically, so readers see either the old or the new
+    layout."""
+    layout_path: str = os.path.join(basepath, LAYOUT_FILENAME)
+    tmp_path: str = "%s.tmp" % layout_path
+    with open(tmp_path, "w") as fh:
+        json.dump(layout.to_json(), fh)
+    os.replace(tmp_path, layout_path)
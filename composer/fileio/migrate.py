@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import re
+import shutil
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set
+
+from composer.fileio.layout import EINLayout, load_layout, save_layout
+from composer.fileio.paths import EINPathManager
+from composer.futures import run_on_process_pool
+
+MIGRATION_FILENAME = "layout_migration.json"
+
+def _filename_pattern(template: str) -> "re.Pattern":
+    prefix, suffix = template.split("%s")
+    return re.compile("^%s([0-9]+)%s$" % (re.escape(prefix), re.escape(suffix)))
+
+def migration_in_progress(basepath: str) -> bool:
+    return os.path.exists(os.path.join(basepath, MIGRATION_FILENAME))
+
+def _up_to_date(src: str, dst: str) -> bool:
+    """Whether dst already holds the current contents of src: it is the same file, or a copy with the same size and
+    modification time. A file rewritten since it was linked has been replaced by a new inode, so its link is stale."""
+    try:
+        src_stat: os.stat_result = os.stat(src)
+    except FileNotFoundError:
+        return True
+    try:
+        dst_stat: os.stat_result = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        return True
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+def _link_chunk(eins: List[str], source: EINPathManager, target: EINPathManager, template: str) -> int:
+    """Places each file at its target-layout path, and returns the number of files placed. Files are hard-linked where
+    possible, so the copy phase costs one directory entry per file. Targets that are already up to date are left alone,
+    which makes the phase safe to re-run."""
+    n_linked: int = 0
+    for ein in eins:
+        src: str = source.path_for(ein, template)
+        dst: str = target.path_for(ein, template)
+        if src == dst or _up_to_date(src, dst):
+            continue
+        target.ensure_directory_for(ein)
+        tmp: str = "%s.migrating" % dst
+        try:
+            os.link(src, tmp)
+        except FileNotFoundError:
+            continue
+        except OSError:
+            shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+        n_linked += 1
+    return n_linked
+
+def _remove_chunk(eins: List[str], source: EINPathManager, target: EINPathManager, template: str) -> None:
+    for ein in eins:
+        src: str = source.path_for(ein, template)
+        if src == target.path_for(ein, template):
+            continue
+        try:
+            os.remove(src)
+        except FileNotFoundError:
+            pass
+
+@dataclass
+class MigrateLayout(Callable):
+    """Re-lays out an existing tree of per-EIN files from the data path's recorded layout to a new one.
+
+    The migration runs in two phases. In the copy phase, every file is linked into its new location while the recorded
+    layout still points readers at the old one. Composites are rewritten by replacing the file, so one rewritten after
+    it was linked would leave its new-layout link pointing at the old contents; every link is therefore checked again
+    just before the recorded layout is switched atomically. The cleanup phase then removes the old entries. Progress
+    is recorded in the data path, so an interrupted migration resumes where it left off when run again with the same
+    target. The e-file update refuses to run while a migration is in progress (see migration_in_progress)."""
+
+    basepath: str
+    source: EINLayout
+    target: EINLayout
+    template: str
+    phase: str = "copy"
+
+    @classmethod
+    def build(cls, basepath: str, target: EINLayout, template: str) -> "MigrateLayout":
+        record: Optional[Dict] = cls._read_record(basepath)
+        if record is None:
+            return cls(basepath, load_layout(basepath), target, template)
+
+        in_progress: EINLayout = EINLayout.from_json(record["target"])
+        if in_progress != target:
+            raise ValueError("A migration to layout %s is already in progress" % in_progress.name)
+        logging.info("Resuming migration to layout %s (%s phase)." % (target.name, record["phase"]))
+        return cls(basepath, EINLayout.from_json(record["source"]), target, template, record["phase"])
+
+    @staticmethod
+    def _read_record(basepath: str) -> Optional[Dict]:
+        record_path: str = os.path.join(basepath, MIGRATION_FILENAME)
+        if not os.path.exists(record_path):
+            return None
+        with open(record_path) as fh:
+            return json.load(fh)
+
+    def _write_record(self) -> None:
+        record_path: str = os.path.join(self.basepath, MIGRATION_FILENAME)
+        record: Dict = {"source": self.source.to_json(), "target": self.target.to_json(), "phase": self.phase}
+        with open("%s.tmp" % record_path, "w") as fh:
+            json.dump(record, fh)
+        os.replace("%s.tmp" % record_path, record_path)
+
+    def _source_eins(self) -> Iterator[str]:
+        """Yields the EIN of every file that sits where the source layout would put it. Files belonging to the target
+        layout, temporary files and anything else in the data path are ignored."""
+        pattern: "re.Pattern" = _filename_pattern(self.template)
+        source: EINPathManager = EINPathManager(self.basepath, self.source)
+        for dirpath, _, filenames in os.walk(self.basepath):
+            for filename in filenames:
+                match: Optional[re.Match] = pattern.match(filename)
+                if match is None:
+                    continue
+                ein: str = match.group(1)
+                if os.path.normpath(source.directory_for(ein)) == os.path.normpath(dirpath):
+                    yield ein
+
+    def _remove_empty_directories(self, eins: List[str]) -> None:
+        """Removes the source layout's directories for the given EINs, and their parents, once they are empty. Other
+        directories in the data path are left alone, even if empty."""
+        source: EINPathManager = EINPathManager(self.basepath, self.source)
+        basepath: str = os.path.normpath(self.basepath)
+        directories: Set[str] = set()
+        for ein in eins:
+            directory: str = os.path.normpath(source.directory_for(ein))
+            while directory != basepath and directory.startswith(basepath + os.sep):
+                directories.add(directory)
+                directory = os.path.dirname(directory)
+        for directory in sorted(directories, key=lambda path: path.count(os.sep), reverse=True):
+            try:
+                os.rmdir(directory)
+            except OSError:  # Not empty, or already gone
+                pass
+
+    def __call__(self, workers_count: Optional[int] = None):
+        if self.source == self.target:
+            logging.info("Data path already uses layout %s; nothing to migrate." % self.target.name)
+            return
+
+        source: EINPathManager = EINPathManager(self.basepath, self.source)
+        target: EINPathManager = EINPathManager(self.basepath, self.target)
+        eins: List[str] = sorted(self._source_eins())
+
+        if self.phase == "copy":
+            self._write_record()
+            logging.info("Linking {:,} files into layout {}.".format(len(eins), self.target.name))
+            run_on_process_pool(_link_chunk, eins, source, target, self.template, workers_count=workers_count)
+            relinked: int = sum(run_on_process_pool(_link_chunk, eins, source, target, self.template,
+                                                    workers_count=workers_count))
+            if relinked > 0:
+                logging.info("Relinked {:,} files that changed during the copy phase.".format(relinked))
+            save_layout(self.basepath, self.target)
+            self.phase = "cleanup"
+            self._write_record()
+
+        logging.info("Removing {:,} files from layout {}.".format(len(eins), self.source.name))
+        run_on_process_pool(_remove_chunk, eins, source, target, self.template, workers_count=workers_count)
+        self._remove_empty_directories(eins)
+        os.remove(os.path.join(self.basepath, MIGRATION_FILENAME))
+        logging.info("Migration to layout %s complete." % self.target.name)
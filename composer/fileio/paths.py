@@ -1,14 +1,39 @@
 import os
-from dataclasses import dataclass
-from typing import IO
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import IO, Optional
+
+from composer.fileio.atomic import AtomicBatchWriter
+from composer.fileio.layout import EINLayout, DEFAULT_LAYOUT, load_layout
+
+@lru_cache(maxsize=4194304)
+def _ensure_directory(directory: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    return directory
 
 @dataclass
 class EINPathManager:
     basepath: str
+    layout: EINLayout = field(default=DEFAULT_LAYOUT)
+
+    @classmethod
+    def build(cls, basepath: str) -> "EINPathManager":
+        """Creates a path manager using the layout recorded for the data path."""
+        layout: EINLayout = load_layout(basepath)
+        return cls(basepath, layout)
 
     def directory_for(self, ein: str):
-        first, second = ein[0:3], ein[3:6]
-        return os.path.join(self.basepath, first, second)
+        return os.path.join(self.basepath, *self.layout.parts_for(ein))
+
+    def ensure_directory_for(self, ein: str) -> str:
+        """Returns the directory for an EIN, creating it if necessary. Directories known to exist are cached, so this is
+        cheap to call once per file."""
+        return _ensure_directory(self.directory_for(ein))
+
+    def path_for(self, ein: str, template: str) -> str:
+        """Returns the path of the file for an EIN whose filename conforms to a template, where "%s" represents the
+        EIN."""
+        return os.path.join(self.directory_for(ein), template % ein)
 
     def open_for_reading(self, ein: str, template: str) -> IO:
         """Locates a file whose filename conforms to a specified template and corresponding to a particular EIN, then
@@ -24,12 +49,13 @@ class EINPathManager:
         filepath: str = os.path.join(directory, filename)
         return open(filepath)
 
-    def open_for_writing(self, ein: str, template: str) -> IO:
+    def open_for_writing(self, ein: str, template: str, writer: Optional[AtomicBatchWriter] = None) -> IO:
         """Creates directories as needed for a file whose filename conforms to a specified template and corresponding to
         a particular EIN, then opens it for writing.
 
         :param ein: The EIN whose file should be opened
         :param template: A string template for the filename, where "%s" will represent the EIN
+        :param writer: If supplied, the file is written atomically as part of the writer's current batch
         :return: A file object in write mode.
         """
 
@@ -38,6 +64,8 @@ class EINPathManager:
 
         filename: str = template % ein
         filepath: str = os.path.join(directory, filename)
+        if writer is not None:
+            return writer.open(filepath)
         return open(filepath, "w")
 
     def exists(self, ein: str, template: str) -> bool:
@@ -1,52 +1,515 @@
-import math
+import logging
+import multiprocessing
 import os
-from concurrent.futures import as_completed, Executor, ThreadPoolExecutor
+import signal
+import statistics
+import threading
+import time
+from concurrent.futures import wait, Executor, Future, ThreadPoolExecutor, FIRST_COMPLETED
 from concurrent.futures.process import ProcessPoolExecutor
-from typing import Optional, Callable, List, Any, Iterable
+from multiprocessing.context import BaseContext
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional, Callable, List, Any, Iterable, Iterator, Dict, Sequence, Set, Tuple
 
+from composer import profiling, tracing
+from composer.metrics import MetricsRegistry, metric_name, registry
 
-def run_on_process_pool(func: Callable, items: List[Any], *args: Any, chunk_size: Optional[int] = None, workers_count: Optional[int] = None):
+# Each guided chunk takes this fraction of the remaining work divided by the number of workers. Chunks start large and
+# shrink as the work drains, so workers that finish early pick up small pieces instead of waiting on a straggler.
+GUIDED_FACTOR: int = 2
+
+
+# With speculation enabled, once every chunk has been submitted, a chunk that has run this many times longer than
+# expected is submitted a second time, and whichever copy finishes first is used.
+SPECULATION_FACTOR: float = 4.0
+
+# Chunks that must finish before the expected duration of a chunk is trusted
+SPECULATION_MIN_SAMPLES: int = 3
+
+_SPECULATION_POLL_SECONDS: float = 0.5
+
+# A dispatch in which no chunk finishes for this long is considered stuck, and fails with DispatchStalled
+STALL_TIMEOUT: float = 3 * 3600.0
+
+# A labelled dispatch logs its progress and estimated time remaining each time another tenth of its items is done
+_PROGRESS_STEPS: int = 10
+
+
+class ItemTimeout(TimeoutError):
+    """Raised inside a time_limit block that overruns its limit."""
+
+
+class DispatchStalled(TimeoutError):
+    """Raised by a dispatch in which no chunk has finished for STALL_TIMEOUT seconds."""
+
+
+@contextmanager
+def time_limit(seconds: Optional[float]) -> Iterator[None]:
+    """Raises ItemTimeout within the block if it runs for longer than the given number of seconds.
+
+    The limit is enforced with SIGALRM, so it applies only on the main thread of a process, as in a process pool worker;
+    elsewhere, or if seconds is None, the block runs unbounded. The alarm interrupts Python code promptly, but a single
+    long call into a C extension is only interrupted once it returns."""
+    if seconds is None or not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise ItemTimeout("Exceeded time limit of %gs" % seconds)
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _default_thread_count() -> int:
+    # Matches ThreadPoolExecutor's own default
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def _process_context() -> BaseContext:
+    """Start method for a new process pool. Forking a process that has other threads running can leave the child
+    holding a lock that no thread will ever release, so pools created from such a process start their workers from a
+    forkserver instead (or spawn them, where there is no forkserver)."""
+    if threading.current_thread() is threading.main_thread() and threading.active_count() == 1:
+        return multiprocessing.get_context()
+    methods: List[str] = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _noop() -> None:
+    pass
+
+
+_active_pool: Optional["SharedPool"] = None
+
+
+class SharedPool:
+    """A process pool that lives for an entire run. While a SharedPool is active (used as a context manager),
+    run_on_process_pool and imap_on_process_pool dispatch to it rather than starting a fresh pool, so every stage shares
+    the same warm workers and start-up costs are paid once per run.
+
+    Every worker is started as the pool is entered, so a pool entered before any of the run's threads start never
+    forks a multi-threaded process.
+
+    :param start_method: multiprocessing start method, e.g. "forkserver". Defaults to the platform default, unless
+    other threads are running (see _process_context).
+    :param preload: Modules the forkserver imports once, before forking any worker.
+    :param initializer: Called once in each worker as it starts, to build per-process state such as clients.
+    """
+
+    def __init__(self, workers_count: Optional[int] = None, start_method: Optional[str] = None,
+                 preload: Sequence[str] = (), initializer: Optional[Callable] = None, initargs: Tuple = ()):
+        self.workers_count: int = workers_count or os.cpu_count() or 1
+        context: BaseContext = _process_context() if start_method is None else multiprocessing.get_context(start_method)
+        if context.get_start_method() == "forkserver" and len(preload) > 0:
+            context.set_forkserver_preload(list(preload))
+        self.executor: ProcessPoolExecutor = ProcessPoolExecutor(max_workers=self.workers_count, mp_context=context,
+                                                                 initializer=initializer, initargs=initargs)
+        self._owner_pid: int = os.getpid()
+        self._previous: Optional[SharedPool] = None
+
+    def imap(self, func: Callable, items: List[Any], *args: Any, workers_count: Optional[int] = None,
+             **kwargs: Any) -> Iterator[Any]:
+        """As imap_on_pool, but leaves the pool running afterward. A workers_count limits the dispatch to that share of
+        the pool, as when another lane is using the rest of it."""
+        share: int = self.workers_count if workers_count is None else max(min(workers_count, self.workers_count), 1)
+        yield from _dispatch(self.executor, func, items, *args, workers_count=share, **kwargs)
+
+    def run(self, func: Callable, items: List[Any], *args: Any, **kwargs: Any) -> List[Any]:
+        return list(self.imap(func, items, *args, **kwargs))
+
+    def __enter__(self) -> "SharedPool":
+        global _active_pool
+        wait([self.executor.submit(_noop) for _ in range(self.workers_count)])
+        self._previous = _active_pool
+        _active_pool = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        global _active_pool
+        _active_pool = self._previous
+        self.executor.shutdown()
+
+
+def _current_pool() -> Optional[SharedPool]:
+    # A forked worker inherits the parent's module state, but not its pool
+    if _active_pool is not None and _active_pool._owner_pid == os.getpid():
+        return _active_pool
+    return None
+
+
+def pool_workers_count() -> int:
+    """Number of workers that run_on_process_pool uses when no workers_count is given."""
+    pool: Optional[SharedPool] = _current_pool()
+    return pool.workers_count if pool is not None else os.cpu_count() or 1
+
+
+def run_on_process_pool(func: Callable, items: List[Any], *args: Any, chunk_size: Optional[int] = None,
+                        workers_count: Optional[int] = None, cost: Optional[Callable[[Any], int]] = None,
+                        largest_first: bool = False, max_in_flight: Optional[int] = None, speculate: bool = False,
+                        label: Optional[str] = None) -> List[Any]:
+    return list(imap_on_process_pool(func, items, *args, chunk_size=chunk_size, workers_count=workers_count,
+                                     cost=cost, largest_first=largest_first, max_in_flight=max_in_flight,
+                                     speculate=speculate, label=label))
+
+
+def run_on_thread_pool(func: Callable, items: List[Any], *args: Any, chunk_size: Optional[int] = None,
+                       workers_count: Optional[int] = None, cost: Optional[Callable[[Any], int]] = None,
+                       largest_first: bool = False, max_in_flight: Optional[int] = None, speculate: bool = False,
+                       label: Optional[str] = None) -> List[Any]:
+    return list(imap_on_thread_pool(func, items, *args, chunk_size=chunk_size, workers_count=workers_count,
+                                    cost=cost, largest_first=largest_first, max_in_flight=max_in_flight,
+                                    speculate=speculate, label=label))
+
+
+def run_on_pool(executor: Executor, func: Callable, items: List[Any], *args: Any, workers_count: int = 1,
+                chunk_size: Optional[int] = None, cost: Optional[Callable[[Any], int]] = None,
+                largest_first: bool = False, max_in_flight: Optional[int] = None, speculate: bool = False,
+                label: Optional[str] = None) -> List[Any]:
+    """Runs func on chunks of items using the supplied executor and returns the result for each chunk, in completion
+    order. See imap_on_pool."""
+    return list(imap_on_pool(executor, func, items, *args, workers_count=workers_count, chunk_size=chunk_size,
+                             cost=cost, largest_first=largest_first, max_in_flight=max_in_flight,
+                             speculate=speculate, label=label))
+
+
+def imap_on_process_pool(func: Callable, items: List[Any], *args: Any, chunk_size: Optional[int] = None,
+                         workers_count: Optional[int] = None, cost: Optional[Callable[[Any], int]] = None,
+                         largest_first: bool = False, ordered: bool = False, max_in_flight: Optional[int] = None,
+                         speculate: bool = False, label: Optional[str] = None) -> Iterator[Any]:
     if len(items) == 0:
         return
 
+    pool: Optional[SharedPool] = _current_pool()
+    if pool is not None:
+        yield from pool.imap(func, items, *args, workers_count=workers_count, chunk_size=chunk_size, cost=cost,
+                             largest_first=largest_first, ordered=ordered, max_in_flight=max_in_flight,
+                             speculate=speculate, label=label)
+        return
+
     if workers_count is None:
         workers_count = os.cpu_count() or 1
 
-    if chunk_size is None:
-        chunk_size = math.ceil(len(items) / workers_count)
+    executor = ProcessPoolExecutor(max_workers=workers_count, mp_context=_process_context())
+    yield from imap_on_pool(executor, func, items, *args, workers_count=workers_count, chunk_size=chunk_size,
+                            cost=cost, largest_first=largest_first, ordered=ordered, max_in_flight=max_in_flight,
+                            speculate=speculate, label=label)
 
-    executor = ProcessPoolExecutor(max_workers=workers_count)
-    run_on_pool(executor, func, items, *args, chunk_size=chunk_size)
 
-
-def run_on_thread_pool(func: Callable, items: List[Any], *args: Any, chunk_size: Optional[int] = None, workers_count: Optional[int] = None):
+def imap_on_thread_pool(func: Callable, items: List[Any], *args: Any, chunk_size: Optional[int] = None,
+                        workers_count: Optional[int] = None, cost: Optional[Callable[[Any], int]] = None,
+                        largest_first: bool = False, ordered: bool = False, max_in_flight: Optional[int] = None,
+                        speculate: bool = False, label: Optional[str] = None) -> Iterator[Any]:
     if len(items) == 0:
         return
 
+    if workers_count is None:
+        workers_count = _default_thread_count()
+
     executor = ThreadPoolExecutor(max_workers=workers_count)
-    run_on_pool(executor, func, items, *args, chunk_size=chunk_size)
+    yield from imap_on_pool(executor, func, items, *args, workers_count=workers_count, chunk_size=chunk_size,
+                            cost=cost, largest_first=largest_first, ordered=ordered, max_in_flight=max_in_flight,
+                            speculate=speculate, label=label)
+
+
+def imap_on_pool(executor: Executor, func: Callable, items: List[Any], *args: Any, workers_count: int = 1,
+                 chunk_size: Optional[int] = None, cost: Optional[Callable[[Any], int]] = None,
+                 largest_first: bool = False, ordered: bool = False, max_in_flight: Optional[int] = None,
+                 speculate: bool = False, label: Optional[str] = None) -> Iterator[Any]:
+    """Runs func(chunk, *args) for chunks of items on the executor, yielding each chunk's result as it becomes
+    available.
+
+    Chunks are handed out dynamically: at most max_in_flight chunks (by default, two per worker) are submitted at once,
+    and another is submitted whenever one finishes, so idle workers take the next piece of work. Unless a fixed
+    chunk_size is given, chunk sizes are guided: each chunk covers a share of the remaining work, measured by the cost
+    function if one is supplied and by item count otherwise. Items keep their order within and across chunks. If items
+    is a range, so is every chunk.
+
+    :param largest_first: If true (and a cost function is supplied), items are reordered by descending cost before
+    chunking, so the most expensive work starts first and cheap items fill in around it. Use this when the order of the
+    items carries no locality worth preserving.
+    :param ordered: If true, results are yielded in chunk order rather than completion order.
+    :param speculate: If true, a straggling chunk is re-submitted once every chunk has been handed out and a worker is
+    free (see SPECULATION_FACTOR), and the first copy to finish is used. The other copy is abandoned rather than
+    awaited, though a pool that is shut down at the end of the call still waits for it. Only use this if func is
+    idempotent and safe to run twice at once on the same chunk.
+    :param label: If given, progress with an estimated time remaining is logged as the chunks finish, and chunk latency
+    percentiles are logged under this label when they are done. The same figures are recorded in the metrics registry
+    as <stage>_chunk_seconds, <stage>_items_total, <stage>_seconds_total and <stage>_eta_seconds, where stage is the
+    label made into a metric name.
+    :raises: The first exception raised by any chunk, once the chunks already in flight have finished. No further
+    chunks are submitted after a failure.
+    :raises DispatchStalled: If no chunk finishes for STALL_TIMEOUT seconds. The workers of a process pool are
+    terminated; a thread pool is shut down without waiting for its threads.
+    """
+    stalled: bool = False
+    try:
+        yield from _dispatch(executor, func, items, *args, workers_count=workers_count, chunk_size=chunk_size,
+                             cost=cost, largest_first=largest_first, ordered=ordered, max_in_flight=max_in_flight,
+                             speculate=speculate, label=label)
+    except DispatchStalled:
+        stalled = True
+        raise
+    finally:
+        executor.shutdown(wait=not stalled)
+
+
+@dataclass
+class _ChunkContext:
+    """What a worker needs to know about the dispatch that handed it a chunk."""
+    dispatcher_pid: int
+    trace: bool
+    profile: bool
+    label: str
+    index: int
+
+
+def _timed(func: Callable, chunk: Sequence[Any], context: _ChunkContext, *args: Any) \
+        -> Tuple[float, Any, Optional[Tuple]]:
+    """Runs one chunk. In a worker process, also returns the metrics, trace spans and profiles recorded since the
+    worker's last chunk, so that the dispatcher can merge them into its own."""
+    if context.trace:
+        tracing.enable_in_worker()
+    if context.profile:
+        profiling.enable_in_worker()
+    wall_start: float = time.time()
+    start: float = time.monotonic()
+    with profiling.profile(context.label):
+        result: Any = func(chunk, *args)
+    seconds: float = time.monotonic() - start
+    tracing.record(context.label, "chunk", wall_start, wall_start + seconds, index=context.index, items=len(chunk))
+    if os.getpid() == context.dispatcher_pid:
+        return seconds, result, None
+    return seconds, result, (registry().drain(), tracing.drain(), profiling.drain())
+
 
+def _merge_telemetry(telemetry: Optional[Tuple]) -> None:
+    if telemetry is not None:
+        worker_metrics, worker_spans, worker_profiles = telemetry
+        registry().merge(worker_metrics)
+        tracing.merge(worker_spans)
+        profiling.merge(worker_profiles)
 
-def run_on_pool(executor: Executor, func: Callable, items: List[Any], *args: Any, chunk_size: Optional[int] = None):
+
+class _ChunkLatencies:
+    """Execution times of the chunks of one dispatch, as measured in the workers."""
+
+    def __init__(self):
+        self.seconds: List[float] = []
+        self.per_item: List[float] = []
+        self.speculated: int = 0
+        self.won: int = 0
+
+    def record(self, seconds: float, n_items: int) -> None:
+        self.seconds.append(seconds)
+        self.per_item.append(seconds / max(n_items, 1))
+
+    def expected(self, n_items: int) -> Optional[float]:
+        if len(self.per_item) < SPECULATION_MIN_SAMPLES:
+            return None
+        return statistics.median(self.per_item) * n_items
+
+    def log(self, label: str, wall_seconds: float) -> None:
+        registry().counter("%s_seconds_total" % metric_name(label),
+                           "Wall time spent in the %s stage" % label).inc(wall_seconds)
+        if len(self.seconds) == 0:
+            return
+        ordered: List[float] = sorted(self.seconds)
+        pct: Callable[[float], float] = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        message: str = "%s: %i chunks in %0.2fs; chunk time p50 %0.2fs, p95 %0.2fs, p99 %0.2fs, max %0.2fs" % (
+            label, len(ordered), wall_seconds, pct(0.5), pct(0.95), pct(0.99), ordered[-1])
+        if self.speculated > 0:
+            message += "; %i re-dispatched, %i won by the copy" % (self.speculated, self.won)
+        logging.info(message)
+
+
+def _dispatch(executor: Executor, func: Callable, items: List[Any], *args: Any, workers_count: int = 1,
+              chunk_size: Optional[int] = None, cost: Optional[Callable[[Any], int]] = None,
+              largest_first: bool = False, ordered: bool = False, max_in_flight: Optional[int] = None,
+              speculate: bool = False, label: Optional[str] = None) -> Iterator[Any]:
     if len(items) == 0:
         return
 
-    if chunk_size is None:
-        chunk_size = 1
+    if max_in_flight is None:
+        max_in_flight = 2 * workers_count
+
+    # Ranges are kept as they are, so that each chunk is itself a range and pickles in constant space
+    item_list: Sequence[Any] = items if isinstance(items, range) else list(items)
+    costs: Optional[List[int]] = None
+    if cost is not None:
+        costs = [max(cost(item), 1) for item in item_list]
+        if largest_first:
+            order: List[int] = sorted(range(len(item_list)), key=lambda i: costs[i], reverse=True)
+            item_list = [item_list[i] for i in order]
+            costs = [costs[i] for i in order]
+
+    chunks: Iterator[Sequence[Any]]
+    if chunk_size is not None:
+        chunks = iter(_split_to_chunks(item_list, chunk_size))
+    else:
+        chunks = _guided_chunks(item_list, costs, workers_count)
+
+    in_flight: Dict[Future, int] = {}
+    unresolved: Dict[int, Sequence[Any]] = {}  # Chunks submitted but not yet finished or failed
+    started: Dict[Future, float] = {}
+    copies: Set[Future] = set()
+    copied: Set[int] = set()
+    ready: Dict[int, Any] = {}
+    exceptions: List[BaseException] = []
+    latencies: _ChunkLatencies = _ChunkLatencies()
+    dispatch_start: float = time.monotonic()
+    wall_start: float = time.time()
+    trace: bool = tracing.enabled()
+    profile: bool = profiling.enabled()
+    chunk_label: str = label if label is not None else getattr(func, "__name__", "chunk")
+    n_done: int = 0
+    next_progress: int = 1
+    submitted: int = 0
+    next_to_yield: int = 0
+    exhausted: bool = False
 
-    chunks: Iterable[List[Any]] = _split_to_chunks(list(items), chunk_size)
+    def submit(chunk: Sequence[Any], index: int) -> Future:
+        context: _ChunkContext = _ChunkContext(os.getpid(), trace, profile, chunk_label, index)
+        future: Future = executor.submit(_timed, func, chunk, context, *args)
+        in_flight[future] = index
+        return future
 
-    exceptions = []
-    with executor:
-        futures = [executor.submit(func, chunk, *args) for chunk in chunks]
-        for future in as_completed(futures):
+    def submit_next() -> bool:
+        nonlocal submitted, exhausted
+        chunk: Optional[Sequence[Any]] = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            return False
+        submit(chunk, submitted)
+        unresolved[submitted] = chunk
+        submitted += 1
+        return True
+
+    def record_progress(seconds: float, n_items: int, now: float) -> None:
+        nonlocal n_done, next_progress
+        metrics: MetricsRegistry = registry()
+        stage: str = metric_name(label)
+        metrics.histogram("%s_chunk_seconds" % stage, "Time taken by a chunk of the %s stage" % label).observe(seconds)
+        metrics.counter("%s_items_total" % stage, "Items processed by the %s stage" % label).inc(n_items)
+        n_done += n_items
+        eta: float = (now - dispatch_start) * (len(item_list) - n_done) / n_done
+        metrics.gauge("%s_eta_seconds" % stage, "Estimated time remaining in the %s stage" % label).set(eta)
+        if n_done * _PROGRESS_STEPS >= next_progress * len(item_list) and n_done < len(item_list):
+            logging.info("%s: %i of %i items done; about %0.0fs remaining." % (label, n_done, len(item_list), eta))
+            next_progress = n_done * _PROGRESS_STEPS // len(item_list) + 1
+
+    def speculate_on_stragglers(now: float) -> None:
+        for future, index in list(in_flight.items()):
+            if len(in_flight) >= workers_count:
+                return
+            if index in copied or future not in started:
+                continue
+            expected: Optional[float] = latencies.expected(len(unresolved[index]))
+            if expected is not None and now - started[future] > SPECULATION_FACTOR * expected:
+                logging.info("Chunk %i has run for %0.1fs against an expected %0.1fs; re-dispatching it." %
+                             (index, now - started[future], expected))
+                copies.add(submit(unresolved[index], index))
+                copied.add(index)
+                latencies.speculated += 1
+
+    while len(in_flight) < max_in_flight and submit_next():
+        pass
+
+    last_done: float = time.monotonic()
+    while len(unresolved) > 0:
+        poll: float = _SPECULATION_POLL_SECONDS if speculate else STALL_TIMEOUT
+        done, _ = wait(in_flight, timeout=max(min(poll, last_done + STALL_TIMEOUT - time.monotonic()), 0),
+                       return_when=FIRST_COMPLETED)
+        now: float = time.monotonic()
+        if len(done) > 0:
+            last_done = now
+        elif now - last_done >= STALL_TIMEOUT:
+            _terminate_workers(executor)
+            raise DispatchStalled("No chunk of %s finished in %gs; %i chunks were still running" %
+                                  (chunk_label, STALL_TIMEOUT, len(in_flight)))
+        if speculate:
+            for future in in_flight:
+                if future not in started and future.running():
+                    started[future] = now
+        for future in done:
+            index: int = in_flight.pop(future)
+            started.pop(future, None)
+            if index not in unresolved:
+                continue  # The other copy of a re-dispatched chunk finished first
+            twins: List[Future] = [f for f, i in in_flight.items() if i == index]
             if future.exception() is not None:
+                if len(twins) > 0:
+                    continue  # Let the other copy decide the outcome
+                del unresolved[index]
+                if len(exceptions) > 0:
+                    logging.error("Additional failure in chunk %i: %r" % (index, future.exception()))
                 exceptions.append(future.exception())
+                continue
+            chunk: Sequence[Any] = unresolved.pop(index)
+            seconds, result, telemetry = future.result()
+            _merge_telemetry(telemetry)
+            latencies.record(seconds, len(chunk))
+            if label is not None:
+                record_progress(seconds, len(chunk), now)
+            if future in copies:
+                latencies.won += 1
+            for twin in twins:
+                twin.cancel()
+                del in_flight[twin]
+                started.pop(twin, None)
+            if len(exceptions) == 0:
+                submit_next()
+            if not ordered:
+                yield result
+                continue
+            ready[index] = result
+            while next_to_yield in ready:
+                yield ready.pop(next_to_yield)
+                next_to_yield += 1
+        if speculate and exhausted and len(exceptions) == 0:
+            speculate_on_stragglers(now)
+
+    if label is not None:
+        latencies.log(label, time.monotonic() - dispatch_start)
+        tracing.record(label, "stage", wall_start, time.time(), chunks=submitted, items=len(item_list))
     if len(exceptions) > 0:
         raise exceptions[0]
 
 
+def _terminate_workers(executor: Executor) -> None:
+    """Kills the workers of a process pool, so that a stuck worker cannot hold up the pool's shutdown. The pool is
+    broken afterward. Threads cannot be killed, so a thread pool is left as it is."""
+    if isinstance(executor, ProcessPoolExecutor):
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+
+
 # https://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks
-def _split_to_chunks(items: List[Any], chunk_size: int) -> Iterable[List[Any]]:
+def _split_to_chunks(items: Sequence[Any], chunk_size: int) -> Iterable[Sequence[Any]]:
     for i in range(0, len(items), chunk_size):
         yield items[i:i + chunk_size]
+
+
+def _guided_chunks(items: Sequence[Any], costs: Optional[List[int]], workers_count: int) -> Iterator[Sequence[Any]]:
+    """Splits items into contiguous chunks, each covering 1 / (GUIDED_FACTOR * workers_count) of the cost that
+    remains. Items cost one unit each if no costs are given. Every chunk holds at least one item."""
+    if costs is None:
+        costs = [1] * len(items)
+    remaining_cost: int = sum(costs)
+    start: int = 0
+    while start < len(items):
+        target: float = remaining_cost / (GUIDED_FACTOR * workers_count)
+        end: int = start
+        acc: int = 0
+        while end < len(items) and (end == start or acc + costs[end] <= target):
+            acc += costs[end]
+            end += 1
+        yield items[start:end]
+        remaining_cost -= acc
+        start = end
@@ -0,0 +1,248 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, Union
+
+from composer.fileio.atomic import AtomicBatchWriter
+
+# Upper bounds of the histogram buckets, in seconds: quarter powers of two from 1µs to about 2.4 hours. Buckets are
+# fixed so that histograms recorded in different processes can be merged by adding their counts.
+HISTOGRAM_BOUNDS: List[float] = [1e-6 * 2 ** (k / 4) for k in range(133)]
+
+PROMETHEUS_PREFIX: str = "composer_"
+
+def metric_name(label: str) -> str:
+    """Turns a free-form label, such as "convert (slow lane)", into a valid metric name prefix."""
+    return re.sub(r"\W+", "_", label.lower()).strip("_")
+
+class Counter:
+    """A value that only goes up, such as a number of filings or bytes."""
+
+    kind: str = "counter"
+
+    def __init__(self, help: str, lock: threading.Lock):
+        self.help: str = help
+        self.value: float = 0.0
+        self._lock: threading.Lock = lock
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def state(self) -> float:
+        return self.value
+
+    def merge(self, state: float) -> None:
+        self.inc(state)
+
+class Gauge:
+    """A value that can go up or down, such as an estimated time remaining."""
+
+    kind: str = "gauge"
+
+    def __init__(self, help: str, lock: threading.Lock):
+        self.help: str = help
+        self.value: float = 0.0
+        self._lock: threading.Lock = lock
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+    def state(self) -> float:
+        return self.value
+
+    def merge(self, state: float) -> None:
+        self.set(state)
+
+class Histogram:
+    """Distribution of durations, in seconds, kept as counts in fixed buckets. Quantiles are interpolated within a
+    bucket, so they are accurate to within a fraction of the bucket width (about 19%)."""
+
+    kind: str = "histogram"
+
+    def __init__(self, help: str, lock: threading.Lock):
+        self.help: str = help
+        self.counts: List[int] = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+        self.min: float = math.inf
+        self.max: float = 0.0
+        self._lock: threading.Lock = lock
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect_left(HISTOGRAM_BOUNDS, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+            self.min = min(self.min, seconds)
+            self.max = max(self.max, seconds)
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank: float = q * self.count
+        seen: int = 0
+        for i, n in enumerate(self.counts):
+            if n > 0 and seen + n >= rank:
+                lower: float = HISTOGRAM_BOUNDS[i - 1] if i > 0 else 0.0
+                upper: float = HISTOGRAM_BOUNDS[i] if i < len(HISTOGRAM_BOUNDS) else self.max
+                estimate: float = lower + (upper - lower) * (rank - seen) / n
+                return min(max(estimate, self.min), self.max)
+            seen += n
+        return self.max
+
+    def state(self) -> Tuple[List[int], int, float, float, float]:
+        return list(self.counts), self.count, self.sum, self.min, self.max
+
+    def merge(self, state: Tuple[List[int], int, float, float, float]) -> None:
+        counts, count, total, low, high = state
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += count
+            self.sum += total
+            self.min = min(self.min, low)
+            self.max = max(self.max, high)
+
+Metric = Union[Counter, Gauge, Histogram]
+
+class MetricsRegistry:
+    """Named counters, gauges and latency histograms for one run of the pipeline.
+
+    Each process has its own registry (see registry()). Pool workers record into theirs, and the dispatcher in
+    composer.futures drains each worker's registry after every chunk and merges it into the parent's, so the parent's
+    registry covers the whole run."""
+
+    def __init__(self):
+        self.pid: int = os.getpid()
+        self.started: float = time.time()
+        self.metrics: Dict[str, Metric] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def _get(self, cls: Type, name: str, help: str) -> Any:
+        metric: Optional[Metric] = self.metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.setdefault(name, cls(help, self._lock))
+        if not isinstance(metric, cls):
+            raise TypeError("Metric %s is a %s, not a %s" % (name, metric.kind, cls.kind))
+        return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str = "") -> Gauge:
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str = "") -> Histogram:
+        return self._get(Histogram, name, help)
+
+    def drain(self) -> Optional[Dict[str, Tuple[str, str, Any]]]:
+        """Returns the state of every metric, as name -> (kind, help, state), and empties the registry. Returns None if
+        nothing has been recorded."""
+        with self._lock:
+            metrics: Dict[str, Metric] = self.metrics
+            self.metrics = {}
+        if len(metrics) == 0:
+            return None
+        return {name: (metric.kind, metric.help, metric.state()) for name, metric in metrics.items()}
+
+    def merge(self, drained: Optional[Dict[str, Tuple[str, str, Any]]]) -> None:
+        """Adds metrics drained from another registry to this one."""
+        if drained is None:
+            return
+        kinds: Dict[str, Type] = {cls.kind: cls for cls in (Counter, Gauge, Histogram)}
+        for name, (kind, help, state) in drained.items():
+            self._get(kinds[kind], name, help).merge(state)
+
+    def _sorted(self, cls: Type) -> List[Tuple[str, Any]]:
+        return sorted((name, metric) for name, metric in self.metrics.items() if isinstance(metric, cls))
+
+    def report(self) -> Dict[str, Any]:
+        """Summarizes the run. Alongside the raw metrics, each counter named <stage>_<quantity>_total is reported as a
+        rate, <stage>_<quantity>_per_second, if the registry also has a <stage>_seconds_total counter. The longest
+        matching stage is used."""
+        counters: Dict[str, float] = {name: metric.value for name, metric in self._sorted(Counter)}
+        suffix: str = "_seconds_total"
+        stages: List[str] = sorted((name[:-len(suffix)] for name in counters if name.endswith(suffix)), key=len,
+                                   reverse=True)
+        rates: Dict[str, float] = {}
+        for name, value in counters.items():
+            if not name.endswith("_total") or name.endswith(suffix):
+                continue
+            stage: Optional[str] = next((stage for stage in stages if name.startswith(stage + "_")), None)
+            if stage is not None and counters[stage + suffix] > 0:
+                rates[name[:-len("_total")] + "_per_second"] = value / counters[stage + suffix]
+        histograms: Dict[str, Dict[str, Optional[float]]] = {
+            name: {"count": metric.count, "sum": metric.sum, "min": metric.min if metric.count > 0 else None,
+                   "max": metric.max if metric.count > 0 else None, "p50": metric.quantile(0.5),
+                   "p95": metric.quantile(0.95), "p99": metric.quantile(0.99)}
+            for name, metric in self._sorted(Histogram)}
+        return {"started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "elapsed_seconds": time.time() - self.started,
+                "counters": counters,
+                "gauges": {name: metric.value for name, metric in self._sorted(Gauge)},
+                "histograms": histograms,
+                "rates": rates}
+
+    def prometheus(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for name, metric in sorted(self.metrics.items()):
+            full_name: str = PROMETHEUS_PREFIX + name
+            if metric.help != "":
+                lines.append("# HELP %s %s" % (full_name, metric.help))
+            lines.append("# TYPE %s %s" % (full_name, metric.kind))
+            if not isinstance(metric, Histogram):
+                lines.append("%s %r" % (full_name, metric.value))
+                continue
+            cumulative: int = 0
+            for bound, n in zip(HISTOGRAM_BOUNDS, metric.counts):
+                cumulative += n
+                if n > 0:  # Empty buckets are omitted; cumulative counts keep the histogram well-formed
+                    lines.append('%s_bucket{le="%.6g"} %i' % (full_name, bound, cumulative))
+            lines.append('%s_bucket{le="+Inf"} %i' % (full_name, metric.count))
+            lines.append("%s_sum %r" % (full_name, metric.sum))
+            lines.append("%s_count %i" % (full_name, metric.count))
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str, name: str) -> None:
+        """Writes <name>.json, a report of the run, and <name>.prom, a Prometheus textfile, to the given directory.
+        Both are replaced atomically, so a collector never reads a partial file."""
+        writer: AtomicBatchWriter = AtomicBatchWriter(fsync=False)
+        with writer.open(os.path.join(directory, "%s.json" % name)) as fh:
+            json.dump(self.report(), fh, indent=2)
+        with writer.open(os.path.join(directory, "%s.prom" % name)) as fh:
+            fh.write(self.prometheus())
+        writer.commit()
+        logging.info("Wrote run metrics to %s." % os.path.join(directory, "%s.{json,prom}" % name))
+
+_registry: MetricsRegistry = MetricsRegistry()
+
+def registry() -> MetricsRegistry:
+    """The current process's registry. A forked process starts with an empty one, rather than a copy of its parent's."""
+    global _registry
+    if _registry.pid != os.getpid():
+        _registry = MetricsRegistry()
+    return _registry
+
+def reset() -> MetricsRegistry:
+    """Replaces the current process's registry with an empty one, as at the start of a run."""
+    global _registry
+    _registry = MetricsRegistry()
+    return _registry
@@ -0,0 +1,188 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from composer.metrics import metric_name
+
+# Allocation sites kept for each stage, and functions listed for each stage in the summary
+TOP_SITES: int = 10
+TOP_FUNCTIONS: int = 25
+
+# (filename, line number, function) -> (primitive calls, calls, total time, cumulative time, callers), as in pstats
+RawStats = Dict[Tuple[str, int, str], Tuple]
+
+class _Stats:
+    """Adapter that lets pstats.Stats load raw stats."""
+
+    def __init__(self, stats: RawStats):
+        self.stats: RawStats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+class _StageProfile:
+    """CPU and memory profile of one stage in one or more processes. CPU stats are merged as they arrive."""
+
+    def __init__(self):
+        self.stats: Optional[pstats.Stats] = None
+        self.peak_bytes: int = 0
+        self.sites: Dict[str, int] = {}
+
+    def add(self, stats: RawStats, peak_bytes: int, sites: Dict[str, int]) -> None:
+        if self.stats is None:
+            self.stats = pstats.Stats(_Stats(stats))
+        else:
+            self.stats.add(_Stats(stats))
+        self.peak_bytes = max(self.peak_bytes, peak_bytes)
+        self.add_sites(sites)
+
+    def add_sites(self, sites: Dict[str, int]) -> None:
+        for site, size in sites.items():
+            self.sites[site] = max(self.sites.get(site, 0), size)
+        self.sites = dict(sorted(self.sites.items(), key=lambda item: item[1], reverse=True)[:TOP_SITES])
+
+    def state(self) -> Tuple[RawStats, int, Dict[str, int]]:
+        return self.stats.stats, self.peak_bytes, self.sites
+
+class _Profiles:
+    def __init__(self, enabled: bool = False, owns_tracemalloc: bool = False):
+        self.pid: int = os.getpid()
+        self.enabled: bool = enabled
+        # Whether tracemalloc was started by profiling, and so should be stopped with it
+        self.owns_tracemalloc: bool = owns_tracemalloc
+        self.active: bool = False
+        self.lock: threading.Lock = threading.Lock()
+        self.stages: Dict[str, _StageProfile] = {}
+        # Stages whose allocation sites have already been sampled in this process
+        self.sampled: Set[str] = set()
+
+    def start_tracemalloc(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.owns_tracemalloc = True
+
+_profiles: _Profiles = _Profiles()
+
+def _current() -> _Profiles:
+    # A forked process starts with no profiles of its own, though profiling stays enabled
+    global _profiles
+    if _profiles.pid != os.getpid():
+        _profiles = _Profiles(_profiles.enabled, _profiles.owns_tracemalloc)
+    return _profiles
+
+def enable() -> None:
+    """Starts profiling in this process, discarding any earlier profiles. The dispatcher in composer.futures enables
+    profiling in pool workers whenever it is enabled in the process that hands them work."""
+    global _profiles
+    _profiles = _Profiles(True)
+    _profiles.start_tracemalloc()
+
+def enable_in_worker() -> None:
+    profiles: _Profiles = _current()
+    profiles.enabled = True
+    profiles.start_tracemalloc()
+
+def disable() -> None:
+    """Stops profiling in this process, and stops tracemalloc if profiling started it. Recorded profiles are kept."""
+    profiles: _Profiles = _current()
+    profiles.enabled = False
+    if profiles.owns_tracemalloc:
+        tracemalloc.stop()
+        profiles.owns_tracemalloc = False
+
+def enabled() -> bool:
+    return _current().enabled
+
+@contextmanager
+def profile(stage: str) -> Iterator[None]:
+    """Profiles the enclosed block under the given stage, if profiling is enabled. Only one block is profiled at a time
+    in each process, as some interpreters allow only one active profiler. A block entered in the same thread while
+    another is being profiled counts toward the outer block's stage; one entered in another thread, such as the huge
+    lane's, is not profiled."""
+    profiles: _Profiles = _current()
+    with profiles.lock:
+        claimed: bool = profiles.enabled and not profiles.active
+        if claimed:
+            profiles.active = True
+    if not claimed:
+        yield
+        return
+    profiler: cProfile.Profile = cProfile.Profile()
+    if hasattr(tracemalloc, "reset_peak"):  # Python 3.9+; earlier, peaks are cumulative within a process
+        tracemalloc.reset_peak()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        profiler.create_stats()
+        with profiles.lock:
+            profiles.stages.setdefault(stage, _StageProfile()).add(profiler.stats, peak_bytes, {})
+            profiles.active = False
+
+def _largest_sites() -> Dict[str, int]:
+    if not tracemalloc.is_tracing():
+        return {}
+    snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot()
+    return {str(stat.traceback): stat.size for stat in snapshot.statistics("lineno")[:TOP_SITES]}
+
+def drain() -> Optional[Dict[str, Tuple[RawStats, int, Dict[str, int]]]]:
+    """Returns and forgets the profiles recorded so far, as stage -> (raw stats, peak bytes, allocation sites), or None
+    if there are none. Taking a snapshot of live allocations is costly, so one is taken only the first time each stage
+    is drained in a process."""
+    profiles: _Profiles = _current()
+    with profiles.lock:
+        stages: Dict[str, _StageProfile] = profiles.stages
+        profiles.stages = {}
+    if len(stages) == 0:
+        return None
+    unsampled: Set[str] = set(stages) - profiles.sampled
+    if len(unsampled) > 0:
+        sites: Dict[str, int] = _largest_sites()
+        for stage in unsampled:
+            stages[stage].add_sites(sites)
+        profiles.sampled |= unsampled
+    return {stage: profile.state() for stage, profile in stages.items()}
+
+def merge(drained: Optional[Dict[str, Tuple[RawStats, int, Dict[str, int]]]]) -> None:
+    """Adds profiles drained from another process to this process's profiles."""
+    if drained is None:
+        return
+    profiles: _Profiles = _current()
+    with profiles.lock:
+        for stage, (stats, peak_bytes, sites) in drained.items():
+            profiles.stages.setdefault(stage, _StageProfile()).add(stats, peak_bytes, sites)
+
+def write(directory: str) -> None:
+    """Writes each stage's merged CPU profile to <stage>.pstats in the given directory, along with summary.txt, which
+    lists each stage's costliest functions, its peak traced memory in any one process, and its largest allocation
+    sites still live when the stage's profile was first drained in some process."""
+    os.makedirs(directory, exist_ok=True)
+    profiles: _Profiles = _current()
+    unsampled: Set[str] = {stage for stage, stage_profile in profiles.stages.items() if len(stage_profile.sites) == 0}
+    if len(unsampled) > 0:
+        sites: Dict[str, int] = _largest_sites()
+        for stage in unsampled:
+            profiles.stages[stage].add_sites(sites)
+    summary: io.StringIO = io.StringIO()
+    for stage, stage_profile in sorted(profiles.stages.items()):
+        stats: pstats.Stats = stage_profile.stats
+        stats.stream = summary
+        stats.dump_stats(os.path.join(directory, "%s.pstats" % metric_name(stage)))
+
+        summary.write("=== %s ===\n" % stage)
+        summary.write("Peak traced memory: {:,} bytes\n".format(stage_profile.peak_bytes))
+        summary.write("Largest live allocation sites:\n")
+        for site, size in stage_profile.sites.items():
+            summary.write("  {:>14,} bytes  {}\n".format(size, site))
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    with open(os.path.join(directory, "summary.txt"), "w") as fh:
+        fh.write(summary.getvalue())
+    logging.info("Wrote profiles of %i stages to %s." % (len(profiles.stages), directory))
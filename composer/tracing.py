@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# Filings listed in the summary of a trace
+SLOWEST_FILINGS: int = 10
+
+class _Trace:
+    """Spans recorded by one process, in Chrome trace event format."""
+
+    def __init__(self, enabled: bool = False):
+        self.pid: int = os.getpid()
+        self.enabled: bool = enabled
+        self.events: List[Dict[str, Any]] = []
+
+_trace: _Trace = _Trace()
+
+def _current() -> _Trace:
+    # A forked process starts with an empty trace rather than a copy of its parent's spans, though tracing stays enabled
+    global _trace
+    if _trace.pid != os.getpid():
+        _trace = _Trace(_trace.enabled)
+    return _trace
+
+def enable() -> None:
+    """Starts recording spans in this process, discarding any recorded earlier. The dispatcher in composer.futures
+    enables tracing in pool workers whenever it is enabled in the process that hands them work."""
+    global _trace
+    _trace = _Trace(True)
+
+def enable_in_worker() -> None:
+    """Turns tracing on, keeping any spans already recorded."""
+    _current().enabled = True
+
+def enabled() -> bool:
+    return _current().enabled
+
+def record(name: str, category: str, start: float, end: float, **args: Any) -> None:
+    """Records a complete span, given its start and end as time.time() values."""
+    trace: _Trace = _current()
+    if not trace.enabled:
+        return
+    trace.events.append({"name": name, "cat": category, "ph": "X", "ts": start * 1e6, "dur": (end - start) * 1e6,
+                         "pid": trace.pid, "tid": threading.get_ident(), "args": args})
+
+@contextmanager
+def span(name: str, category: str, **args: Any) -> Iterator[None]:
+    """Records the enclosed block as a span, if tracing is enabled."""
+    if not enabled():
+        yield
+        return
+    start: float = time.time()
+    try:
+        yield
+    finally:
+        record(name, category, start, time.time(), **args)
+
+def drain() -> Optional[List[Dict[str, Any]]]:
+    """Returns and forgets the spans recorded so far, or None if there are none."""
+    trace: _Trace = _current()
+    if len(trace.events) == 0:
+        return None
+    events: List[Dict[str, Any]] = trace.events
+    trace.events = []
+    return events
+
+def merge(events: Optional[List[Dict[str, Any]]]) -> None:
+    """Adds spans drained from another process to this process's trace."""
+    if events is not None:
+        _current().events.extend(events)
+
+def summarize(events: List[Dict[str, Any]], n_slowest: int = SLOWEST_FILINGS) -> Dict[str, Any]:
+    """The slowest filings, and the share of the traced period that each worker process spent running chunks."""
+    spans: List[Dict[str, Any]] = [e for e in events if e["ph"] == "X"]
+    if len(spans) == 0:
+        return {"slowest_filings": [], "worker_utilization": {}}
+    begin: float = min(e["ts"] for e in spans)
+    end: float = max(e["ts"] + e["dur"] for e in spans)
+    filings: List[Dict[str, Any]] = sorted((e for e in spans if e["cat"] == "filing"), key=lambda e: e["dur"],
+                                           reverse=True)
+    busy: Dict[int, float] = defaultdict(float)
+    for e in spans:
+        if e["cat"] == "chunk" and e["pid"] != os.getpid():
+            busy[e["pid"]] += e["dur"]
+    return {"slowest_filings": [dict(e["args"], stage=e["name"], seconds=e["dur"] / 1e6)
+                                for e in filings[:n_slowest]],
+            "worker_utilization": {str(pid): seconds / max(end - begin, 1.0) for pid, seconds in sorted(busy.items())}}
+
+def write(path: str, n_slowest: int = SLOWEST_FILINGS) -> None:
+    """Writes every span recorded in or merged into this process as a Chrome trace, which can be opened in
+    chrome://tracing or Perfetto, and logs a summary of it."""
+    events: List[Dict[str, Any]] = _current().events
+    summary: Dict[str, Any] = summarize(events, n_slowest)
+    names: List[Dict[str, Any]] = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                                    "args": {"name": "main" if pid == os.getpid() else "worker %i" % pid}}
+                                   for pid in sorted({e["pid"] for e in events})]
+    tmp_path: str = "%s.%i.tmp" % (path, os.getpid())
+    with open(tmp_path, "w") as fh:
+        json.dump({"traceEvents": names + events, "displayTimeUnit": "ms", "otherData": summary}, fh)
+    os.replace(tmp_path, path)
+
+    logging.info("Wrote {:,} trace spans to {}.".format(len(events), path))
+    for filing in summary["slowest_filings"]:
+        logging.info("Slow filing: %s" % ", ".join("%s=%s" % item for item in sorted(filing.items())))
+    for pid, utilization in summary["worker_utilization"].items():
+        logging.info("Worker %s was busy for %0.0f%% of the trace." % (pid, utilization * 100))
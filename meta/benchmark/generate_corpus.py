@@ -0,0 +1,185 @@
+"""Grows the e-file fixtures into a synthetic corpus of any size, for load testing. The corpus has the layout of the IRS
+bucket, split by timepoint:
+
+    <corpus>/xml/<ObjectId>_public.xml          every filing of every timepoint
+    <corpus>/indices/<timepoint>/index_<year>.json
+
+Each timepoint's indices hold every filing of the earlier timepoints plus a new slice of filings, so successive
+timepoints can be applied to one data path as incremental updates. A fraction of each new slice amends a filing that
+was already indexed. Filings are copies of the fixture XMLs, padded to sizes drawn from a Pareto distribution, so that a
+few filings are far larger than the rest, as in the real corpus.
+
+    python meta/benchmark/generate_corpus.py CORPUS_PATH [--filings 1000000] [--timepoints 2] [--amended_ratio 0.05]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+from typing import Dict, Iterator, List, Match, Optional, TextIO, Tuple
+
+from composer.aws.efile.indices import EARLIEST_YEAR
+from composer.futures import run_on_process_pool
+
+BASEPATH: str = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_XML_PATH: str = os.path.join(BASEPATH, "..", "..", "fixtures", "efile_xml")
+
+# Filings are spread over this many consecutive tax years for each EIN, starting with EARLIEST_YEAR - 1
+DEFAULT_FILINGS_PER_EIN: int = 4
+
+# Padding added to a filing is in elements of this many characters
+PADDING_ELEMENT: str = "<SyntheticPadding>%s</SyntheticPadding>" % ("x" * 1000)
+
+XML_PER_CHUNK: int = 1000
+
+# (ObjectId, EIN, tax year, index year, SubmittedOn, timepoint)
+Filing = Tuple[str, str, int, int, str, int]
+
+class CorpusSpec:
+    """Determines every filing of a corpus from a handful of parameters, so that a filing's row and XML can be
+    regenerated in any process without holding the corpus in memory."""
+
+    def __init__(self, n_filings: int, n_timepoints: int, amended_ratio: float, filings_per_ein: int,
+                 pareto_alpha: float, max_size_factor: float, seed: int):
+        self.n_filings: int = n_filings
+        self.n_timepoints: int = n_timepoints
+        self.amended_ratio: float = amended_ratio
+        self.filings_per_ein: int = filings_per_ein
+        self.n_eins: int = max(n_filings // filings_per_ein, 1)
+        self.pareto_alpha: float = pareto_alpha
+        self.max_size_factor: float = max_size_factor
+        self.seed: int = seed
+
+    def _slice(self, timepoint: int) -> range:
+        """Original filings first indexed at the given timepoint. Later timepoints bring later tax years."""
+        per_timepoint: int = -(-self.n_filings // self.n_timepoints)
+        return range(timepoint * per_timepoint, min((timepoint + 1) * per_timepoint, self.n_filings))
+
+    def _original(self, k: int, timepoint: int) -> Filing:
+        ein: str = "%09i" % (100000000 + k % self.n_eins)
+        tax_year: int = EARLIEST_YEAR - 1 + k // self.n_eins
+        index_year: int = tax_year + 1
+        rng: random.Random = random.Random(self.seed * 1000003 + k)
+        submitted: str = "%i-%02i-%02i" % (index_year, rng.randint(1, 11), rng.randint(1, 28))
+        return "%i%014i" % (index_year, k), ein, tax_year, index_year, submitted, timepoint
+
+    def _amendments(self, timepoint: int) -> Iterator[Filing]:
+        """Amendments made at the given timepoint, each of an original filing indexed at or before it."""
+        indexed: int = self._slice(timepoint).stop
+        n_amended: int = int(len(self._slice(timepoint)) * self.amended_ratio)
+        rng: random.Random = random.Random(self.seed * 7919 + timepoint)
+        for i in range(n_amended):
+            object_id, ein, tax_year, index_year, _, _ = self._original(rng.randrange(indexed), timepoint)
+            yield ("%i9%013i" % (index_year, timepoint * self.n_filings + i), ein, tax_year, index_year,
+                   "%i-12-%02i" % (index_year, 29 + timepoint % 2), timepoint)
+
+    def filings(self, timepoint: int) -> Iterator[Filing]:
+        """Filings first indexed at the given timepoint."""
+        for k in self._slice(timepoint):
+            yield self._original(k, timepoint)
+        yield from self._amendments(timepoint)
+
+    def size_factor(self, object_id: str) -> float:
+        rng: random.Random = random.Random("%i:%s" % (self.seed, object_id))
+        return min(rng.paretovariate(self.pareto_alpha), self.max_size_factor)
+
+def _templates() -> List[Tuple[str, str]]:
+    """(form type, XML) of each fixture filing."""
+    templates: List[Tuple[str, str]] = []
+    for filename in sorted(os.listdir(FIXTURE_XML_PATH)):
+        with open(os.path.join(FIXTURE_XML_PATH, filename)) as fh:
+            raw: str = fh.read()
+        form_type: Optional[Match] = re.search(r"<ReturnType(?:Cd)?>(\w+)<", raw)
+        templates.append((form_type.group(1) if form_type is not None else "990", raw))
+    return templates
+
+def _row(filing: Filing, form_type: str, last_updated: str) -> Dict[str, str]:
+    object_id, ein, tax_year, _, submitted, _ = filing
+    return {"EIN": ein, "TaxPeriod": "%i12" % tax_year, "DLN": "9349%s" % object_id[-10:], "FormType": form_type,
+            "URL": "https://s3.amazonaws.com/irs-form-990/%s_public.xml" % object_id,
+            "OrganizationName": "SYNTHETIC ORGANIZATION %s" % ein, "SubmittedOn": submitted, "ObjectId": object_id,
+            "LastUpdated": last_updated}
+
+def _template_for(object_id: str, n_templates: int) -> int:
+    return int(object_id) % n_templates
+
+def _write_xml(filings: List[Filing], spec: CorpusSpec, xml_path: str) -> int:
+    templates: List[Tuple[str, str]] = _templates()
+    n_bytes: int = 0
+    for filing in filings:
+        object_id: str = filing[0]
+        _, raw = templates[_template_for(object_id, len(templates))]
+        n_padding: int = int(len(raw) * (spec.size_factor(object_id) - 1) / len(PADDING_ELEMENT))
+        if n_padding > 0:
+            raw = raw.replace("</ReturnData>", PADDING_ELEMENT * n_padding + "</ReturnData>", 1)
+        with open(os.path.join(xml_path, "%s_public.xml" % object_id), "w") as fh:
+            n_bytes += fh.write(raw)
+    return n_bytes
+
+def _write_indices(spec: CorpusSpec, timepoint: int, index_path: str, form_types: List[str]) -> int:
+    """Writes the indices of a timepoint, one row at a time, so that millions of rows never need to be in memory at
+    once."""
+    os.makedirs(index_path, exist_ok=True)
+    last_updated: Dict[int, str] = {t: "%i-01-01T00:00:00" % (2020 + t) for t in range(timepoint + 1)}
+    handles: Dict[int, TextIO] = {}
+    n_rows: int = 0
+    try:
+        for earlier in range(timepoint + 1):
+            for filing in spec.filings(earlier):
+                index_year: int = filing[3]
+                if index_year not in handles:
+                    handles[index_year] = open(os.path.join(index_path, "index_%i.json" % index_year), "w")
+                    handles[index_year].write('{"Filings%i": [\n' % index_year)
+                else:
+                    handles[index_year].write(",\n")
+                form_type: str = form_types[_template_for(filing[0], len(form_types))]
+                handles[index_year].write(json.dumps(_row(filing, form_type, last_updated[filing[5]])))
+                n_rows += 1
+    finally:
+        for fh in handles.values():
+            fh.write("\n]}\n")
+            fh.close()
+    return n_rows
+
+def generate(corpus_path: str, spec: CorpusSpec) -> None:
+    xml_path: str = os.path.join(corpus_path, "xml")
+    os.makedirs(xml_path, exist_ok=True)
+    form_types: List[str] = [form_type for form_type, _ in _templates()]
+    for timepoint in range(spec.n_timepoints):
+        new_filings: List[Filing] = list(spec.filings(timepoint))
+        n_bytes: int = sum(run_on_process_pool(_write_xml, new_filings, spec, xml_path, chunk_size=XML_PER_CHUNK))
+        logging.info("Wrote {:,} filings ({:,} bytes) for timepoint {}.".format(len(new_filings), n_bytes, timepoint))
+        index_path: str = os.path.join(corpus_path, "indices", timepoint_name(timepoint))
+        n_rows: int = _write_indices(spec, timepoint, index_path, form_types)
+        logging.info("Wrote {:,} index rows to {}.".format(n_rows, index_path))
+
+def timepoint_name(timepoint: int) -> str:
+    return "timepoint_%i" % timepoint
+
+def add_spec_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--timepoints", type=int, default=2, help="Number of successive sets of indices.")
+    parser.add_argument("--amended_ratio", type=float, default=0.05,
+                        help="Amendments made at each timepoint, as a fraction of its new filings.")
+    parser.add_argument("--filings_per_ein", type=int, default=DEFAULT_FILINGS_PER_EIN)
+    parser.add_argument("--pareto_alpha", type=float, default=1.5,
+                        help="Shape of the filing size distribution; smaller values give a heavier tail.")
+    parser.add_argument("--max_size_factor", type=float, default=100.0,
+                        help="Largest filing, as a multiple of the fixture it is copied from.")
+    parser.add_argument("--seed", type=int, default=0)
+
+def spec_from_arguments(n_filings: int, args: argparse.Namespace) -> CorpusSpec:
+    return CorpusSpec(n_filings, args.timepoints, args.amended_ratio, args.filings_per_ein, args.pareto_alpha,
+                      args.max_size_factor, args.seed)
+
+def main():
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("corpus_path")
+    parser.add_argument("--filings", type=int, default=1000000, help="Original filings, before amendments.")
+    add_spec_arguments(parser)
+    args: argparse.Namespace = parser.parse_args()
+    generate(args.corpus_path, spec_from_arguments(args.filings, args))
+
+if __name__ == "__main__":
+    main()
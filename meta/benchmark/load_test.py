@@ -0,0 +1,128 @@
+"""Runs the e-file update end to end against synthetic corpora of increasing size (see generate_corpus.py), and reports
+the throughput and peak memory of each update. At each scale, the corpus's timepoints are applied in turn to one data
+path, so that the first update builds every composite and the later ones are incremental.
+
+Each update runs in a child process of its own, so that its peak RSS, and that of its pool workers, is measured
+separately from the rest of the load test.
+
+    python meta/benchmark/load_test.py WORK_PATH [--scales 10000,100000,1000000] [--output load_test.json]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional
+
+from composer.aws.efile.bucket import use_local_source
+from composer.aws.efile.filings import init_efile_worker
+from composer.aws.efile.indices import EfileIndices
+from composer.aws.s3 import LocalBucket
+from composer.efile.compose import ComposeEfiles
+from composer.efile.update import METRICS_NAME, UpdateEfileState
+from composer.futures import SharedPool
+
+from generate_corpus import CorpusSpec, add_spec_arguments, generate, spec_from_arguments, timepoint_name
+
+def _peak_rss_bytes(who: int) -> int:
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+    peak: int = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _update(corpus_path: str, timepoint: int, data_path: str, temp_path: str, latency: float,
+            bandwidth: Optional[float], results: Connection) -> None:
+    """Runs one update in this child process and sends back its peak RSS, and the largest peak RSS of its workers."""
+    source: LocalBucket = LocalBucket(os.path.join(corpus_path, "xml"), latency, bandwidth)
+    use_local_source(source)
+    indices: EfileIndices = EfileIndices(LocalBucket(os.path.join(corpus_path, "indices", timepoint_name(timepoint)),
+                                                     latency, bandwidth))
+    compose: ComposeEfiles = ComposeEfiles.build(data_path, temp_path, False)
+    pool: SharedPool = SharedPool(initializer=init_efile_worker, initargs=(source,))
+    UpdateEfileState(data_path, indices, compose, pool=pool)()
+    results.send({"peak_rss_bytes": _peak_rss_bytes(resource.RUSAGE_SELF),
+                  "worker_peak_rss_bytes": _peak_rss_bytes(resource.RUSAGE_CHILDREN)})
+
+def run_update(corpus_path: str, timepoint: int, data_path: str, temp_path: str, latency: float,
+               bandwidth: Optional[float]) -> Dict[str, Any]:
+    # Spawned rather than forked, so that the child's peak RSS does not include memory this process used generating the
+    # corpus
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    start: float = time.monotonic()
+    child = context.Process(target=_update, args=(corpus_path, timepoint, data_path, temp_path, latency,
+                                                         bandwidth, sender))
+    child.start()
+    sender.close()
+    child.join()
+    wall_seconds: float = time.monotonic() - start
+    if child.exitcode != 0:
+        raise RuntimeError("Update of timepoint %i failed with exit code %s" % (timepoint, child.exitcode))
+    result: Dict[str, Any] = receiver.recv()
+    with open(os.path.join(data_path, "%s.json" % METRICS_NAME)) as fh:
+        counters: Dict[str, float] = json.load(fh)["counters"]
+    n_indexed: float = counters.get("index_add_entries_total", 0)
+    n_converted: float = counters.get("convert_filings_total", 0)
+    result.update({"wall_seconds": wall_seconds, "index_entries": n_indexed, "filings_converted": n_converted,
+                   "index_entries_per_second": n_indexed / wall_seconds,
+                   "filings_per_second": n_converted / wall_seconds,
+                   "composites_written": counters.get("compose_writes_total", 0)})
+    return result
+
+def run_scale(work_path: str, spec: CorpusSpec, keep: bool, latency: float = 0.0,
+              bandwidth: Optional[float] = None) -> List[Dict[str, Any]]:
+    scale_path: str = os.path.join(work_path, "scale_%i" % spec.n_filings)
+    corpus_path: str = os.path.join(scale_path, "corpus")
+    data_path: str = os.path.join(scale_path, "data")
+    temp_path: str = os.path.join(scale_path, "temp")
+    if not os.path.exists(corpus_path):
+        logging.info("Generating a corpus of {:,} filings.".format(spec.n_filings))
+        generate(corpus_path, spec)
+    shutil.rmtree(data_path, ignore_errors=True)
+    os.makedirs(data_path)
+    os.makedirs(temp_path, exist_ok=True)
+    results: List[Dict[str, Any]] = []
+    try:
+        for timepoint in range(spec.n_timepoints):
+            result: Dict[str, Any] = run_update(corpus_path, timepoint, data_path, temp_path, latency, bandwidth)
+            result.update({"filings": spec.n_filings, "timepoint": timepoint})
+            logging.info("{:,} filings, timepoint {}: {:.1f}s, {:,.0f} filings/s, peak RSS {:,.0f} MB (workers "
+                         "{:,.0f} MB)".format(spec.n_filings, timepoint, result["wall_seconds"],
+                                              result["filings_per_second"], result["peak_rss_bytes"] / 2 ** 20,
+                                              result["worker_peak_rss_bytes"] / 2 ** 20))
+            results.append(result)
+    finally:
+        if not keep:
+            shutil.rmtree(scale_path)
+    return results
+
+def main():
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("work_path", help="Directory for the corpora and data paths.")
+    parser.add_argument("--scales", default="10000,100000,1000000",
+                        help="Comma-separated numbers of original filings in each corpus.")
+    parser.add_argument("--output", default="load_test.json", help="Where to save the results.")
+    parser.add_argument("--keep", action="store_true", help="Keep each corpus and data path after testing it.")
+    parser.add_argument("--source_latency", type=float, default=0.0,
+                        help="Delay each request to the corpus by this many milliseconds, as if it were remote.")
+    parser.add_argument("--source_bandwidth", type=float, default=None,
+                        help="Read from the corpus at no more than this many MB per second.")
+    add_spec_arguments(parser)
+    args: argparse.Namespace = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        bandwidth: Optional[float] = None if args.source_bandwidth is None else args.source_bandwidth * 1024 * 1024
+        results.extend(run_scale(args.work_path, spec_from_arguments(scale, args), args.keep,
+                                 args.source_latency / 1000, bandwidth))
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+    logging.info("Wrote results to %s." % args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Stage-level benchmarks of the e-file pipeline, run against the fixtures. Each result is saved to a JSON file and
+compared with a stored baseline; any result that is worse than the baseline by more than the tolerance is reported as
+a regression, and the script exits with status 1.
+
+    python meta/benchmark/run_benchmarks.py [--output results.json] [--baseline baseline.json] [--save_baseline]
+
+Baselines are specific to the machine they were recorded on, so record one with --save_baseline before comparing."""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+from composer.aws.efile.indices import IndexColumns
+from composer.efile.compose import ComposeEfilesUpdater
+from composer.efile.structures.mdindex import EfileMetadataIndex
+from composer.efile.structures.metadata import FilingMetadata
+from composer.efile.xmlio import JsonTranslator
+from composer.fileio.paths import EINPathManager
+from composer.futures import SharedPool, run_on_process_pool
+from composer.metrics import Histogram, registry, reset
+
+BASEPATH: str = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_PATH: str = os.path.join(BASEPATH, "..", "..", "fixtures")
+DEFAULT_BASELINE: str = os.path.join(BASEPATH, "baseline.json")
+
+# Upper bounds, in bytes, of the filing size classes reported by the translator benchmark
+SIZE_CLASSES: List[Tuple[str, float]] = [("small", 20000), ("medium", 100000), ("large", float("inf"))]
+
+# Filings parsed per from_json measurement, and items dispatched per pool measurement
+FROM_JSON_FILINGS: int = 100000
+DISPATCH_ITEMS: int = 2000
+
+# name -> {"value", "unit", "higher_is_better"}
+Results = Dict[str, Dict[str, Any]]
+
+def _result(value: float, unit: str, higher_is_better: bool) -> Dict[str, Any]:
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+def _best_seconds(repeat: int, func: Callable[[], Any]) -> float:
+    """Runs func repeat times and returns the fastest run, which is the one least disturbed by the rest of the
+    machine."""
+    best: float = float("inf")
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _index_rows(timepoint: str) -> List[Dict[str, str]]:
+    index_path: str = os.path.join(FIXTURE_PATH, "efile_indices", timepoint)
+    rows: List[Dict[str, str]] = []
+    for filename in sorted(os.listdir(index_path)):
+        with open(os.path.join(index_path, filename)) as fh:
+            for filing_list in json.load(fh).values():
+                rows.extend(filing_list)
+    return rows
+
+def _index_filings(timepoint: str) -> List[FilingMetadata]:
+    index_path: str = os.path.join(FIXTURE_PATH, "efile_indices", timepoint)
+    filings: List[FilingMetadata] = []
+    for filename in sorted(os.listdir(index_path)):
+        year: int = int(filename[len("index_"):-len(".json")])
+        with open(os.path.join(index_path, filename)) as fh:
+            filings.extend(IndexColumns.parse(year, fh.read()))
+    return filings
+
+def bench_translator(repeat: int) -> Results:
+    """Throughput of JsonTranslator for each class of filing size, in filings and in megabytes per second."""
+    xml_path: str = os.path.join(FIXTURE_PATH, "efile_xml")
+    by_class: Dict[str, List[str]] = defaultdict(list)
+    for filename in sorted(os.listdir(xml_path)):
+        with open(os.path.join(xml_path, filename)) as fh:
+            raw: str = fh.read()
+        size_class: str = next(name for name, bound in SIZE_CLASSES if len(raw) < bound)
+        by_class[size_class].append(raw)
+    translate: JsonTranslator = JsonTranslator()
+    results: Results = {}
+    for size_class, raws in sorted(by_class.items()):
+        seconds: float = _best_seconds(repeat, lambda: [translate(raw) for raw in raws])
+        n_bytes: int = sum(len(raw.encode("utf-8")) for raw in raws)
+        results["translate_%s_filings_per_second" % size_class] = _result(len(raws) / seconds, "filings/s", True)
+        results["translate_%s_mb_per_second" % size_class] = _result(n_bytes / seconds / 1e6, "MB/s", True)
+    return results
+
+def bench_from_json(repeat: int) -> Results:
+    rows: List[Dict[str, str]] = _index_rows("first_timepoint")
+    rows = (rows * (FROM_JSON_FILINGS // len(rows) + 1))[:FROM_JSON_FILINGS]
+    seconds: float = _best_seconds(repeat, lambda: [FilingMetadata.from_json(row) for row in rows])
+    return {"from_json_filings_per_second": _result(len(rows) / seconds, "filings/s", True)}
+
+def bench_metadata_index(repeat: int) -> Results:
+    """Rate of EfileMetadataIndex.add and commit when the second timepoint's indices are applied to the first
+    timepoint's database, as in an incremental update."""
+    filings: List[FilingMetadata] = _index_filings("second_timepoint")
+    best_add: float = float("inf")
+    best_commit: float = float("inf")
+    n_changes: int = 0
+    workdir: str = tempfile.mkdtemp()
+    try:
+        for _ in range(repeat):
+            db_path: str = os.path.join(workdir, "state.sqlite")
+            shutil.copy(os.path.join(FIXTURE_PATH, "efile_sqlite", "first_timepoint.sqlite"), db_path)
+            conn: sqlite3.Connection = sqlite3.connect(db_path)
+            md_index: EfileMetadataIndex = EfileMetadataIndex.build(conn)
+            start: float = time.perf_counter()
+            for filing in filings:
+                md_index.add(filing)
+            best_add = min(best_add, time.perf_counter() - start)
+            n_changes = sum(len(updates) for _, updates in md_index.changes) + len(md_index.staged_dupes)
+            start = time.perf_counter()
+            md_index.commit()
+            best_commit = min(best_commit, time.perf_counter() - start)
+            conn.close()
+    finally:
+        shutil.rmtree(workdir)
+    return {"index_add_filings_per_second": _result(len(filings) / best_add, "filings/s", True),
+            "index_commit_filings_per_second": _result(n_changes / best_commit, "filings/s", True)}
+
+def bench_compose(repeat: int) -> Results:
+    """Latency of merging each EIN's filings into its composite. The filings of the first timepoint are merged into
+    new composites, then those of the second timepoint into the existing ones. Composites are written without fsync,
+    so that the result reflects the pipeline rather than the disk."""
+    workdir: str = tempfile.mkdtemp()
+    try:
+        translate: JsonTranslator = JsonTranslator()
+        json_path: str = os.path.join(workdir, "json")
+        os.makedirs(json_path)
+        xml_path: str = os.path.join(FIXTURE_PATH, "efile_xml")
+        timepoints: List[List[Tuple[str, Dict[str, str]]]] = []
+        for timepoint in ["first_timepoint", "second_timepoint"]:
+            changes: Dict[str, Dict[str, str]] = defaultdict(dict)
+            for filing in _index_filings(timepoint):
+                xml_file: str = os.path.join(xml_path, "%s_public.xml" % filing.irs_efile_id)
+                if not os.path.exists(xml_file):
+                    continue
+                destination: str = os.path.join(json_path, "%s.json" % filing.irs_efile_id)
+                with open(xml_file) as in_fh, open(destination, "w") as out_fh:
+                    json.dump(translate(in_fh.read()), out_fh)
+                changes[filing.ein][filing.period] = destination
+            timepoints.append(sorted(changes.items()))
+
+        results: Results = {}
+        for name in ["create", "update"]:
+            updaters: List[ComposeEfilesUpdater] = [ComposeEfilesUpdater(EINPathManager(tempfile.mkdtemp(dir=workdir)),
+                                                                         fsync=False) for _ in range(repeat)]
+            if name == "update":
+                for updater in updaters:
+                    updater.create_or_update(timepoints[0])
+            reset()
+            for updater in updaters:
+                updater.create_or_update(timepoints[0] if name == "create" else timepoints[1])
+            latency: Histogram = registry().histogram("compose_merge_seconds")
+            results["compose_%s_p50_ms" % name] = _result(latency.quantile(0.5) * 1e3, "ms", False)
+            results["compose_%s_p99_ms" % name] = _result(latency.quantile(0.99) * 1e3, "ms", False)
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+def _echo(chunk: List[int]) -> List[int]:
+    return chunk
+
+def bench_dispatch(repeat: int) -> Results:
+    """Cost of starting a process pool, and of handing a chunk to one of its workers and collecting the result,
+    measured with chunks that do no work."""
+    items: List[int] = list(range(DISPATCH_ITEMS))
+    start_seconds: float = _best_seconds(repeat, lambda: SharedPool().__enter__().__exit__(None, None, None))
+    with SharedPool():
+        seconds: float = _best_seconds(repeat, lambda: run_on_process_pool(_echo, items, chunk_size=1))
+    return {"pool_start_ms": _result(start_seconds * 1e3, "ms", False),
+            "dispatch_chunk_overhead_us": _result(seconds / len(items) * 1e6, "µs", False)}
+
+BENCHMARKS: List[Callable[[int], Results]] = [bench_translator, bench_from_json, bench_metadata_index, bench_compose,
+                                              bench_dispatch]
+
+def compare(results: Results, baseline: Results, tolerance: float) -> List[str]:
+    """Returns a description of each result that is worse than its baseline by more than the tolerance, as a fraction
+    of the baseline."""
+    regressions: List[str] = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        expected: float = baseline[name]["value"]
+        actual: float = result["value"]
+        change: float = (actual - expected) / expected if expected != 0 else 0.0
+        worse: bool = change < -tolerance if result["higher_is_better"] else change > tolerance
+        if worse:
+            regressions.append("%s: %.4g %s against a baseline of %.4g (%+.0f%%)" % (name, actual, result["unit"],
+                                                                                    expected, change * 100))
+    return regressions
+
+def main():
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to save the results.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Results to compare against.")
+    parser.add_argument("--save_baseline", action="store_true", help="Save the results as the baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Fraction by which a result may be worse than its baseline before it is a regression.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each measurement; the best is kept.")
+    args: argparse.Namespace = parser.parse_args()
+
+    results: Results = {}
+    for benchmark in BENCHMARKS:
+        logging.info("Running %s." % benchmark.__name__)
+        results.update(benchmark(args.repeat))
+    for name, result in sorted(results.items()):
+        logging.info("%-40s %12.4g %s" % (name, result["value"], result["unit"]))
+    report: Dict[str, Any] = {"started": datetime.now().isoformat(timespec="seconds"),
+                              "python": platform.python_version(), "machine": platform.node(), "results": results}
+    with open(args.output, "w") as fh:
+        json.dump(report, fh, indent=2)
+    logging.info("Wrote results to %s." % args.output)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as fh:
+            json.dump(report, fh, indent=2)
+        logging.info("Saved results as the baseline in %s." % args.baseline)
+        return
+    if not os.path.exists(args.baseline):
+        logging.warning("No baseline at %s; record one with --save_baseline." % args.baseline)
+        return
+    with open(args.baseline) as fh:
+        baseline: Results = json.load(fh)["results"]
+    regressions: List[str] = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        logging.error("Regression in %s" % regression)
+    if len(regressions) > 0:
+        sys.exit(1)
+    logging.info("No regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
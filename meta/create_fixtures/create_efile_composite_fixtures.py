@@ -4,9 +4,8 @@ from sqlite3 import Connection, connect
 from typing import Iterator, Tuple, Dict
 
 from composer.aws.efile.filings import RetrieveEfiles
-from mock import MagicMock
 
-from composer.aws.s3 import file_backed_bucket
+from composer.aws.s3 import LocalBucket
 from composer.efile.compose import ComposeEfiles
 from composer.efile.structures.mdindex import EfileMetadataIndex
 from composer.efile.structures.metadata import FilingMetadata
@@ -24,7 +23,7 @@ def get_composite_items(idx: EfileMetadataIndex) -> Iterator[Tuple[str, Dict[str
 
 def get_bucket():
     efile_xml_path: str = os.path.join(BASEPATH, "fixtures", "efile_xml")
-    return file_backed_bucket(efile_xml_path)
+    return LocalBucket(efile_xml_path)
 
 for timepoint in ["first", "second"]:
     cpath: str = "%s/fixtures/efile_sqlite/%s_timepoint.sqlite" % (BASEPATH, timepoint)
@@ -0,0 +1,45 @@
+"""Compares composite write throughput for direct writes against atomic writes with and without batched fsync."""
+import json
+import logging
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+from composer.fileio.atomic import AtomicBatchWriter
+from composer.fileio.paths import EINPathManager
+
+TEMPLATE = "%s.json"
+COMPOSITE: Dict = {"20%02i12" % year: {"Return": {"Field%i" % i: "x" * 40 for i in range(200)}} for year in range(10, 19)}
+
+def write_all(path_mgr: EINPathManager, eins: List[str], writer: Optional[AtomicBatchWriter]):
+    for ein in eins:
+        with path_mgr.open_for_writing(ein, TEMPLATE, writer) as fh:
+            json.dump(COMPOSITE, fh, indent=2)
+    if writer is not None:
+        writer.commit()
+
+def measure(label: str, eins: List[str], make_writer: Callable[[], Optional[AtomicBatchWriter]]):
+    basepath: str = tempfile.mkdtemp()
+    try:
+        path_mgr: EINPathManager = EINPathManager(basepath)
+        write_all(path_mgr, eins, None)  # Composites exist already, as in an update run
+        start: float = time.time()
+        write_all(path_mgr, eins, make_writer())
+        elapsed: float = time.time() - start
+        logging.info("%-32s %8.0f composites/s" % (label, len(eins) / elapsed))
+    finally:
+        shutil.rmtree(basepath)
+
+def main():
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+    n_composites: int = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    eins: List[str] = ["%09i" % (i * 7919 % 1000000000) for i in range(n_composites)]
+    measure("direct (unsafe)", eins, lambda: None)
+    measure("atomic, no fsync", eins, lambda: AtomicBatchWriter(fsync=False))
+    measure("atomic, fsync per 256 files", eins, lambda: AtomicBatchWriter(fsync=True, batch_size=256))
+    measure("atomic, fsync per file", eins, lambda: AtomicBatchWriter(fsync=True, batch_size=1))
+
+if __name__ == "__main__":
+    main()
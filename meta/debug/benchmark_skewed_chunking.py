@@ -0,0 +1,51 @@
+"""Measures stage makespan and tail-completion time for a skewed synthetic workload under different chunking schemes.
+
+Each item stands in for an EIN's filings and costs time proportional to its "size"; sizes follow a heavy-tailed Pareto
+distribution, so a handful of items dominate, as a 40 MB 990 with schedules does among small 990-EZs. The tail is the
+time between the first worker running out of work and the end of the stage."""
+import logging
+import math
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from composer.futures import run_on_process_pool
+
+N_ITEMS: int = 2000
+SECONDS_PER_UNIT: float = 0.0005
+
+def make_workload(seed: int = 0) -> List[int]:
+    rng: random.Random = random.Random(seed)
+    return [int(rng.paretovariate(1.2)) for _ in range(N_ITEMS)]
+
+def work(chunk: List[int]) -> Tuple[int, float, float]:
+    start: float = time.time()
+    time.sleep(sum(chunk) * SECONDS_PER_UNIT)
+    return os.getpid(), start, time.time()
+
+def measure(label: str, workers: int, **kwargs):
+    items: List[int] = make_workload()
+    start: float = time.time()
+    results: List[Tuple[int, float, float]] = run_on_process_pool(work, items, workers_count=workers, **kwargs)
+    end: float = max(finished for _, _, finished in results)
+    last_by_worker: Dict[int, float] = {}
+    for pid, _, finished in results:
+        last_by_worker[pid] = max(finished, last_by_worker.get(pid, 0.0))
+    first_idle: float = min(last_by_worker.values())
+    logging.info("%-44s makespan %6.2fs   tail %6.2fs   chunks %4i" % (label, end - start, end - first_idle,
+                                                                         len(results)))
+
+def main():
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+    workers: int = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    ideal: float = sum(make_workload()) * SECONDS_PER_UNIT / workers
+    logging.info("%i items, %i workers, ideal makespan %.2fs" % (N_ITEMS, workers, ideal))
+    measure("static: one chunk per worker by count", workers, chunk_size=math.ceil(N_ITEMS / workers))
+    measure("guided by count", workers)
+    measure("guided by cost", workers, cost=lambda item: item)
+    measure("guided by cost, largest first", workers, cost=lambda item: item, largest_first=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,82 @@
+import json
 import os
 from collections import Callable
-from typing import Optional
+from typing import Any, Dict, Optional
 from composer.efile.structures.sqlite import init_sqlite_db
 from mock import MagicMock
 
 import pytest
 
-from composer.aws.s3 import Bucket
+from composer import futures
+from composer.aws.efile.filings import RetrieveEfiles
+from composer.aws.efile.indices import EfileIndices
+from composer.aws.s3 import Bucket, LocalBucket
+from composer.efile.compose import ComposeEfiles
+from composer.efile.update import UpdateEfileState
+from composer.fileio.paths import EINPathManager
 
 BASEPATH: str = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_PATH: str = os.path.join(BASEPATH, "..", "fixtures")
 
-@pytest.fixture()
+# EINs whose composites are recorded in fixtures/efile_composites/first_timepoint
+FIRST_TIMEPOINT_EINS = ["208419458", "260687839", "364201074", "943041314"]
+
+@pytest.fixture(scope="session")
 def fixture_path() -> str:
-    return os.path.join(BASEPATH, "..", "fixtures")
+    return FIXTURE_PATH
+
+@pytest.fixture(autouse=True)
+def stall_timeout(monkeypatch):
+    """Fails a test whose pool workers get stuck, rather than hanging the whole run."""
+    monkeypatch.setattr(futures, "STALL_TIMEOUT", 300.0)
+
+def _xml_bucket() -> Bucket:
+    """Stands in for the IRS bucket's filings, serving the XML fixtures."""
+    return LocalBucket(os.path.join(FIXTURE_PATH, "efile_xml"))
+
+@pytest.fixture(scope="session")
+def xml_bucket() -> Callable:
+    """Returns a function that builds a bucket serving the XML fixtures."""
+    return _xml_bucket
+
+@pytest.fixture(scope="module")
+def efile_xml():
+    """Serves filings from the XML fixtures to RetrieveEfiles, in this process and in pool workers, for the whole
+    module."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(RetrieveEfiles, "get_bucket", staticmethod(_xml_bucket))
+        yield
+
+@pytest.fixture(scope="session")
+def make_update() -> Callable:
+    """Returns a function that builds an update of a data path from the first timepoint's indices. Options in
+    retrieve_options are passed to RetrieveEfiles, and the rest to UpdateEfileState."""
+    def _make(data_path: str, temp_path: str, retrieve_options: Optional[Dict] = None,
+              **options: Any) -> UpdateEfileState:
+        indices: EfileIndices = EfileIndices(LocalBucket(os.path.join(FIXTURE_PATH, "efile_indices",
+                                                                             "first_timepoint")))
+        retrieve_options = retrieve_options or {}
+        retrieve: RetrieveEfiles = RetrieveEfiles(temp_path, **retrieve_options)
+        compose: ComposeEfiles = ComposeEfiles(retrieve, EINPathManager(data_path),
+                                               use_plan=retrieve_options.get("use_plan", False))
+        return UpdateEfileState(data_path, indices, compose, **options)
+    return _make
+
+@pytest.fixture(scope="session")
+def load_composite() -> Callable:
+    """Returns a function that reads an EIN's composite from a data path in the default layout."""
+    def _load(root: str, ein: str) -> Dict:
+        with open(os.path.join(root, ein[0:3], ein[3:6], "%s.json" % ein)) as fh:
+            return json.load(fh)
+    return _load
+
+@pytest.fixture(scope="session")
+def expected_composite(load_composite) -> Callable:
+    """Returns a function that reads an EIN's composite as recorded in the fixtures for a timepoint."""
+    def _expected(ein: str, timepoint: str = "first_timepoint") -> Dict:
+        return load_composite(os.path.join(FIXTURE_PATH, "efile_composites", timepoint), ein)
+    return _expected
+
+@pytest.fixture(params=FIRST_TIMEPOINT_EINS)
+def first_timepoint_ein(request) -> str:
+    return request.param
@@ -0,0 +1,53 @@
+import itertools
+import os
+from sqlite3 import connect
+from typing import Iterator, List, Optional, Tuple
+
+import pytest
+
+from composer.aws.efile.filings import RetrieveEfiles
+from composer.aws.s3 import Bucket, LocalBucket, ObjectInfo
+
+MISSING_EIN: str = "364201074"
+MISSING_ID: str = "201842359349300914"
+
+class UnlistedBucket(LocalBucket):
+    """Serves the XML fixtures, but fails any request for the filing left out of the inventory."""
+
+    def get_obj_body(self, key: str, encoding: Optional[str] = "utf-8"):
+        if key == "%s_public.xml" % MISSING_ID:
+            raise RuntimeError("Requested an object that is not in the inventory")
+        return super().get_obj_body(key, encoding)
+
+@pytest.fixture(scope="module")
+def data_path(tmp_path_factory, fixture_path, make_update) -> str:
+    def unlisted_bucket() -> Bucket:
+        return UnlistedBucket(os.path.join(fixture_path, "efile_xml"))
+
+    def listing() -> Iterator[ObjectInfo]:
+        indices: LocalBucket = LocalBucket(os.path.join(fixture_path, "efile_indices", "first_timepoint"))
+        objects = itertools.chain(indices.list_objects(), unlisted_bucket().list_objects())
+        return (obj for obj in objects if obj[0] != "%s_public.xml" % MISSING_ID)
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(RetrieveEfiles, "get_bucket", staticmethod(unlisted_bucket))
+        data_path: str = str(tmp_path_factory.mktemp("data"))
+        make_update(data_path, str(tmp_path_factory.mktemp("temp")), inventory_source=listing)()
+    return data_path
+
+def _query(data_path: str, query: str) -> List[Tuple]:
+    with connect(os.path.join(data_path, "state.sqlite")) as conn:
+        return list(conn.execute(query))
+
+def test_missing_filing_never_requested(data_path):
+    assert _query(data_path, "SELECT irs_efile_id, stage, error FROM quarantine") == \
+        [(MISSING_ID, "downloaded", "%s_public.xml is not in the bucket inventory" % MISSING_ID)]
+
+def test_inventory_kept(data_path, fixture_path):
+    n_indices: int = len(os.listdir(os.path.join(fixture_path, "efile_indices", "first_timepoint")))
+    n_xml: int = len(os.listdir(os.path.join(fixture_path, "efile_xml")))
+    assert _query(data_path, "SELECT COUNT(*) FROM bucket_inventory") == [(n_indices + n_xml - 1,)]
+
+def test_other_eins_composed(data_path, first_timepoint_ein, load_composite, expected_composite):
+    if first_timepoint_ein != MISSING_EIN:
+        assert load_composite(data_path, first_timepoint_ein) == expected_composite(first_timepoint_ein)
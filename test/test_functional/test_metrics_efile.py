@@ -0,0 +1,11 @@
+import os
+
+def test_unwritable_metrics_path_does_not_fail_run(tmp_path, efile_xml, make_update, load_composite,
+                                                   expected_composite):
+    data_path: str = str(tmp_path / "data")
+    os.makedirs(data_path)
+    blocked: str = str(tmp_path / "blocked")
+    open(blocked, "w").close()
+    make_update(data_path, str(tmp_path), metrics_path=os.path.join(blocked, "metrics"))()
+    ein: str = "208419458"
+    assert load_composite(data_path, ein) == expected_composite(ein)
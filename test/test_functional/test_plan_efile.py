@@ -0,0 +1,10 @@
+import pytest
+
+@pytest.fixture(scope="module")
+def planned_path(tmp_path_factory, efile_xml, make_update) -> str:
+    data_path: str = str(tmp_path_factory.mktemp("data"))
+    make_update(data_path, str(tmp_path_factory.mktemp("temp")), retrieve_options={"use_plan": True})()
+    return data_path
+
+def test_planned_composites(planned_path, first_timepoint_ein, load_composite, expected_composite):
+    assert load_composite(planned_path, first_timepoint_ein) == expected_composite(first_timepoint_ein)
@@ -0,0 +1,28 @@
+from typing import Dict, List, Tuple
+
+import pytest
+
+from composer.aws.efile.filings import RetrieveEfiles
+from composer.efile.structures.metadata import FilingMetadata
+
+@pytest.fixture(scope="module")
+def prefetched(tmp_path_factory, efile_xml, make_update) -> Tuple[str, List[Tuple[str, Dict[str, FilingMetadata]]]]:
+    """Runs an update with prefetching, recording what the retrieval stage was still asked to download."""
+    download_all = RetrieveEfiles._download_all
+    requested: List[Tuple[str, Dict[str, FilingMetadata]]] = []
+    def record_download(self, changes):
+        requested.extend(changes)
+        return download_all(self, changes)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(RetrieveEfiles, "_download_all", record_download)
+        data_path: str = str(tmp_path_factory.mktemp("data"))
+        make_update(data_path, str(tmp_path_factory.mktemp("temp")), prefetch=True)()
+    return data_path, requested
+
+def test_prefetched_filings_not_downloaded_again(prefetched):
+    _, requested = prefetched
+    assert requested == []
+
+def test_prefetched_composites(prefetched, first_timepoint_ein, load_composite, expected_composite):
+    data_path, _ = prefetched
+    assert load_composite(data_path, first_timepoint_ein) == expected_composite(first_timepoint_ein)
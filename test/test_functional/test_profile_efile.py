@@ -0,0 +1,25 @@
+import os
+import tracemalloc
+from typing import Set
+
+import pytest
+
+from composer import profiling
+from composer.efile.update import PROFILE_DIRECTORY
+
+@pytest.fixture(scope="module")
+def profiled_path(tmp_path_factory, efile_xml, make_update) -> str:
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(profiling, "_profiles", profiling._Profiles())
+        data_path: str = str(tmp_path_factory.mktemp("data"))
+        make_update(data_path, str(tmp_path_factory.mktemp("temp")), profile=True)()
+    return data_path
+
+def test_profile_written_for_every_stage(profiled_path):
+    written: Set[str] = set(os.listdir(os.path.join(profiled_path, PROFILE_DIRECTORY)))
+    assert {"index_pass.pstats", "batch.pstats", "index.pstats", "download.pstats", "convert.pstats",
+            "compose.pstats", "summary.txt"} <= written
+
+def test_profiling_stopped(profiled_path):
+    assert not tracemalloc.is_tracing()
+    assert not profiling.enabled()
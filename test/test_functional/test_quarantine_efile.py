@@ -0,0 +1,65 @@
+import os
+from sqlite3 import connect
+from typing import List, Optional, Tuple
+
+import pytest
+
+from composer.aws.efile.filings import RetrieveEfiles
+from composer.aws.s3 import Bucket, LocalBucket
+
+BAD_EIN: str = "943041314"
+BAD_ID: str = "201102999349300730"
+
+def quarantined(data_path: str) -> List[Tuple]:
+    with connect(os.path.join(data_path, "state.sqlite")) as conn:
+        return list(conn.execute("SELECT irs_efile_id, stage FROM quarantine"))
+
+class MalformedBucket(LocalBucket):
+    """Serves the XML fixtures, except that one filing is truncated."""
+
+    def get_obj_body(self, key: str, encoding: Optional[str] = "utf-8"):
+        if key == "%s_public.xml" % BAD_ID:
+            return "<Return><ReturnData>"
+        return super().get_obj_body(key, encoding)
+
+@pytest.fixture()
+def paths(tmp_path, monkeypatch, fixture_path, make_update) -> Tuple[str, str]:
+    def malformed_bucket() -> Bucket:
+        return MalformedBucket(os.path.join(fixture_path, "efile_xml"))
+    monkeypatch.setattr(RetrieveEfiles, "get_bucket", staticmethod(malformed_bucket))
+    data_path: str = str(tmp_path / "data")
+    temp_path: str = str(tmp_path / "temp")
+    os.makedirs(data_path)
+    os.makedirs(temp_path)
+    make_update(data_path, temp_path)()
+    return data_path, temp_path
+
+def test_bad_filing_quarantined(paths):
+    data_path, _ = paths
+    assert quarantined(data_path) == [(BAD_ID, "converted")]
+
+def test_bad_filing_not_indexed(paths):
+    data_path, _ = paths
+    with connect(os.path.join(data_path, "state.sqlite")) as conn:
+        rows = list(conn.execute("SELECT irs_efile_id FROM latest_filings WHERE ein = ? AND period = '201012'",
+                                 (BAD_EIN,)))
+    assert rows == []
+
+def test_rest_of_ein_composed(paths, load_composite, expected_composite):
+    data_path, _ = paths
+    expected = expected_composite(BAD_EIN)
+    del expected["201012"]
+    assert load_composite(data_path, BAD_EIN) == expected
+
+def test_other_eins_composed(paths, load_composite, expected_composite):
+    data_path, _ = paths
+    ein: str = "208419458"
+    assert load_composite(data_path, ein) == expected_composite(ein)
+
+def test_retry_releases_and_composes(paths, monkeypatch, xml_bucket, make_update, load_composite,
+                                     expected_composite):
+    data_path, temp_path = paths
+    monkeypatch.setattr(RetrieveEfiles, "get_bucket", staticmethod(xml_bucket))
+    make_update(data_path, temp_path, retry_quarantined=True)()
+    assert quarantined(data_path) == []
+    assert load_composite(data_path, BAD_EIN) == expected_composite(BAD_EIN)
@@ -0,0 +1,51 @@
+import json
+import os
+from sqlite3 import connect
+from typing import Dict, List, Tuple
+
+import pytest
+
+import composer.efile.update as update
+
+def _versions(data_path: str) -> List[Tuple]:
+    with connect(os.path.join(data_path, "state.sqlite")) as conn:
+        return list(conn.execute("""
+            SELECT latest_filings.irs_efile_id, converter_version FROM latest_filings
+            LEFT JOIN conversions ON latest_filings.irs_efile_id = conversions.irs_efile_id
+        """))
+
+def _counters(data_path: str) -> Dict[str, float]:
+    with open(os.path.join(data_path, "%s.json" % update.METRICS_NAME)) as fh:
+        return json.load(fh)["counters"]
+
+@pytest.fixture(scope="module")
+def data_path(tmp_path_factory, efile_xml, make_update) -> str:
+    data_path: str = str(tmp_path_factory.mktemp("data"))
+    make_update(data_path, str(tmp_path_factory.mktemp("temp")))()
+    return data_path
+
+@pytest.fixture(scope="module")
+def reconverted(data_path, tmp_path_factory, efile_xml, make_update) -> List[Tuple]:
+    before: List[Tuple] = _versions(data_path)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(update, "CONVERTER_VERSION", "2")
+        make_update(data_path, str(tmp_path_factory.mktemp("temp")), reconvert=True)()
+    return before
+
+def test_versions_recorded(data_path):
+    versions: List[Tuple] = _versions(data_path)
+    assert len(versions) > 0
+    assert {version for _, version in versions} == {update.CONVERTER_VERSION}
+
+def test_reconverts_older_versions(reconverted, data_path):
+    assert sorted(irs_efile_id for irs_efile_id, _ in _versions(data_path)) == \
+        sorted(irs_efile_id for irs_efile_id, _ in reconverted)
+    assert {version for _, version in _versions(data_path)} == {"2"}
+    assert _counters(data_path)["convert_filings_total"] == len(reconverted)
+
+def test_unchanged_composites_not_rewritten(reconverted, data_path, first_timepoint_ein, load_composite,
+                                            expected_composite):
+    counters: Dict[str, float] = _counters(data_path)
+    assert counters.get("compose_writes_total", 0) == 0
+    assert counters["compose_unchanged_total"] > 0
+    assert load_composite(data_path, first_timepoint_ein) == expected_composite(first_timepoint_ein)
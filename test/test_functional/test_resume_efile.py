@@ -0,0 +1,51 @@
+import os
+from sqlite3 import connect
+from typing import Set
+
+import pytest
+from mock import MagicMock
+
+from composer.aws.efile.indices import EfileIndices
+from composer.efile.update import UpdateEfileState
+
+class Interrupted(Exception):
+    pass
+
+@pytest.fixture(scope="module")
+def resumed_path(tmp_path_factory, efile_xml, make_update) -> str:
+    data_path: str = str(tmp_path_factory.mktemp("data"))
+    temp_path: str = str(tmp_path_factory.mktemp("temp"))
+
+    interrupted: UpdateEfileState = make_update(data_path, temp_path, retrieve_options={"persistent": True},
+                                                batch_size=1)
+    process_all = interrupted.compose.process_all
+    calls: MagicMock = MagicMock(side_effect=[None, None, Interrupted])
+    def fail_on_third_batch(json_changes):
+        calls(json_changes)
+        return process_all(json_changes)
+    interrupted.compose.process_all = fail_on_third_batch
+    with pytest.raises(Interrupted):
+        interrupted()
+
+    resumed: UpdateEfileState = make_update(data_path, temp_path, retrieve_options={"persistent": True},
+                                            resume=True, batch_size=1)
+    resumed.indices = MagicMock(spec=EfileIndices)
+    resumed.indices.__iter__.side_effect = AssertionError("Resumed run should not re-read the indices")
+    resumed.indices.by_year.side_effect = AssertionError("Resumed run should not re-read the indices")
+    resumed()
+    return data_path
+
+def test_resumed_composites(resumed_path, first_timepoint_ein, load_composite, expected_composite):
+    assert load_composite(resumed_path, first_timepoint_ein) == expected_composite(first_timepoint_ein)
+
+def test_resumed_latest_filings(resumed_path, fixture_path):
+    query: str = "SELECT irs_efile_id FROM latest_filings"
+    with connect(os.path.join(resumed_path, "state.sqlite")) as a_conn, \
+            connect(os.path.join(fixture_path, "efile_sqlite", "first_timepoint.sqlite")) as e_conn:
+        actual: Set = {row for row in a_conn.execute(query)}
+        expected: Set = {row for row in e_conn.execute(query)}
+    assert actual == expected
+
+def test_resumed_ledger_cleared(resumed_path):
+    with connect(os.path.join(resumed_path, "state.sqlite")) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM run_filings").fetchone()[0] == 0
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from composer.aws.efile.bucket import use_local_source
+from composer.aws.s3 import LocalBucket
+from composer.efile.update import UpdateEfileState
+
+@pytest.fixture(scope="module")
+def mirrored_path(tmp_path_factory, fixture_path) -> str:
+    """Runs an update built as the CLI builds it, reading from a local mirror of the bucket rather than from S3."""
+    mirror: str = str(tmp_path_factory.mktemp("mirror"))
+    for directory in [os.path.join(fixture_path, "efile_indices", "first_timepoint"),
+                      os.path.join(fixture_path, "efile_xml")]:
+        for filename in os.listdir(directory):
+            os.symlink(os.path.join(directory, filename), os.path.join(mirror, filename))
+    data_path: str = str(tmp_path_factory.mktemp("data"))
+    try:
+        UpdateEfileState.build(data_path, str(tmp_path_factory.mktemp("temp")), False, source=LocalBucket(mirror))()
+    finally:
+        use_local_source(None)
+    return data_path
+
+def test_mirrored_composites(mirrored_path, first_timepoint_ein, load_composite, expected_composite):
+    assert load_composite(mirrored_path, first_timepoint_ein) == expected_composite(first_timepoint_ein)
@@ -0,0 +1,21 @@
+import pytest
+
+import composer.aws.efile.filings as filings
+from composer.efile.update import UpdateEfileState
+
+@pytest.fixture(scope="module")
+def budgeted_path(tmp_path_factory, efile_xml, make_update) -> str:
+    """Runs an update whose staging area can only ever hold one EIN's files, so that every EIN after the first in a
+    batch is deferred."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(filings, "DOWNLOAD_WAVE_EINS", 1)
+        data_path: str = str(tmp_path_factory.mktemp("data"))
+        update: UpdateEfileState = make_update(data_path, str(tmp_path_factory.mktemp("temp")),
+                                               retrieve_options={"persistent": True, "staging_budget": 1},
+                                               batch_size=3)
+        update()
+        assert update.compose.retrieve.staged_bytes == 0
+    return data_path
+
+def test_budgeted_composites(budgeted_path, first_timepoint_ein, load_composite, expected_composite):
+    assert load_composite(budgeted_path, first_timepoint_ein) == expected_composite(first_timepoint_ein)
@@ -0,0 +1,31 @@
+import json
+from typing import Any, Dict, List
+
+import pytest
+
+from composer import tracing
+
+@pytest.fixture(scope="module")
+def trace(tmp_path_factory, efile_xml, make_update) -> Dict[str, Any]:
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(tracing, "_trace", tracing._Trace())
+        trace_path: str = str(tmp_path_factory.mktemp("trace") / "trace.json")
+        make_update(str(tmp_path_factory.mktemp("data")), str(tmp_path_factory.mktemp("temp")),
+                    trace_path=trace_path)()
+    with open(trace_path) as fh:
+        return json.load(fh)
+
+def test_every_filing_traced(trace):
+    spans: List[Dict[str, Any]] = [e for e in trace["traceEvents"] if e.get("cat") == "filing"]
+    downloaded: List[str] = [e["args"]["irs_efile_id"] for e in spans if e["name"] == "download"]
+    converted: List[str] = [e["args"]["irs_efile_id"] for e in spans if e["name"] == "convert"]
+    assert len(downloaded) == 30
+    assert sorted(converted) == sorted(downloaded)
+
+def test_stages_traced(trace):
+    stages: List[str] = [e["name"] for e in trace["traceEvents"] if e.get("cat") == "stage"]
+    assert {"index pass", "index", "download", "convert", "compose"} <= set(stages)
+
+def test_summary(trace):
+    assert len(trace["otherData"]["slowest_filings"]) == tracing.SLOWEST_FILINGS
+    assert len(trace["otherData"]["worker_utilization"]) > 0
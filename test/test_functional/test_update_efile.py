@@ -10,7 +10,7 @@ import shutil
 
 from composer.aws.efile.filings import RetrieveEfiles
 from composer.aws.efile.indices import EfileIndices
-from composer.aws.s3 import Bucket, file_backed_bucket, List
+from composer.aws.s3 import Bucket, LocalBucket, List
 from composer.efile.compose import ComposeEfiles
 from composer.efile.update import UpdateEfileState
 from composer.fileio.paths import EINPathManager
@@ -28,7 +28,7 @@ shutil.rmtree(working_path, ignore_errors=True)
 
 def make_indices(timepoint: str) -> EfileIndices:
     efile_index_path: str = os.path.join(fixture_path, "efile_indices", "%s_timepoint" % timepoint)
-    index_bucket: Bucket = file_backed_bucket(efile_index_path)
+    index_bucket: Bucket = LocalBucket(efile_index_path)
     indices: EfileIndices = EfileIndices(index_bucket)
     return indices
 
@@ -46,7 +46,7 @@ def do_update(timepoint: str, tp_path: str):
 
 def get_bucket():
     efile_xml_path: str = os.path.join(fixture_path, "efile_xml")
-    return file_backed_bucket(efile_xml_path)
+    return LocalBucket(efile_xml_path)
 
 RetrieveEfiles.get_bucket = get_bucket
 
@@ -0,0 +1,107 @@
+import logging
+import os
+import shutil
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import pytest
+
+import composer.aws.efile.filings as filings
+from composer.aws.efile.filings import RetrieveEfiles, json_path_for
+from composer.aws.efile.indices import EfileIndices
+from composer.aws.s3 import LocalBucket
+from composer.efile.conversions import ConversionCache
+from composer.efile.structures.metadata import FilingMetadata
+from composer.efile.structures.quarantine import ItemFailure
+
+@pytest.fixture()
+def changes(fixture_path) -> List[Tuple[str, Dict[str, FilingMetadata]]]:
+    indices: EfileIndices = EfileIndices(LocalBucket(os.path.join(fixture_path, "efile_indices",
+                                                                         "first_timepoint")))
+    by_ein: Dict[str, Dict[str, FilingMetadata]] = defaultdict(dict)
+    for filing in indices:
+        xml_path: str = os.path.join(fixture_path, "efile_xml", "%s_public.xml" % filing.irs_efile_id)
+        if filing.ein in {"208419458", "260687839"} and os.path.exists(xml_path):
+            by_ein[filing.ein][filing.period] = filing
+    return list(by_ein.items())
+
+@pytest.fixture()
+def retrieve(tmp_path, fixture_path, changes) -> RetrieveEfiles:
+    """A retriever whose XML staging directory already holds the filings."""
+    retrieve: RetrieveEfiles = RetrieveEfiles(str(tmp_path))
+    for ein, updates in changes:
+        directory: str = retrieve.xml_paths.ensure_directory_for(ein)
+        for filing in updates.values():
+            filename: str = "%s_public.xml" % filing.irs_efile_id
+            shutil.copy(os.path.join(fixture_path, "efile_xml", filename), os.path.join(directory, filename))
+    return retrieve
+
+def assert_converted(retrieve: RetrieveEfiles, changes: List[Tuple[str, Dict[str, FilingMetadata]]]):
+    for ein, updates in changes:
+        for filing in updates.values():
+            assert os.path.exists(json_path_for(retrieve.json_paths, ein, filing.irs_efile_id))
+
+def test_overrunning_filings_converted_in_slow_lane(retrieve, changes):
+    retrieve.convert_timeout = 1e-6
+    failures: List[ItemFailure] = retrieve._convert_all(changes)
+    assert failures == []
+    assert_converted(retrieve, changes)
+
+def test_overrunning_slow_lane_fails(retrieve, changes, monkeypatch):
+    retrieve.convert_timeout = 1e-6
+    monkeypatch.setattr(filings, "SLOW_LANE_TIMEOUT", 1e-6)
+    failures: List[ItemFailure] = retrieve._convert_all(changes)
+    n_filings: int = sum(len(updates) for _, updates in changes)
+    assert len(failures) == n_filings
+    assert all(failure.timed_out for failure in failures)
+
+def test_split_by_size(retrieve, changes, monkeypatch):
+    sizes: List[int] = sorted(retrieve._xml_bytes_of(ein, [f.irs_efile_id]) for ein, u in changes for f in u.values())
+    threshold: int = sizes[len(sizes) // 2]
+    monkeypatch.setattr(filings, "HUGE_XML_BYTES", threshold)
+    small, huge, largest = retrieve._split_by_size(changes)
+    assert sorted(retrieve._xml_bytes_of(ein, [f.irs_efile_id]) for ein, u in small for f in u.values()) == \
+        [size for size in sizes if size <= threshold]
+    assert sorted(retrieve._xml_bytes_of(ein, [f.irs_efile_id]) for ein, u in huge for f in u.values()) == \
+        [size for size in sizes if size > threshold]
+    assert largest == sizes[-1]
+
+def test_budgeted_workers(retrieve, monkeypatch):
+    monkeypatch.setattr(filings, "MEMORY_PER_XML_BYTE", 10)
+    retrieve.convert_memory_budget = 1000
+    assert retrieve._budgeted_workers(25) == 4
+    assert retrieve._budgeted_workers(1000) == 1
+
+def test_huge_filings_converted_in_budgeted_lane(retrieve, changes, monkeypatch, caplog):
+    monkeypatch.setattr(filings, "HUGE_XML_BYTES", 10000)
+    retrieve.convert_memory_budget = 1
+    caplog.set_level(logging.INFO)
+    assert retrieve._convert_all(changes) == []
+    assert_converted(retrieve, changes)
+    assert "on 1 worker(s)" in caplog.text
+
+def test_conversion_cache(retrieve, changes, tmp_path, monkeypatch):
+    retrieve.conversion_cache = ConversionCache(str(tmp_path / "cache"))
+    assert retrieve._convert_all(changes) == []
+    converted: Dict[str, str] = {}
+    for ein, updates in changes:
+        for filing in updates.values():
+            with open(json_path_for(retrieve.json_paths, ein, filing.irs_efile_id)) as fh:
+                converted[filing.irs_efile_id] = fh.read()
+    shutil.rmtree(retrieve.json_cache_dir)
+
+    def translate(raw_xml: str):
+        raise AssertionError("Converted a filing held by the cache")
+    monkeypatch.setattr(filings, "_get_worker_translator", lambda: translate)
+    assert retrieve._convert_all(changes) == []
+    for ein, updates in changes:
+        for filing in updates.values():
+            with open(json_path_for(retrieve.json_paths, ein, filing.irs_efile_id)) as fh:
+                assert fh.read() == converted[filing.irs_efile_id]
+
+def test_conversion_cache_keyed_by_version(tmp_path):
+    cache: ConversionCache = ConversionCache(str(tmp_path))
+    key: str = cache.key("<Return/>")
+    cache.put(key, "{}")
+    assert cache.get(key) == "{}"
+    assert ConversionCache(str(tmp_path), version="later").get(key) is None
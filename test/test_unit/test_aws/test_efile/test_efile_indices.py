@@ -0,0 +1,38 @@
+import json
+from typing import Dict, List
+
+import pytest
+
+from composer.aws.efile.indices import IndexColumns, _fetch_indices
+from composer.aws.s3 import LocalBucket
+from composer.efile.structures.metadata import FilingMetadata
+
+def spec(irs_efile_id: str, name: str = "SOME ORGANIZATION") -> Dict[str, str]:
+    return {"EIN": "123456789", "TaxPeriod": "201712", "DLN": "93493%s" % irs_efile_id[-9:], "FormType": "990",
+            "URL": "https://s3.amazonaws.com/irs-form-990/%s_public.xml" % irs_efile_id, "OrganizationName": name,
+            "SubmittedOn": "2018-05-01", "ObjectId": irs_efile_id, "LastUpdated": "2018-06-01T00:00:00"}
+
+def as_raw(specs: List[Dict[str, str]]) -> str:
+    return json.dumps({"Filings2018": specs})
+
+def test_columns_match_from_json():
+    specs: List[Dict[str, str]] = [spec("201800000000000001"), spec("201800000000000002", "ANOTHER ORGANIZATION")]
+    actual: List[FilingMetadata] = list(IndexColumns.parse(2018, as_raw(specs)))
+    expected: List[FilingMetadata] = [FilingMetadata.from_json(s) for s in specs]
+    for filing in actual + expected:
+        filing.date_downloaded = "the current time"
+    assert actual == expected
+
+def test_empty_year():
+    columns: IndexColumns = IndexColumns.parse(2018, as_raw([]))
+    assert columns.n_filings == 0
+    assert list(columns) == []
+
+def test_reserved_character_rejected():
+    with pytest.raises(ValueError):
+        IndexColumns.parse(2018, as_raw([spec("201800000000000001", "BAD\x1fNAME")]))
+
+def test_fetch_skips_missing_years(tmp_path):
+    (tmp_path / "index_2018.json").write_text(as_raw([spec("201800000000000001")]))
+    parsed: List[IndexColumns] = _fetch_indices([2017, 2018], LocalBucket(str(tmp_path)))
+    assert [(columns.year, columns.n_filings) for columns in parsed] == [(2018, 1)]
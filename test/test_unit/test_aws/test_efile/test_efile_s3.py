@@ -1,11 +1,19 @@
+import pickle
+
+import composer.aws.efile.bucket as efile_bucket
+import composer.aws.efile.filings as filings
+import composer.aws.s3 as s3
 from composer.aws.efile.indices import EfileIndices
-from composer.aws.s3 import Bucket, List, file_backed_bucket
+from composer.aws.handshake import Handshake
+from composer.aws.handshake.ssm import SecretManager
+from composer.aws.s3 import Bucket, List, LocalBucket
 import os
+from mock import MagicMock
 from composer.efile.structures.metadata import FilingMetadata
 
 def test_read_efile_indices(fixture_path):
     index_path: str = os.path.join(fixture_path, "efile_indices", "first_timepoint")
-    bucket: Bucket = file_backed_bucket(index_path)
+    bucket: Bucket = LocalBucket(index_path)
     indices: EfileIndices = EfileIndices(bucket)
     expected: List = [
         FilingMetadata(record_id='364201074_201012', irs_efile_id='201101389349300010', irs_dln='93493138000101',
@@ -233,3 +241,19 @@ def test_read_efile_indices(fixture_path):
     for a in actual:
         a.date_downloaded = 'the current time'
     assert expected == actual
+
+def test_worker_reads_with_resolved_credentials(monkeypatch):
+    ssm: SecretManager = MagicMock(spec=SecretManager)
+    ssm.resolve.side_effect = lambda key: "resolved %s" % key
+    monkeypatch.setattr(efile_bucket, "_credentials", None)
+    monkeypatch.setattr(filings, "_worker_bucket", None)
+    monkeypatch.setattr(filings.RetrieveEfiles, "get_bucket", staticmethod(efile_bucket.efile_bucket))
+    monkeypatch.setattr(filings, "_get_worker_translator", lambda: None)
+    monkeypatch.setattr(s3, "s3_client", lambda aws_id=None, aws_secret=None: (aws_id, aws_secret))
+
+    # Secrets are resolved once, in the parent; the worker gets them by pickle, as it would through the pool
+    credentials: Handshake = pickle.loads(pickle.dumps(efile_bucket.use_credentials(Handshake(ssm=ssm))))
+    assert ssm.resolve.call_count == 2
+    filings.init_efile_worker(credentials=credentials)
+    assert ssm.resolve.call_count == 2
+    assert filings._worker_bucket.s3 == ("resolved s3/aws_key", "resolved s3/aws_secret")
@@ -0,0 +1,100 @@
+import os
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import pytest
+from mock import MagicMock
+
+import composer.aws.efile.filings as filings
+from composer import metrics
+from composer.aws.efile.filings import FetchOutcome, Prefetcher, RetrieveEfiles, json_path_for
+from composer.aws.efile.indices import EfileIndices
+from composer.aws.s3 import LocalBucket
+from composer.efile.structures.metadata import FilingMetadata
+
+@pytest.fixture()
+def changes(fixture_path) -> List[Tuple[str, Dict[str, FilingMetadata]]]:
+    indices: EfileIndices = EfileIndices(LocalBucket(os.path.join(fixture_path, "efile_indices",
+                                                                         "first_timepoint")))
+    by_ein: Dict[str, Dict[str, FilingMetadata]] = defaultdict(dict)
+    for filing in indices:
+        xml_path: str = os.path.join(fixture_path, "efile_xml", "%s_public.xml" % filing.irs_efile_id)
+        if filing.ein in {"208419458", "260687839"} and os.path.exists(xml_path):
+            by_ein[filing.ein][filing.period] = filing
+    return sorted(by_ein.items())
+
+@pytest.fixture()
+def retrieve(tmp_path, fixture_path, monkeypatch) -> RetrieveEfiles:
+    monkeypatch.setattr(RetrieveEfiles, "get_bucket",
+                        staticmethod(lambda: LocalBucket(os.path.join(fixture_path, "efile_xml"))))
+    monkeypatch.setattr(filings, "DOWNLOAD_WAVE_EINS", 1)
+    return RetrieveEfiles(str(tmp_path), staging_budget=1)
+
+def staged_files(retrieve: RetrieveEfiles) -> List[str]:
+    return [filename for directory in (retrieve.xml_cache_dir, retrieve.json_cache_dir)
+            for _, _, filenames in os.walk(directory) for filename in filenames]
+
+def test_fetch_defers_over_budget(retrieve, changes):
+    outcome: FetchOutcome = retrieve.fetch(changes)
+    assert outcome.failures == []
+    assert outcome.deferred == changes[1:]
+    ein, updates = changes[0]
+    json_paths: List[str] = [json_path_for(retrieve.json_paths, ein, f.irs_efile_id) for f in updates.values()]
+    assert sorted(staged_files(retrieve)) == sorted(os.path.basename(path) for path in json_paths)
+    assert retrieve.staged_bytes == sum(os.path.getsize(path) for path in json_paths)
+
+def test_fetch_within_budget(retrieve, changes):
+    retrieve.staging_budget = 1024 * 1024 * 1024
+    outcome: FetchOutcome = retrieve.fetch(changes)
+    assert outcome == FetchOutcome()
+
+def test_discard(retrieve, changes):
+    retrieve.fetch(changes)
+    retrieve.discard(changes[:1])
+    assert staged_files(retrieve) == []
+    assert retrieve.staged_bytes == 0
+
+def test_discard_no_cleanup(retrieve, changes):
+    retrieve.no_cleanup = True
+    retrieve.fetch(changes)
+    retrieve.discard(changes[:1])
+    assert len(staged_files(retrieve)) > 0
+
+def test_call_fetches_deferred(retrieve, changes):
+    assert sorted(ein for ein, _ in retrieve(changes)) == [ein for ein, _ in changes]
+
+def test_prefetch_discards_superseded(retrieve, changes):
+    retrieve.staging_budget = None
+    filings_seen: List[FilingMetadata] = [f for _, updates in changes for f in updates.values()]
+    prefetcher: Prefetcher = Prefetcher(retrieve, wave_size=2)
+    for filing in filings_seen:
+        prefetcher.submit(filing)
+    kept: List[FilingMetadata] = prefetcher.finish(lambda filing: filing.ein == changes[0][0])
+    assert kept == list(changes[0][1].values())
+    assert sorted(staged_files(retrieve)) == sorted("%s_public.xml" % f.irs_efile_id for f in kept)
+
+def test_prefetch_flush_starts_partial_wave(retrieve, changes):
+    retrieve.staging_budget = None
+    filing: FilingMetadata = next(iter(changes[0][1].values()))
+    prefetcher: Prefetcher = Prefetcher(retrieve, wave_size=100)
+    prefetcher.submit(filing)
+    assert prefetcher.in_flight == []
+    prefetcher.flush()
+    prefetcher._reap(wait=True)
+    assert staged_files(retrieve) == ["%s_public.xml" % filing.irs_efile_id]
+    prefetcher.finish(lambda filing: True)
+
+def test_prefetch_stops_over_budget(retrieve, changes):
+    prefetcher: Prefetcher = Prefetcher(retrieve, wave_size=1)
+    for _, updates in changes:
+        for filing in updates.values():
+            prefetcher.submit(filing)
+            prefetcher._reap(wait=True)
+    assert len(prefetcher.finish(lambda filing: True)) == 1
+
+def test_download_counts_bytes(tmp_path):
+    bucket = MagicMock()
+    bucket.get_obj_body.return_value = "<Return>Société</Return>"
+    registry = metrics.reset()
+    assert filings._download_xml_on_thread([("208419458", str(tmp_path), "1")], bucket) == []
+    assert registry.counter("download_bytes_total").value == os.path.getsize(str(tmp_path / "1_public.xml"))
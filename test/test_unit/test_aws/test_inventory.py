@@ -0,0 +1,64 @@
+import gzip
+import json
+import os
+from sqlite3 import Connection, connect
+from typing import List
+
+import pytest
+
+from composer.aws.inventory import BucketInventory, read_manifest
+from composer.aws.s3 import LocalBucket
+
+@pytest.fixture
+def inventory() -> BucketInventory:
+    conn: Connection = connect(":memory:")
+    return BucketInventory.build(conn)
+
+def test_lookup(inventory):
+    inventory.refresh([("b_public.xml", 20, "etag-b"), ("a_public.xml", 10, "etag-a")])
+    assert len(inventory) == 2
+    assert "a_public.xml" in inventory
+    assert "c_public.xml" not in inventory
+    assert inventory.size("b_public.xml") == 20
+    assert inventory.size("c_public.xml") is None
+    assert inventory.etag("a_public.xml") == "etag-a"
+
+def test_refresh_replaces_and_reports_changes(inventory):
+    assert inventory.refresh([("a", 10, "1"), ("b", 20, "2"), ("c", 30, "3")]) == []
+    changed: List[str] = inventory.refresh([("a", 10, "1"), ("b", 25, "2*"), ("d", 40, "4")])
+    assert changed == ["b"]
+    assert "c" not in inventory
+    assert inventory.size("b") == 25
+    assert len(inventory) == 3
+
+def test_local_bucket_objects(tmp_path):
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "1_public.xml").write_bytes(b"<Return/>")
+    ((key, size, etag),) = list(LocalBucket(str(tmp_path)).list_objects())
+    assert (key, size) == ("nested/1_public.xml", 9)
+    os.utime(str(tmp_path / "nested" / "1_public.xml"), ns=(0, 0))
+    assert next(LocalBucket(str(tmp_path)).list_objects())[2] != etag
+
+def _write_report(path, file_format: str = "CSV", schema: str = "Bucket, Key, Size, ETag") -> None:
+    (path / "data").mkdir()
+    with gzip.open(str(path / "data" / "part-0.csv.gz"), "wt") as fh:
+        fh.write('"irs-form-990","index_2011.json","1024","abc"\n')
+        fh.write('"irs-form-990","dir%2F201101389349300010_public.xml","2048","def-2"\n')
+    manifest = {"sourceBucket": "irs-form-990", "fileFormat": file_format, "fileSchema": schema,
+                "files": [{"key": "data/part-0.csv.gz", "size": 0, "MD5checksum": ""}]}
+    (path / "manifest.json").write_text(json.dumps(manifest))
+
+def test_read_manifest(tmp_path):
+    _write_report(tmp_path)
+    objects = list(read_manifest(LocalBucket(str(tmp_path)), "manifest.json"))
+    assert objects == [("index_2011.json", 1024, "abc"), ("dir/201101389349300010_public.xml", 2048, "def-2")]
+
+def test_read_manifest_unsupported(tmp_path):
+    _write_report(tmp_path, file_format="ORC")
+    with pytest.raises(ValueError):
+        list(read_manifest(LocalBucket(str(tmp_path)), "manifest.json"))
+
+def test_read_manifest_without_etags(tmp_path):
+    _write_report(tmp_path, schema="Bucket, Key, Size")
+    with pytest.raises(ValueError):
+        list(read_manifest(LocalBucket(str(tmp_path)), "manifest.json"))
@@ -0,0 +1,89 @@
+import os
+import pickle
+from typing import List
+
+import pytest
+
+import composer.aws.s3 as s3
+from composer.aws.s3 import LocalBucket
+
+@pytest.fixture()
+def root(tmp_path) -> str:
+    (tmp_path / "index_2011.json").write_text('{"Filings2011": []}')
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "1_public.xml").write_bytes("<Return>Société</Return>".encode("utf-8"))
+    return str(tmp_path)
+
+def test_get_obj_body(root):
+    bucket: LocalBucket = LocalBucket(root)
+    assert bucket.get_obj_body("nested/1_public.xml") == "<Return>Société</Return>"
+    assert bucket.get_obj_body("nested/1_public.xml", encoding=None) == "<Return>Société</Return>".encode("utf-8")
+
+def test_missing_object(root):
+    with pytest.raises(FileNotFoundError):
+        LocalBucket(root).get_obj_body("index_2010.json")
+
+def test_exists(root):
+    bucket: LocalBucket = LocalBucket(root)
+    assert bucket.exists("index_2011.json")
+    assert not bucket.exists("index_2010.json")
+    assert not bucket.exists("nested")
+
+def test_list_keys(root):
+    bucket: LocalBucket = LocalBucket(root)
+    assert sorted(bucket.list_keys()) == ["index_2011.json", "nested/1_public.xml"]
+    assert list(bucket.list_keys("nested/")) == ["nested/1_public.xml"]
+
+def test_open_obj_streams(root):
+    with LocalBucket(root).open_obj("nested/1_public.xml") as fh:
+        assert fh.read(8) == b"<Return>"
+
+def test_simulated_latency_and_bandwidth(root, monkeypatch):
+    slept: List[float] = []
+    monkeypatch.setattr(s3.time, "sleep", slept.append)
+    bucket: LocalBucket = LocalBucket(root, latency=0.05, bandwidth=10.0)
+    body: bytes = bucket.get_obj_body("nested/1_public.xml", encoding=None)
+    assert slept[0] == 0.05
+    assert sum(slept[1:]) == pytest.approx(len(body) / 10.0)
+
+def test_picklable(root):
+    bucket: LocalBucket = pickle.loads(pickle.dumps(LocalBucket(root, latency=0.01)))
+    assert bucket.latency == 0.01
+    assert bucket.exists(os.path.join("nested", "1_public.xml"))
+
+@pytest.fixture
+def built_clients(monkeypatch) -> List[tuple]:
+    import boto3
+    built: List[tuple] = []
+    monkeypatch.setattr(s3, "_clients", {})
+    monkeypatch.setattr(boto3, "client", lambda *args, **kwargs: built.append(
+        (kwargs["aws_access_key_id"], kwargs["aws_secret_access_key"])) or object())
+    return built
+
+def test_client_cached_per_credentials(built_clients):
+    assert s3.s3_client() is s3.s3_client()
+    assert s3.s3_client("id", "secret") is s3.s3_client("id", "secret")
+    assert s3.s3_client() is not s3.s3_client("id", "secret")
+    assert built_clients == [(None, None), ("id", "secret")]
+
+def test_client_rebuilt_in_new_process(built_clients, monkeypatch):
+    s3.s3_client()
+    monkeypatch.setattr(s3, "_clients_pid", -1)
+    s3.s3_client()
+    assert len(built_clients) == 2
+
+def test_bucket_pickled_without_client(built_clients, monkeypatch):
+    class StubHandshake:
+        def get_aws_key(self) -> str:
+            return "id"
+
+        def get_aws_secret(self) -> str:
+            return "secret"
+
+    bucket: s3.Bucket = s3.Bucket.build_authenticated(StubHandshake(), "irs-form-990")
+    pickled: bytes = pickle.dumps(bucket)
+    monkeypatch.setattr(s3, "_clients_pid", -1)
+    unpickled: s3.Bucket = pickle.loads(pickled)
+    assert unpickled.name == "irs-form-990"
+    assert unpickled.s3 is not bucket.s3
+    assert built_clients == [("id", "secret"), ("id", "secret")]
@@ -0,0 +1,39 @@
+from typing import List
+
+import pytest
+import sqlite3
+
+from composer.efile.structures.conversions import ConversionLog
+from composer.efile.structures.mdindex import EfileMetadataIndex
+from composer.efile.structures.metadata import FilingMetadata
+
+@pytest.fixture()
+def log(empty_db: sqlite3.Connection) -> ConversionLog:
+    return ConversionLog.build(empty_db)
+
+@pytest.fixture()
+def latest(empty_db: sqlite3.Connection, filing_original, dict_to_standard_filing, filing_original_dict) \
+        -> List[FilingMetadata]:
+    later: FilingMetadata = dict_to_standard_filing(dict(filing_original_dict, TaxPeriod="201112",
+                                                         ObjectId="201203049349300935"))
+    index: EfileMetadataIndex = EfileMetadataIndex.build(empty_db)
+    index.add(filing_original)
+    index.add(later)
+    index.commit()
+    return [filing_original, later]
+
+def test_record(log):
+    log.record(["201120919349300412"], "1")
+    assert log.version_of("201120919349300412") == "1"
+    log.record(["201120919349300412"], "2")
+    assert log.version_of("201120919349300412") == "2"
+    assert log.version_of("201203049349300935") is None
+
+def test_unrecorded_filings_are_stale(log, latest):
+    assert sorted(f.irs_efile_id for f in log.stale("1")) == sorted(f.irs_efile_id for f in latest)
+
+def test_stale_by_version(log, latest):
+    original, later = latest
+    log.record([original.irs_efile_id], "1")
+    log.record([later.irs_efile_id], "2")
+    assert list(log.stale("2")) == [original]
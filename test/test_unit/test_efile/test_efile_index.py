@@ -4,6 +4,7 @@ import pytest
 import sqlite3
 
 from composer.efile.structures.mdindex import EfileMetadataIndex
+from composer.efile.structures.metadata import FilingMetadata
 
 @pytest.fixture()
 def index(empty_db: sqlite3.Connection) -> EfileMetadataIndex:
@@ -152,3 +153,51 @@ def test_commit_clears_staged_dupes(index, filing_original, filing_amended):
     index.commit()
     assert len(index.staged_dupes) == 0
 
+
+def test_commit_eins_commits_only_those_eins(index, filing_original, dict_to_standard_filing, filing_original_dict):
+    other_dict: Dict = dict(filing_original_dict, EIN="123456789", ObjectId="201120919349300999")
+    other: FilingMetadata = dict_to_standard_filing(other_dict)
+    index.add(filing_original)
+    index.add(other)
+    index.commit(["123456789"])
+    assert list(index.latest_filings) == [other]
+    assert list(index.changes) == [("943041314", {"201012": filing_original})]
+
+def test_commit_eins_commits_their_dupes(index, filing_original, filing_amended):
+    index.add(filing_original)
+    index.add(filing_amended)
+    index.commit(["943041314"])
+    assert list(index.duplicates) == [filing_original]
+    assert len(index.staged_dupes) == 0
+
+def test_discard_unstages_change_and_its_dupes(index, filing_original, filing_amended):
+    index.add(filing_original)
+    index.add(filing_amended)
+    index.discard([filing_amended])
+    assert list(index.changes) == []
+    assert len(index.staged_dupes) == 0
+
+def test_discard_keeps_existing_latest(index, filing_original, filing_amended):
+    index.add(filing_original)
+    index.commit()
+    index.add(filing_amended)
+    index.discard([filing_amended])
+    index.commit()
+    assert list(index.latest_filings) == [filing_original]
+    assert list(index.duplicates) == []
+
+def test_is_staged_change(index, filing_original, filing_amended):
+    index.add(filing_original)
+    index.add(filing_amended)
+    assert index.is_staged_change(filing_amended)
+    assert not index.is_staged_change(filing_original)
+
+def test_restage_latest_filing(index, filing_original):
+    index.add(filing_original)
+    index.commit()
+    index.add(filing_original)
+    assert not index.is_staged_change(filing_original)
+    index.restage(filing_original)
+    assert list(index.changes) == [("943041314", {"201012": filing_original})]
+    index.commit()
+    assert list(index.latest_filings) == [filing_original]
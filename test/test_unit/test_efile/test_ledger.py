@@ -0,0 +1,62 @@
+from typing import List
+
+import pytest
+import sqlite3
+
+from composer.efile.structures.ledger import RunLedger, STAGED, DOWNLOADED, CONVERTED, COMPOSED
+from composer.efile.structures.mdindex import EfileMetadataIndex
+from composer.efile.structures.metadata import FilingMetadata
+
+@pytest.fixture()
+def index(empty_db: sqlite3.Connection, filing_original, filing_amended) -> EfileMetadataIndex:
+    md_index: EfileMetadataIndex = EfileMetadataIndex.build(empty_db)
+    md_index.add(filing_original)
+    md_index.add(filing_amended)
+    return md_index
+
+@pytest.fixture()
+def ledger(empty_db: sqlite3.Connection, index: EfileMetadataIndex) -> RunLedger:
+    ledger: RunLedger = RunLedger.build(empty_db)
+    ledger.begin(index, {"xml_cache_dir": "/tmp/xml"})
+    return ledger
+
+def test_new_ledger_not_in_progress(empty_db):
+    assert not RunLedger.build(empty_db).in_progress
+
+def test_begin_in_progress(ledger):
+    assert ledger.in_progress
+    assert ledger.get_state("xml_cache_dir") == "/tmp/xml"
+
+def test_begin_stages_changes(ledger, filing_amended):
+    assert ledger.stages == {filing_amended.irs_efile_id: STAGED}
+
+def test_mark_persists(empty_db, ledger, filing_amended):
+    ledger.mark([filing_amended.irs_efile_id], CONVERTED)
+    reloaded: RunLedger = RunLedger.build(empty_db)
+    assert reloaded.reached(filing_amended.irs_efile_id, DOWNLOADED)
+    assert reloaded.reached(filing_amended.irs_efile_id, CONVERTED)
+    assert not reloaded.reached(filing_amended.irs_efile_id, COMPOSED)
+
+def test_pending_omits_completed(ledger, filing_amended):
+    changes: List = [("943041314", {"201012": filing_amended})]
+    ledger.mark_changes(changes, DOWNLOADED)
+    assert ledger.pending(changes, DOWNLOADED) == []
+    assert ledger.pending(changes, CONVERTED) == changes
+
+def test_restore(empty_db, ledger, filing_original, filing_amended):
+    md_index: EfileMetadataIndex = EfileMetadataIndex.build(empty_db)
+    ledger.restore(md_index)
+    assert list(md_index.changes) == [("943041314", {"201012": filing_amended})]
+    assert md_index.staged_dupes == {filing_original.irs_efile_id: filing_original}
+
+def test_restore_skips_committed(empty_db, ledger):
+    ledger.mark_committed(["943041314"])
+    md_index: EfileMetadataIndex = EfileMetadataIndex.build(empty_db)
+    ledger.restore(md_index)
+    assert list(md_index.changes) == []
+    assert md_index.staged_dupes == {}
+
+def test_clear(ledger):
+    ledger.clear()
+    assert not ledger.in_progress
+    assert ledger.stages == {}
@@ -0,0 +1,66 @@
+import os
+from typing import Dict, List, Tuple
+
+import pytest
+
+from composer.efile.structures.metadata import FilingMetadata
+from composer.efile.structures.plan import ChangePlan, read_plan, temporary_plan
+
+def filing(ein: str, period: str, irs_efile_id: str) -> FilingMetadata:
+    return FilingMetadata("record", irs_efile_id, "dln", ein, period, "org", "990", "2019", "2019", "2019", "url")
+
+CHANGES: List[Tuple[str, Dict[str, FilingMetadata]]] = [
+    ("012345678", {"201612": filing("012345678", "201612", "201703189349301234"),
+                   "201712": filing("012345678", "201712", "201803189349305678")}),
+    ("987654321", {"201806": filing("987654321", "201806", "201903189349300001")}),
+    ("111111111", {"201812": filing("111111111", "201812", "201913189349300002")})
+]
+
+@pytest.fixture()
+def plan(tmp_path) -> ChangePlan:
+    with ChangePlan.write(str(tmp_path / "plan.bin"), CHANGES) as plan:
+        yield plan
+
+def test_len_counts_eins(plan):
+    assert len(plan) == 3
+    assert plan.n_filings == 4
+
+def test_changes_round_trip(plan):
+    expected = [(ein, {period: f.irs_efile_id for period, f in updates.items()}) for ein, updates in CHANGES]
+    assert list(plan.changes(range(len(plan)))) == expected
+
+def test_filings_for_slice(plan):
+    assert list(plan.filings(range(1, 3))) == [("987654321", "201806", "201903189349300001"),
+                                               ("111111111", "201812", "201913189349300002")]
+
+def test_filings_out_of_order(plan):
+    eins: List[str] = [ein for ein, _, _ in plan.filings([2, 0])]
+    assert eins == ["111111111", "012345678", "012345678"]
+
+def test_empty_plan(tmp_path):
+    with ChangePlan.write(str(tmp_path / "plan.bin"), []) as plan:
+        assert len(plan) == 0
+        assert list(plan.changes(range(0))) == []
+
+def test_open_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        ChangePlan.open(str(path))
+
+def test_oversized_field_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ChangePlan.write(str(tmp_path / "plan.bin"), [("0123456789", {"201612": filing("0", "201612", "1")})])
+
+def test_temporary_plan_removed(tmp_path):
+    with temporary_plan(str(tmp_path), CHANGES) as plan:
+        path: str = plan.path
+        assert os.path.exists(path)
+    assert not os.path.exists(path)
+
+def test_read_plan_reuses_handle(tmp_path):
+    with temporary_plan(str(tmp_path), CHANGES) as plan:
+        first: ChangePlan = read_plan(plan.path)
+        assert read_plan(plan.path) is first
+    with temporary_plan(str(tmp_path), CHANGES[:1]) as plan:
+        assert len(read_plan(plan.path)) == 1
@@ -0,0 +1,69 @@
+from typing import Dict, List, Tuple
+
+import pytest
+import sqlite3
+
+from composer.efile.structures.ledger import CONVERTED, COMPOSED, DOWNLOADED
+from composer.efile.structures.metadata import FilingMetadata
+from composer.efile.structures.quarantine import ItemFailure, Quarantine, exclude_failed, expand_failures
+
+@pytest.fixture()
+def changes(filing_original, dict_to_standard_filing, filing_original_dict) \
+        -> List[Tuple[str, Dict[str, FilingMetadata]]]:
+    later: FilingMetadata = dict_to_standard_filing(dict(filing_original_dict, TaxPeriod="201112",
+                                                         ObjectId="201203049349300935"))
+    other: FilingMetadata = dict_to_standard_filing(dict(filing_original_dict, EIN="123456789",
+                                                         ObjectId="201120919349300999"))
+    return [("943041314", {"201012": filing_original, "201112": later}), ("123456789", {"201012": other})]
+
+def failure(stage: str, ein: str, irs_efile_id=None) -> ItemFailure:
+    return ItemFailure(stage, ein, irs_efile_id, "ValueError()", "Traceback")
+
+@pytest.fixture()
+def quarantine(empty_db: sqlite3.Connection) -> Quarantine:
+    return Quarantine.build(empty_db)
+
+def test_capture_records_traceback():
+    try:
+        raise ValueError("Mixed text and tags")
+    except ValueError as e:
+        captured: ItemFailure = ItemFailure.capture(CONVERTED, "943041314", "201120919349300412", e)
+    assert captured.error == "ValueError('Mixed text and tags')"
+    assert "Traceback" in captured.traceback
+
+def test_exclude_failed_filing(changes):
+    remaining = exclude_failed(changes, [failure(DOWNLOADED, "943041314", "201120919349300412")])
+    assert [(ein, sorted(updates)) for ein, updates in remaining] == [("943041314", ["201112"]),
+                                                                      ("123456789", ["201012"])]
+
+def test_exclude_failed_omits_empty_eins(changes):
+    remaining = exclude_failed(changes, [failure(DOWNLOADED, "123456789", "201120919349300999")])
+    assert [ein for ein, _ in remaining] == ["943041314"]
+
+def test_exclude_failed_ein(changes):
+    remaining = exclude_failed(changes, [failure(COMPOSED, "943041314")])
+    assert [ein for ein, _ in remaining] == ["123456789"]
+
+def test_expand_ein_failure_to_every_filing(changes):
+    expanded = expand_failures(changes, [failure(COMPOSED, "943041314")])
+    assert sorted(filing.irs_efile_id for filing, _ in expanded) == ["201120919349300412", "201203049349300935"]
+
+def test_expand_filing_failure(changes, filing_original):
+    expanded = expand_failures(changes, [failure(CONVERTED, "943041314", "201120919349300412")])
+    assert [filing for filing, _ in expanded] == [filing_original]
+
+def test_add_and_iterate(quarantine, filing_original):
+    quarantine.add([(filing_original, failure(CONVERTED, "943041314", filing_original.irs_efile_id))])
+    assert list(quarantine) == [filing_original]
+    assert len(quarantine) == 1
+
+def test_add_again_replaces_error_and_counts_attempts(empty_db, quarantine, filing_original):
+    quarantine.add([(filing_original, failure(DOWNLOADED, "943041314", filing_original.irs_efile_id))])
+    quarantine.add([(filing_original, failure(CONVERTED, "943041314", filing_original.irs_efile_id))])
+    assert [f.stage for f in quarantine.failures()] == [CONVERTED]
+    assert empty_db.execute("SELECT attempts FROM quarantine").fetchone()[0] == 2
+
+def test_release(quarantine, filing_original):
+    quarantine.add([(filing_original, failure(CONVERTED, "943041314", filing_original.irs_efile_id))])
+    quarantine.release([filing_original.irs_efile_id])
+    assert len(quarantine) == 0
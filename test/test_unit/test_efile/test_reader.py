@@ -0,0 +1,87 @@
+import json
+import os
+from typing import Dict, List
+
+import pytest
+
+from composer.efile.compose import TEMPLATE
+from composer.efile.reader import CompositeReader
+from composer.fileio.layout import EINLayout
+from composer.fileio.migrate import MigrateLayout
+from composer.fileio.paths import EINPathManager
+
+def _write(path_mgr: EINPathManager, ein: str, composite: Dict):
+    with path_mgr.open_for_writing(ein, TEMPLATE) as fh:
+        json.dump(composite, fh)
+
+@pytest.fixture()
+def path_mgr(tmp_path) -> EINPathManager:
+    path_mgr: EINPathManager = EINPathManager(str(tmp_path))
+    _write(path_mgr, "123456789", {"201012": {"a": 1}, "201112": {"b": 2}})
+    _write(path_mgr, "987654321", {"201212": {"c": 3}})
+    return path_mgr
+
+@pytest.fixture()
+def reader(path_mgr) -> CompositeReader:
+    return CompositeReader(path_mgr)
+
+def test_get(reader):
+    expected: Dict = {"201012": {"a": 1}, "201112": {"b": 2}}
+    assert reader.get("123456789") == expected
+
+def test_get_periods(reader):
+    expected: Dict = {"201112": {"b": 2}}
+    assert reader.get("123456789", periods=["201112", "209912"]) == expected
+
+def test_get_missing(reader):
+    assert reader.get("000000000") is None
+
+def test_get_cached(reader):
+    first: Dict = reader.get("123456789")
+    second: Dict = reader.get("123456789")
+    assert first is second
+
+def test_get_stale_reloads(reader, path_mgr):
+    reader.get("987654321")
+    _write(path_mgr, "987654321", {"201212": {"c": 3}, "201312": {"d": 4}})
+    assert set(reader.get("987654321").keys()) == {"201212", "201312"}
+
+def test_get_deleted_evicts(reader, path_mgr):
+    reader.get("987654321")
+    os.remove(os.path.join(path_mgr.directory_for("987654321"), TEMPLATE % "987654321"))
+    assert reader.get("987654321") is None
+    assert reader.cache_bytes == 0
+
+def test_cache_bounded_by_bytes(path_mgr):
+    size: int = os.path.getsize(os.path.join(path_mgr.directory_for("123456789"), TEMPLATE % "123456789"))
+    reader: CompositeReader = CompositeReader(path_mgr, max_cache_bytes=size)
+    reader.get("987654321")
+    reader.get("123456789")
+    assert list(reader._cache.keys()) == ["123456789"]
+    assert reader.cache_bytes <= size
+
+def test_get_many(reader):
+    expected: List = [
+        ("987654321", {"201212": {"c": 3}}),
+        ("000000000", None),
+        ("123456789", {"201012": {"a": 1}})
+    ]
+    actual: List = list(reader.get_many(["987654321", "000000000", "123456789"], periods=["201012", "201212"]))
+    assert actual == expected
+
+def test_prefetch_populates_cache(reader):
+    reader.prefetch(["123456789", "987654321"], workers_count=2)
+    assert set(reader._cache.keys()) == {"123456789", "987654321"}
+
+def test_invalidate(reader):
+    reader.get("123456789")
+    reader.invalidate()
+    assert reader.cache_bytes == 0
+    assert len(reader._cache) == 0
+
+def test_follows_layout_migration(path_mgr):
+    reader: CompositeReader = CompositeReader.build(path_mgr.basepath)
+    assert reader.get("987654321") == {"201212": {"c": 3}}
+    MigrateLayout.build(path_mgr.basepath, EINLayout(depth=1, width=2), TEMPLATE)(workers_count=1)
+    assert reader.get("123456789") == {"201012": {"a": 1}, "201112": {"b": 2}}
+    assert reader.path_mgr.layout == EINLayout(depth=1, width=2)
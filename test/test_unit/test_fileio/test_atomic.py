@@ -0,0 +1,50 @@
+import os
+from typing import List
+
+import pytest
+
+from composer.fileio.atomic import AtomicBatchWriter
+
+def _read(path: str) -> str:
+    with open(path) as fh:
+        return fh.read()
+
+def test_not_visible_until_commit(tmp_path):
+    path: str = str(tmp_path / "a.json")
+    writer: AtomicBatchWriter = AtomicBatchWriter(fsync=False)
+    with writer.open(path) as fh:
+        fh.write("new")
+    assert not os.path.exists(path)
+    writer.commit()
+    assert _read(path) == "new"
+
+def test_replaces_existing(tmp_path):
+    path: str = str(tmp_path / "a.json")
+    with open(path, "w") as fh:
+        fh.write("old")
+    with AtomicBatchWriter() as writer:
+        with writer.open(path) as fh:
+            fh.write("new")
+    assert _read(path) == "new"
+    assert os.listdir(str(tmp_path)) == ["a.json"]
+
+def test_commits_when_batch_full(tmp_path):
+    writer: AtomicBatchWriter = AtomicBatchWriter(fsync=False, batch_size=2)
+    for name in ["a", "b"]:
+        with writer.open(str(tmp_path / name)) as fh:
+            fh.write(name)
+    assert sorted(os.listdir(str(tmp_path))) == ["a", "b"]
+
+def test_error_discards_batch(tmp_path):
+    path: str = str(tmp_path / "a.json")
+    with open(path, "w") as fh:
+        fh.write("old")
+    with pytest.raises(RuntimeError):
+        with AtomicBatchWriter() as writer:
+            with writer.open(path) as fh:
+                fh.write("new")
+            with writer.open(str(tmp_path / "b.json")) as fh:
+                fh.write("partial")
+                raise RuntimeError
+    assert _read(path) == "old"
+    assert os.listdir(str(tmp_path)) == ["a.json"]
@@ -0,0 +1,36 @@
+from typing import List
+
+import pytest
+
+from composer.fileio.layout import EINLayout, DEFAULT_LAYOUT, load_layout, save_layout
+from composer.fileio.paths import EINPathManager
+
+def test_default_layout_matches_historical_split():
+    path_mgr: EINPathManager = EINPathManager("/base")
+    assert path_mgr.directory_for("123456789") == "/base/123/456"
+
+def test_split_layout_parts():
+    layout: EINLayout = EINLayout(depth=3, width=2)
+    assert layout.parts_for("123456789") == ["12", "34", "56"]
+
+def test_hashed_layout_parts():
+    layout: EINLayout = EINLayout(depth=2, width=2, hashed=True)
+    parts: List[str] = layout.parts_for("123456789")
+    assert parts == ["25", "f9"]
+
+def test_flat_layout():
+    path_mgr: EINPathManager = EINPathManager("/base", EINLayout(depth=0))
+    assert path_mgr.path_for("123456789", "%s.json") == "/base/123456789.json"
+
+def test_layout_too_long_raises():
+    with pytest.raises(ValueError):
+        EINLayout(depth=4, width=3)
+
+def test_load_missing_layout_is_default(tmp_path):
+    assert load_layout(str(tmp_path)) == DEFAULT_LAYOUT
+
+def test_save_and_load_layout(tmp_path):
+    layout: EINLayout = EINLayout(depth=1, width=4, hashed=True)
+    save_layout(str(tmp_path), layout)
+    assert load_layout(str(tmp_path)) == layout
+    assert EINPathManager.build(str(tmp_path)).layout == layout
@@ -0,0 +1,88 @@
+import json
+import os
+from typing import Dict, List
+
+import pytest
+
+from composer.efile.compose import ComposeEfiles
+from composer.fileio.atomic import AtomicBatchWriter
+from composer.fileio.layout import EINLayout, DEFAULT_LAYOUT, load_layout
+from composer.fileio.migrate import MigrateLayout, MIGRATION_FILENAME, _link_chunk
+from composer.fileio.paths import EINPathManager
+
+TEMPLATE = "%s.json"
+EINS: List[str] = ["123456789", "123456000", "987654321"]
+
+@pytest.fixture()
+def basepath(tmp_path) -> str:
+    path_mgr: EINPathManager = EINPathManager(str(tmp_path))
+    for ein in EINS:
+        with path_mgr.open_for_writing(ein, TEMPLATE) as fh:
+            json.dump({"ein": ein}, fh)
+    return str(tmp_path)
+
+def _read_all(path_mgr: EINPathManager) -> Dict:
+    ret: Dict = {}
+    for ein in EINS:
+        with path_mgr.open_for_reading(ein, TEMPLATE) as fh:
+            ret[ein] = json.load(fh)
+    return ret
+
+def _all_files(basepath: str) -> List[str]:
+    return sorted(os.path.relpath(os.path.join(dirpath, filename), basepath)
+                  for dirpath, _, filenames in os.walk(basepath) for filename in filenames)
+
+def test_migrate(basepath):
+    target: EINLayout = EINLayout(depth=1, width=2, hashed=True)
+    MigrateLayout.build(basepath, target, TEMPLATE)(workers_count=1)
+    assert load_layout(basepath) == target
+    assert _read_all(EINPathManager.build(basepath)) == {ein: {"ein": ein} for ein in EINS}
+    expected: List[str] = sorted([EINPathManager("", target).path_for(ein, TEMPLATE).lstrip("/") for ein in EINS]
+                                 + ["layout.json"])
+    assert _all_files(basepath) == expected
+
+def test_migrate_same_layout_noop(basepath):
+    before: List[str] = _all_files(basepath)
+    MigrateLayout.build(basepath, DEFAULT_LAYOUT, TEMPLATE)(workers_count=1)
+    assert _all_files(basepath) == before
+
+def test_migrate_resumes_interrupted_copy(basepath):
+    target: EINLayout = EINLayout(depth=3, width=3)
+    migrate: MigrateLayout = MigrateLayout.build(basepath, target, TEMPLATE)
+    migrate._write_record()
+    _link_chunk(EINS[:1], EINPathManager(basepath), EINPathManager(basepath, target), TEMPLATE)
+
+    resumed: MigrateLayout = MigrateLayout.build(basepath, target, TEMPLATE)
+    resumed(workers_count=1)
+    assert load_layout(basepath) == target
+    assert not os.path.exists(os.path.join(basepath, MIGRATION_FILENAME))
+    assert _read_all(EINPathManager(basepath, target)) == {ein: {"ein": ein} for ein in EINS}
+    assert not os.path.exists(os.path.join(basepath, "123", "456", "123456789.json"))
+
+def test_migrate_conflicting_target_raises(basepath):
+    MigrateLayout.build(basepath, EINLayout(depth=1, width=3), TEMPLATE)._write_record()
+    with pytest.raises(ValueError):
+        MigrateLayout.build(basepath, EINLayout(depth=1, width=4), TEMPLATE)
+
+def test_link_chunk_relinks_rewritten_file(basepath):
+    source: EINPathManager = EINPathManager(basepath)
+    target: EINPathManager = EINPathManager(basepath, EINLayout(depth=1, width=2))
+    assert _link_chunk(EINS, source, target, TEMPLATE) == len(EINS)
+    writer: AtomicBatchWriter = AtomicBatchWriter(fsync=False)
+    with source.open_for_writing(EINS[0], TEMPLATE, writer) as fh:
+        json.dump({"ein": EINS[0], "updated": True}, fh)
+    writer.commit()
+    assert _link_chunk(EINS, source, target, TEMPLATE) == 1
+    with target.open_for_reading(EINS[0], TEMPLATE) as fh:
+        assert json.load(fh)["updated"]
+
+def test_migrate_keeps_unrelated_empty_directories(basepath):
+    os.makedirs(os.path.join(basepath, "scratch"))
+    MigrateLayout.build(basepath, EINLayout(depth=1, width=2), TEMPLATE)(workers_count=1)
+    assert os.path.isdir(os.path.join(basepath, "scratch"))
+    assert not os.path.exists(os.path.join(basepath, "123"))
+
+def test_update_refused_during_migration(basepath, tmp_path_factory):
+    MigrateLayout.build(basepath, EINLayout(depth=1, width=2), TEMPLATE)._write_record()
+    with pytest.raises(ValueError):
+        ComposeEfiles.build(basepath, str(tmp_path_factory.mktemp("temp")), no_cleanup=False)
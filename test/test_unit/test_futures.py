@@ -0,0 +1,156 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import pytest
+
+import composer.futures as futures
+from composer.futures import _dispatch, _guided_chunks, _current_pool, _process_context, imap_on_thread_pool, \
+    run_on_process_pool, run_on_thread_pool, time_limit, DispatchStalled, ItemTimeout, SharedPool
+
+def _sum(chunk: List[int]) -> int:
+    return sum(chunk)
+
+def _sleep_then_return(chunk: List[float]) -> List[float]:
+    for item in chunk:
+        time.sleep(item)
+    return chunk
+
+def _fail_on_three(chunk: List[int]) -> List[int]:
+    if 3 in chunk:
+        raise ValueError(3)
+    return chunk
+
+def test_guided_chunks_shrink():
+    chunks: List = list(_guided_chunks(list(range(100)), None, 2))
+    sizes: List[int] = [len(chunk) for chunk in chunks]
+    assert sizes == sorted(sizes, reverse=True)
+    assert sizes[0] == 25
+    assert sizes[-1] == 1
+
+def test_guided_chunks_preserve_order():
+    items: List[int] = list(range(1, 50))
+    chunks: List = list(_guided_chunks(items, items, 3))
+    assert [item for chunk in chunks for item in chunk] == items
+
+def test_guided_chunks_by_cost():
+    items: List[int] = [100, 1, 1, 1, 1, 1]
+    chunks: List = list(_guided_chunks(items, items, 1))
+    assert chunks[0] == [100]
+
+def test_guided_chunks_zero_cost_items():
+    assert [item for chunk in _guided_chunks([0] * 4, [1] * 4, 2) for item in chunk] == [0] * 4
+
+def test_run_on_thread_pool_returns_results():
+    results: List[int] = run_on_thread_pool(_sum, list(range(10)), chunk_size=3, workers_count=2)
+    assert sorted(results) == [3, 9, 12, 21]
+
+def test_imap_ordered():
+    items: List[float] = [0.05, 0.0, 0.0, 0.0]
+    results: List = list(imap_on_thread_pool(_sleep_then_return, items, chunk_size=1, workers_count=4, ordered=True))
+    assert results == [[0.05], [0.0], [0.0], [0.0]]
+
+def test_imap_unordered_completion_order():
+    items: List[float] = [0.1, 0.0]
+    results: List = list(imap_on_thread_pool(_sleep_then_return, items, chunk_size=1, workers_count=2))
+    assert results == [[0.0], [0.1]]
+
+def test_imap_raises_first_exception():
+    with pytest.raises(ValueError):
+        run_on_thread_pool(_fail_on_three, list(range(10)), chunk_size=1, workers_count=2)
+
+def test_imap_caps_in_flight():
+    items: List[int] = list(range(20))
+    results: List = list(imap_on_thread_pool(_sum, items, chunk_size=1, workers_count=2, max_in_flight=1,
+                                             ordered=True))
+    assert results == items
+
+def test_largest_first():
+    items: List[int] = [1, 5, 3]
+    results: List = list(imap_on_thread_pool(_sum, items, workers_count=1, max_in_flight=1, cost=lambda item: item,
+                                             largest_first=True, ordered=True))
+    assert results == [5, 3, 1]
+
+def _pid(chunk: List[int]) -> int:
+    return os.getpid()
+
+@pytest.mark.parametrize("start_method", [None, "forkserver"])
+def test_shared_pool_reused_across_stages(start_method):
+    with SharedPool(workers_count=2, start_method=start_method) as pool:
+        first: List[int] = run_on_process_pool(_pid, list(range(20)), chunk_size=1)
+        second: List[int] = run_on_process_pool(_pid, list(range(20)), chunk_size=1)
+    assert len(set(first) | set(second)) <= 2
+    assert os.getpid() not in first
+
+def test_shared_pool_honours_workers_count(monkeypatch):
+    shares: List[int] = []
+    def record_share(executor, func, items, *args, workers_count=1, **kwargs):
+        shares.append(workers_count)
+        yield from []
+    monkeypatch.setattr(futures, "_dispatch", record_share)
+    with SharedPool(workers_count=2) as pool:
+        run_on_process_pool(_pid, list(range(4)))
+        run_on_process_pool(_pid, list(range(4)), workers_count=1)
+        run_on_process_pool(_pid, list(range(4)), workers_count=8)
+    assert shares == [2, 1, 2]
+
+def test_process_context_avoids_fork_from_threads():
+    assert _process_context().get_start_method() == multiprocessing.get_start_method()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(lambda: _process_context().get_start_method()).result() in {"forkserver", "spawn"}
+
+def test_stalled_dispatch_fails(monkeypatch):
+    monkeypatch.setattr(futures, "STALL_TIMEOUT", 0.2)
+    with pytest.raises(DispatchStalled):
+        run_on_process_pool(_sleep_then_return, [0.0, 60.0], chunk_size=1, workers_count=2)
+
+def test_shared_pool_inactive_after_exit():
+    with SharedPool(workers_count=1):
+        pass
+    assert _current_pool() is None
+
+def test_range_items_chunked_as_ranges():
+    chunks = run_on_thread_pool(lambda chunk: chunk, range(100), workers_count=2)
+    assert all(isinstance(chunk, range) for chunk in chunks)
+    assert sorted(i for chunk in chunks for i in chunk) == list(range(100))
+
+def test_time_limit_raises():
+    with pytest.raises(ItemTimeout):
+        with time_limit(0.05):
+            time.sleep(1)
+
+def test_time_limit_none_unbounded():
+    with time_limit(None):
+        time.sleep(0.01)
+
+def test_time_limit_unenforced_off_main_thread():
+    def sleep_briefly(chunk):
+        with time_limit(0.001):
+            time.sleep(0.05)
+        return chunk
+    assert run_on_thread_pool(sleep_briefly, [1], workers_count=1) == [[1]]
+
+def test_speculation_redispatches_straggler(caplog):
+    calls: Dict[int, int] = {}
+    lock = threading.Lock()
+    def straggle_once(chunk: List[int]) -> List[int]:
+        with lock:
+            calls[chunk[0]] = calls.get(chunk[0], 0) + 1
+            first_attempt: bool = calls[chunk[0]] == 1
+        time.sleep(3 if chunk[0] == 5 and first_attempt else 0.01)
+        return chunk
+    executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=4)
+    caplog.set_level(logging.INFO)
+    start: float = time.monotonic()
+    results: List = list(_dispatch(executor, straggle_once, list(range(6)), workers_count=4, chunk_size=1,
+                                   speculate=True, label="test"))
+    elapsed: float = time.monotonic() - start
+    executor.shutdown()
+    assert sorted(r[0] for r in results) == list(range(6))
+    assert elapsed < 2
+    assert calls[5] == 2
+    assert "1 re-dispatched, 1 won by the copy" in caplog.text
@@ -0,0 +1,29 @@
+import subprocess
+import sys
+from typing import List
+
+import pytest
+
+# Dependencies that are slow to import, and which a process should only import once it needs them
+HEAVY_MODULES: List[str] = ["boto3", "botocore", "lxml", "xmljson", "pytz", "mock"]
+
+# Generous ceiling on the time taken to import the CLI, in microseconds, as reported by python -X importtime
+CLI_IMPORT_BUDGET_US: int = 500000
+
+def _heavy_modules_after_import(module: str) -> List[str]:
+    script: str = "import sys, %s; print(' '.join(sorted({m.split('.')[0] for m in sys.modules} & set(%r))))" \
+                  % (module, HEAVY_MODULES)
+    return subprocess.run([sys.executable, "-c", script], check=True, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout.split()
+
+@pytest.mark.parametrize("module", ["composer.cli", "composer.futures", "composer.efile.update",
+                                    "composer.fileio.migrate", "composer.efile.reader"])
+def test_no_heavy_imports(module):
+    assert _heavy_modules_after_import(module) == []
+
+def test_cli_import_within_budget():
+    stderr: str = subprocess.run([sys.executable, "-X", "importtime", "-c", "import composer.cli"], check=True,
+                                 stderr=subprocess.PIPE, universal_newlines=True).stderr
+    cumulative: int = next(int(line.split("|")[1]) for line in stderr.splitlines()
+                           if line.split("|")[-1].strip() == "composer.cli")
+    assert cumulative < CLI_IMPORT_BUDGET_US
@@ -0,0 +1,88 @@
+import json
+import os
+from typing import Dict, List
+
+import pytest
+
+from composer import metrics
+from composer.futures import run_on_process_pool
+from composer.metrics import Histogram, MetricsRegistry, metric_name, registry, reset
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    reset()
+    yield
+    reset()
+
+def _count_items(chunk: List[int]) -> int:
+    registry().counter("work_widgets_total", "Widgets made").inc(len(chunk))
+    registry().histogram("work_widget_seconds").observe(0.01)
+    return os.getpid()
+
+def test_metric_name():
+    assert metric_name("convert (slow lane)") == "convert_slow_lane"
+
+def test_histogram_quantiles():
+    histogram: Histogram = registry().histogram("latency_seconds")
+    for i in range(1, 1001):
+        histogram.observe(i / 1000)
+    assert histogram.quantile(0.5) == pytest.approx(0.5, rel=0.2)
+    assert histogram.quantile(0.99) == pytest.approx(0.99, rel=0.2)
+    assert histogram.quantile(1.0) == 1.0
+
+def test_empty_histogram():
+    assert registry().histogram("latency_seconds").quantile(0.5) is None
+
+def test_kind_conflict():
+    registry().counter("things_total")
+    with pytest.raises(TypeError):
+        registry().gauge("things_total")
+
+def test_drain_and_merge():
+    source: MetricsRegistry = MetricsRegistry()
+    source.counter("work_widgets_total", "Widgets made").inc(3)
+    source.gauge("work_eta_seconds").set(5)
+    source.histogram("work_widget_seconds").observe(0.5)
+    target: MetricsRegistry = MetricsRegistry()
+    target.counter("work_widgets_total").inc(2)
+    target.merge(source.drain())
+    assert source.drain() is None
+    assert target.counter("work_widgets_total").value == 5
+    assert target.gauge("work_eta_seconds").value == 5
+    assert target.histogram("work_widget_seconds").count == 1
+
+def test_report_rates():
+    registry().counter("work_seconds_total").inc(2)
+    registry().counter("work_widgets_total").inc(10)
+    registry().counter("work_slow_seconds_total").inc(5)
+    registry().counter("work_slow_widgets_total").inc(10)
+    registry().counter("loose_widgets_total").inc(1)
+    rates: Dict[str, float] = registry().report()["rates"]
+    assert rates == {"work_widgets_per_second": 5.0, "work_slow_widgets_per_second": 2.0}
+
+def test_worker_metrics_aggregated():
+    pids: List[int] = run_on_process_pool(_count_items, list(range(100)), chunk_size=10, workers_count=2,
+                                          label="work")
+    assert os.getpid() not in pids
+    assert registry().counter("work_widgets_total").value == 100
+    assert registry().histogram("work_widget_seconds").count == 10
+    assert registry().counter("work_items_total").value == 100
+    assert registry().counter("work_seconds_total").value > 0
+
+def test_write(tmp_path):
+    registry().counter("work_widgets_total", "Widgets made").inc(3)
+    registry().histogram("work_widget_seconds").observe(0.5)
+    registry().write(str(tmp_path), "run")
+    with open(os.path.join(str(tmp_path), "run.json")) as fh:
+        assert json.load(fh)["counters"] == {"work_widgets_total": 3.0}
+    with open(os.path.join(str(tmp_path), "run.prom")) as fh:
+        lines: List[str] = fh.read().splitlines()
+    assert "# HELP composer_work_widgets_total Widgets made" in lines
+    assert "composer_work_widgets_total 3.0" in lines
+    assert 'composer_work_widget_seconds_bucket{le="+Inf"} 1' in lines
+    assert "composer_work_widget_seconds_count 1" in lines
+
+def test_registry_replaced_after_fork(monkeypatch):
+    registry().counter("things_total").inc()
+    monkeypatch.setattr(metrics._registry, "pid", -1)
+    assert len(registry().metrics) == 0
@@ -0,0 +1,65 @@
+import os
+import pstats
+import tracemalloc
+from typing import List
+
+import pytest
+
+from composer import profiling
+from composer.futures import run_on_process_pool
+
+@pytest.fixture(autouse=True)
+def disable_profiling(monkeypatch):
+    monkeypatch.setattr(profiling, "_profiles", profiling._Profiles())
+    yield
+    profiling.disable()
+
+def _allocate(chunk: List[int]) -> int:
+    blocks: List[bytes] = [bytes(1024 * 1024) for _ in chunk]
+    return len(blocks)
+
+def _functions(stats: pstats.Stats) -> List[str]:
+    return [function for _, _, function in stats.stats]
+
+def test_disabled_records_nothing():
+    with profiling.profile("work"):
+        _allocate([1])
+    assert profiling.drain() is None
+
+def test_nested_blocks_count_toward_outer_stage():
+    profiling.enable()
+    with profiling.profile("outer"):
+        with profiling.profile("inner"):
+            _allocate([1])
+    assert list(profiling.drain().keys()) == ["outer"]
+
+def test_worker_profiles_merged(tmp_path):
+    profiling.enable()
+    run_on_process_pool(_allocate, list(range(8)), chunk_size=2, workers_count=2, label="work (lane)")
+    profiling.write(str(tmp_path))
+    stats: pstats.Stats = pstats.Stats(os.path.join(str(tmp_path), "work_lane.pstats"))
+    assert "_allocate" in _functions(stats)
+    assert stats.stats[[key for key in stats.stats if key[2] == "_allocate"][0]][1] == 4
+    with open(os.path.join(str(tmp_path), "summary.txt")) as fh:
+        summary: str = fh.read()
+    assert "=== work (lane) ===" in summary
+    peak: int = int(summary.split("Peak traced memory: ")[1].split(" ")[0].replace(",", ""))
+    assert peak >= 2 * 1024 * 1024
+
+def test_disable_stops_tracemalloc():
+    profiling.enable()
+    assert tracemalloc.is_tracing()
+    profiling.disable()
+    assert not tracemalloc.is_tracing()
+    assert not profiling.enabled()
+
+def test_sites_sampled_once_per_stage(monkeypatch):
+    snapshots: List[int] = []
+    take_snapshot = tracemalloc.take_snapshot
+    monkeypatch.setattr(tracemalloc, "take_snapshot", lambda: snapshots.append(1) or take_snapshot())
+    profiling.enable()
+    for _ in range(3):
+        with profiling.profile("work"):
+            _allocate([1])
+        profiling.drain()
+    assert len(snapshots) == 1
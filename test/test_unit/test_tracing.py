@@ -0,0 +1,53 @@
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+import pytest
+
+from composer import tracing
+from composer.futures import run_on_process_pool
+
+@pytest.fixture(autouse=True)
+def disable_tracing(monkeypatch):
+    monkeypatch.setattr(tracing, "_trace", tracing._Trace())
+
+def _traced_work(chunk: List[int]) -> int:
+    for item in chunk:
+        with tracing.span("work", "filing", item=item):
+            time.sleep(0.02 * item)
+    return os.getpid()
+
+def test_disabled_records_nothing():
+    with tracing.span("work", "filing"):
+        pass
+    assert tracing.drain() is None
+
+def test_worker_spans_merged():
+    tracing.enable()
+    pids: List[int] = run_on_process_pool(_traced_work, list(range(1, 9)), chunk_size=2, workers_count=2,
+                                          label="work")
+    events: List[Dict[str, Any]] = tracing.drain()
+    filings: List[Dict[str, Any]] = [e for e in events if e["cat"] == "filing"]
+    assert sorted(e["args"]["item"] for e in filings) == list(range(1, 9))
+    assert {e["pid"] for e in filings} == set(pids)
+    assert len([e for e in events if e["cat"] == "chunk"]) == 4
+    assert [e["name"] for e in events if e["cat"] == "stage"] == ["work"]
+
+def test_summarize():
+    tracing.enable()
+    run_on_process_pool(_traced_work, list(range(1, 9)), chunk_size=2, workers_count=2, label="work")
+    summary: Dict[str, Any] = tracing.summarize(tracing.drain(), n_slowest=3)
+    assert [filing["item"] for filing in summary["slowest_filings"]] == [8, 7, 6]
+    assert 0 < sum(summary["worker_utilization"].values()) <= 2
+
+def test_write(tmp_path):
+    tracing.enable()
+    with tracing.span("work", "filing", item=1):
+        pass
+    path: str = str(tmp_path / "trace.json")
+    tracing.write(path)
+    with open(path) as fh:
+        trace: Dict[str, Any] = json.load(fh)
+    assert [e["ph"] for e in trace["traceEvents"]] == ["M", "X"]
+    assert trace["otherData"]["slowest_filings"][0]["item"] == 1